@@ -0,0 +1,17 @@
+""" Collector of the stack data of several pico gateways, runs on a host with CPython.
+
+    Each pico serves its stack at /data and its alarm events at /events, see
+    Src/html_server.py. The collector polls all nodes concurrently with
+    asyncio, reuses the connections where the node keeps them open, backs off
+    per node and merges the answers into one site model which it serves at
+    /site, /nodes and /events:
+        python -m fleet_collector living_room=192.168.178.40 garage=192.168.178.41
+        python -m fleet_collector --demo 24
+"""
+
+from .http_client import HttpConnection, HttpError
+from .node import Node
+from .site_model import SiteModel
+from .collector import Collector
+from .api import ApiServer
+from .standin import StandInNode
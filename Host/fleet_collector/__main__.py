@@ -0,0 +1,86 @@
+""" python -m fleet_collector [--port 8080] name=host[:port] ...
+    python -m fleet_collector --demo 24 [--duration 20]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+from .collector import Collector
+from .api import ApiServer
+from .http_client import HttpConnection
+from .standin import StandInNode
+
+
+def parse_node(text):
+    name, _, address = text.partition('=')
+    host, _, port = address.partition(':')
+    return name, host, int(port) if port else 80
+
+
+async def demo(nodes, duration, interval, port):
+    """ collector and API against stand-in nodes on localhost: a third closes after each
+        answer like the pico, every eighth is flaky and one is offline from the start
+    """
+    standins = []
+    for i in range(nodes):
+        standin = StandInNode(modules=4 + i % 12, keep_alive=i % 3 != 0, delay=0.01,
+                              failure_rate=0.3 if i % 8 == 7 else 0.0, seed=i)
+        standins.append(await standin.start())
+    collector = Collector()
+    for i, standin in enumerate(standins):
+        collector.add(f'node{i + 1}', '127.0.0.1', standin.port, interval=interval, timeout=1.0)
+    collector.add('offline', '127.0.0.1', 9, interval=interval, timeout=1.0)
+    api = ApiServer(collector.site, '127.0.0.1', port)
+    await api.start()
+    collector.start()
+    await asyncio.sleep(duration)
+    client = HttpConnection('127.0.0.1', api.port)
+    site = await client.get_json('/site')
+    node_status = await client.get_json('/nodes')
+    client.close()
+    await collector.stop()
+    await api.stop()
+    for standin in standins:
+        await standin.stop()
+    latencies = [n['latency_ms'] for n in node_status.values() if n['latency_ms'] is not None]
+    print(json.dumps(site['stack'], indent=1))
+    print(f"nodes fresh {site['nodes_fresh']}, stale {site['nodes_stale']}, offline {site['nodes_offline']}")
+    print(f"polls {sum(n['polls'] for n in node_status.values())}, "
+          f"errors {sum(n['errors'] for n in node_status.values())}, "
+          f"connects {sum(n['connects'] for n in node_status.values())}, "
+          f"reuses {sum(n['reuses'] for n in node_status.values())}")
+    print(f"latency median {statistics.median(latencies):.1f} ms, "
+          f"max {max(n['max_latency_ms'] for n in node_status.values()):.1f} ms")
+
+
+async def run(nodes, port, interval):
+    collector = Collector()
+    for name, host, node_port in nodes:
+        collector.add(name, host, node_port, interval=interval)
+    api = ApiServer(collector.site, port=port)
+    await api.start()
+    collector.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await collector.stop()
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='fleet_collector', description='collects the stacks of several pico gateways')
+    parser.add_argument('nodes', nargs='*', help='name=host[:port] of a pico')
+    parser.add_argument('--port', type=int, default=8080, help='port of the API')
+    parser.add_argument('--interval', type=float, default=5.0, help='poll interval in s')
+    parser.add_argument('--demo', type=int, metavar='N', help='runs against N local stand-in nodes')
+    parser.add_argument('--duration', type=float, default=10.0, help='duration of the demo in s')
+    args = parser.parse_args()
+    if args.demo:
+        asyncio.run(demo(args.demo, args.duration, min(args.interval, 1.0), 0))
+    else:
+        asyncio.run(run([parse_node(node) for node in args.nodes], args.port, args.interval))
+
+
+if __name__ == '__main__':
+    main()
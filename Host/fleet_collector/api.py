@@ -0,0 +1,67 @@
+""" JSON API of the collector: /site, /nodes and /events?since=<site_seq>. """
+
+import asyncio
+import json
+from urllib.parse import urlsplit, parse_qs
+
+
+class ApiServer:
+    """ HTTP/1.1 with keep-alive on asyncio streams """
+
+    def __init__(self, site, host='0.0.0.0', port=8080):
+        self.site = site
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def answer(self, target):
+        url = urlsplit(target)
+        if url.path == '/site':
+            snapshot = self.site.snapshot()
+            del snapshot['nodes']
+            return 200, snapshot
+        if url.path == '/nodes':
+            return 200, self.site.snapshot()['nodes']
+        if url.path == '/events':
+            since = int(parse_qs(url.query).get('since', ['0'])[0])
+            return 200, self.site.events_since(since)
+        return 404, {'error': f'unknown path {url.path}'}
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                parts = line.decode('latin-1').split()
+                close = False
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    if header.lower().startswith(b'connection:') and b'close' in header.lower():
+                        close = True
+                try:
+                    status, data = self.answer(parts[1])
+                except (IndexError, ValueError) as ex:
+                    status, data = 400, {'error': str(ex)}
+                body = json.dumps(data).encode()
+                reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[status]
+                writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # closed by the client or the server stops
+        finally:
+            writer.close()
@@ -0,0 +1,34 @@
+""" Runs the poll loops of the nodes and serves the site model. """
+
+import asyncio
+from .node import Node, POLL_INTERVAL, TIMEOUT
+from .site_model import SiteModel
+
+MAX_CONCURRENT = 32  # requests in flight, bounds the sockets and the load of the host
+
+
+class Collector:
+    """ one task per node, a semaphore bounds the concurrent requests """
+
+    def __init__(self, site=None, max_concurrent=MAX_CONCURRENT):
+        self.site = site if site is not None else SiteModel()
+        self.max_concurrent = max_concurrent
+        self.tasks = []
+
+    def add(self, name, host, port=80, interval=POLL_INTERVAL, timeout=TIMEOUT):
+        node = Node(name, host, port, interval, timeout)
+        self.site.add(node)
+        return node
+
+    def start(self):
+        limit = asyncio.Semaphore(self.max_concurrent)
+        for node in self.site.nodes.values():
+            self.tasks.append(asyncio.create_task(node.run(self.site, limit), name=f'node {node.name}'))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for node in self.site.nodes.values():
+            node.connection.close()
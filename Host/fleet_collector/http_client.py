@@ -0,0 +1,96 @@
+""" Minimal HTTP/1.1 client on asyncio streams with connection reuse.
+
+    A connection stays open while the node answers HTTP/1.1 with a
+    Content-Length and without Connection: close; the pico answers HTTP/1.0
+    and closes, then the next request opens a new connection. A request on a
+    reused connection which the node closed in the meantime is repeated once
+    on a new connection.
+"""
+
+import asyncio
+import json
+
+
+class HttpError(Exception):
+    pass
+
+
+class HttpConnection:
+    """ one connection to a node, requests are sent one after the other """
+
+    def __init__(self, host, port=80, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.connects = 0
+        self.reuses = 0
+
+    async def get_json(self, path):
+        status, body = await self.get(path)
+        if status != 200:
+            raise HttpError(f'{self.host}:{self.port}{path}: status {status}')
+        return json.loads(body)
+
+    async def get(self, path):
+        """ (status, body) of a GET request, the whole request is bounded by the timeout """
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(self.request(path), self.timeout)
+            except BaseException:
+                self.close()  # the state of the connection is unknown after a timeout or an error
+                raise
+
+    async def request(self, path):
+        reused = self.writer is not None
+        if reused:
+            try:
+                result = await self.exchange(path)
+                self.reuses += 1
+                return result
+            except (ConnectionError, asyncio.IncompleteReadError, HttpError):
+                self.close()  # closed by the node while idle, once more on a new connection
+        await self.connect()
+        return await self.exchange(path)
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+
+    async def exchange(self, path):
+        self.writer.write(f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n'.encode())
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise HttpError('connection closed')
+        parts = line.split(None, 2)
+        if len(parts) < 2:
+            raise HttpError(f'invalid status line {line!r}')
+        version = parts[0]
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise HttpError('connection closed in the header')
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get('content-length')
+        keep = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close' and length is not None
+        if length is not None:
+            body = await self.reader.readexactly(int(length))
+        else:
+            body = await self.reader.read()
+        if not keep:
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
@@ -0,0 +1,103 @@
+""" One pico gateway: its poll loop, backoff and freshness. """
+
+import asyncio
+import random
+import time
+from .http_client import HttpConnection
+
+POLL_INTERVAL = 5.0
+TIMEOUT = 2.0
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+JITTER = 0.1  # share of the interval, spreads the polls of the nodes
+LATENCY_GAIN = 0.2
+
+
+class Node:
+    """ polls /data and the new /events of a node """
+
+    def __init__(self, name, host, port=80, interval=POLL_INTERVAL, timeout=TIMEOUT):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.connection = HttpConnection(host, port, timeout)
+        self.data = None  # the last answer of /data
+        self.last_ok = None  # time.monotonic() of the last successful poll
+        self.event_sequence = 0
+        self.failures = 0  # consecutive
+        self.polls = 0
+        self.errors = 0
+        self.last_error = None
+        self.latency = None  # exponential mean in s
+        self.max_latency = 0.0
+
+    def backoff(self):
+        """ delay after the consecutive failures, exponential with jitter """
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+    async def poll(self):
+        """ the stack data and the events since the last poll. /data answers from the last poll
+            of the pico, /events is only asked when LastEvent is beyond the cursor; a LastEvent
+            below the cursor is a rebooted pico whose event sequence starts again at 0
+        @return  (data, events)
+        """
+        data = await self.connection.get_json('/data?command=status')
+        last = (data.get('result') or {}).get('LastEvent') if data.get('ready') else None
+        if last is None:
+            return data, []
+        if last < self.event_sequence:
+            self.event_sequence = 0
+        if last == self.event_sequence:
+            return data, []
+        events = await self.connection.get_json(f'/events?since={self.event_sequence}')
+        if events:
+            self.event_sequence = events[-1]['seq']
+        return data, events
+
+    async def run(self, site, limit):
+        """ polls until cancelled, limit bounds the concurrent requests of all nodes """
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            start = time.monotonic()
+            try:
+                async with limit:
+                    data, events = await self.poll()
+            except Exception as ex:
+                self.failures += 1
+                self.errors += 1
+                self.last_error = f'{type(ex).__name__}: {ex}'
+                site.failed(self)
+                await asyncio.sleep(self.backoff())
+                continue
+            latency = time.monotonic() - start
+            self.latency = latency if self.latency is None else self.latency + LATENCY_GAIN * (latency - self.latency)
+            self.max_latency = max(self.max_latency, latency)
+            self.failures = 0
+            self.polls += 1
+            self.data = data
+            self.last_ok = time.monotonic()
+            site.update(self, events)
+            await asyncio.sleep(max(0.0, self.interval - latency) * random.uniform(1 - JITTER, 1 + JITTER))
+
+    def age(self, now=None):
+        """ seconds since the last successful poll, None before the first """
+        if self.last_ok is None:
+            return None
+        return (now if now is not None else time.monotonic()) - self.last_ok
+
+    def status(self, now=None):
+        age = self.age(now)
+        return {
+            'host': f'{self.host}:{self.port}',
+            'age_s': None if age is None else round(age, 1),
+            'polls': self.polls,
+            'errors': self.errors,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'latency_ms': None if self.latency is None else round(self.latency * 1000, 1),
+            'max_latency_ms': round(self.max_latency * 1000, 1),
+            'connects': self.connection.connects,
+            'reuses': self.connection.reuses,
+        }
@@ -0,0 +1,91 @@
+""" Site-wide stack model merged from the Calculated data of the nodes. """
+
+import collections
+import time
+
+FRESH = 'fresh'
+STALE = 'stale'
+OFFLINE = 'offline'
+STALE_AFTER = 60.0  # s without an answer until a node leaves the totals
+EVENT_CAPACITY = 1000
+
+# summed over the nodes
+SUM_KEYS = ('RemainingEnergy_kWh', 'Capacity_kWh', 'RemainingCapacity_Ah', 'TotalCapacity_Ah',
+            'Charging_Watt', 'Current_Amp', 'ActiveAlarms', 'StaleModules',
+            'ChargedDay_kWh', 'DischargedDay_kWh', 'ChargedMonth_kWh', 'DischargedMonth_kWh',
+            'ChargedLifetime_kWh', 'DischargedLifetime_kWh')
+# extreme over the nodes, with the node and the location on the node
+MIN_KEYS = ('MinimumCellVoltage', 'MinimumTemperature')
+MAX_KEYS = ('MaximumCellVoltage', 'MaximumTemperature')
+
+
+class SiteModel:
+    """ the nodes, their freshness and the merged stack """
+
+    def __init__(self, stale_after=STALE_AFTER, event_capacity=EVENT_CAPACITY):
+        self.stale_after = stale_after
+        self.nodes = {}
+        self.events = collections.deque(maxlen=event_capacity)
+        self.event_sequence = 0
+        self.updates = 0
+
+    def add(self, node):
+        self.nodes[node.name] = node
+
+    def update(self, node, events=()):
+        """ a successful poll of the node """
+        self.updates += 1
+        for event in events:
+            self.event_sequence += 1
+            self.events.append(dict(event, node=node.name, site_seq=self.event_sequence))
+
+    def failed(self, node):
+        pass  # the node keeps its last data until it becomes stale
+
+    def freshness(self, node, now):
+        age = node.age(now)
+        if age is None or age > self.stale_after:
+            return OFFLINE
+        if age <= 2 * node.interval + node.connection.timeout:
+            return FRESH
+        return STALE
+
+    def snapshot(self):
+        """ the merged stack of the fresh and stale nodes and the state of every node """
+        now = time.monotonic()
+        totals = dict.fromkeys(SUM_KEYS, 0)
+        extremes = {}
+        counts = {FRESH: 0, STALE: 0, OFFLINE: 0}
+        nodes = {}
+        for name, node in self.nodes.items():
+            state = self.freshness(node, now)
+            counts[state] += 1
+            status = node.status(now)
+            status['state'] = state
+            nodes[name] = status
+            if state == OFFLINE or not node.data:
+                continue
+            calculated = node.data.get('result') or {}
+            for key in SUM_KEYS:
+                value = calculated.get(key)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] += value
+            for keys, better in ((MIN_KEYS, lambda a, b: a < b), (MAX_KEYS, lambda a, b: a > b)):
+                for key in keys:
+                    value = calculated.get(key)
+                    if value is None:
+                        continue
+                    if key not in extremes or better(value, extremes[key]['value']):
+                        extremes[key] = {'value': value, 'node': name, 'at': calculated.get(key + 'At')}
+        for key in ('RemainingEnergy_kWh', 'Capacity_kWh', 'RemainingCapacity_Ah', 'TotalCapacity_Ah',
+                    'Charging_Watt', 'Current_Amp'):
+            totals[key] = round(totals[key], 3)
+        if totals['TotalCapacity_Ah']:
+            totals['Remaining_%'] = round(100 * totals['RemainingCapacity_Ah'] / totals['TotalCapacity_Ah'], 1)
+        else:
+            totals['Remaining_%'] = 0
+        return {'nodes_fresh': counts[FRESH], 'nodes_stale': counts[STALE], 'nodes_offline': counts[OFFLINE],
+                'stack': totals, 'extremes': extremes, 'nodes': nodes}
+
+    def events_since(self, sequence=0):
+        return [event for event in self.events if event['site_seq'] > sequence]
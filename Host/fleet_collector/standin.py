@@ -0,0 +1,108 @@
+""" Stand-in of a pico gateway for tests and demos of the collector.
+
+    Serves /data?command=status and /events?since=<seq> like html_server
+    with a simulated stack. keep_alive=False answers HTTP/1.0 and closes the
+    connection like the pico; delay and failure_rate make a slow or flaky node.
+"""
+
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit, parse_qs
+
+
+class StandInNode:
+    """ a simulated stack of modules behind an asyncio HTTP server """
+
+    def __init__(self, modules=8, keep_alive=True, delay=0.0, failure_rate=0.0, seed=None):
+        self.modules = modules
+        self.keep_alive = keep_alive
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.remaining_ah = 0.8 * 100 * modules
+        self.current = 10.0 * modules
+        self.events = []
+        self.requests = 0
+        self.connections = 0
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.serve, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def calculated(self):
+        self.current = max(-50.0 * self.modules, min(50.0 * self.modules, self.current + self.random.uniform(-5, 5)))
+        self.remaining_ah = max(0.0, min(100.0 * self.modules, self.remaining_ah + self.current / 720))
+        voltage = 48.0 + 4.0 * self.remaining_ah / (100.0 * self.modules)
+        if self.random.random() < 0.02:
+            self.events.append({'seq': len(self.events) + 1, 'time': int(time.time() * 1000),
+                                'module': self.random.randint(1, self.modules), 'name': 'ChargeOverCurrent',
+                                'transition': 'raised', 'value': True, 'kind': 'alarm'})
+        cell = voltage / 15
+        return {
+            'Remaining_%': round(100 * self.remaining_ah / (100.0 * self.modules), 1),
+            'RemainingEnergy_kWh': round(self.remaining_ah * voltage / 1000, 3),
+            'Capacity_kWh': round(100.0 * self.modules * voltage / 1000, 3),
+            'RemainingCapacity_Ah': round(self.remaining_ah, 1),
+            'TotalCapacity_Ah': 100.0 * self.modules,
+            'Charging_Watt': round(self.current * voltage, 1),
+            'Current_Amp': round(self.current, 1),
+            'ActiveAlarms': 0,
+            'LastEvent': len(self.events),
+            'MinimumCellVoltage': round(cell - self.random.uniform(0, 0.02), 3),
+            'MinimumCellVoltageAt': f'{self.random.randint(1, self.modules)}.{self.random.randint(1, 15)}',
+            'MaximumCellVoltage': round(cell + self.random.uniform(0, 0.02), 3),
+            'MaximumCellVoltageAt': f'{self.random.randint(1, self.modules)}.{self.random.randint(1, 15)}',
+            'MinimumTemperature': round(self.random.uniform(18, 21), 1),
+            'MaximumTemperature': round(self.random.uniform(22, 26), 1),
+            'StaleModules': 0,
+            'Timestamp': int(time.time() * 1000),
+        }
+
+    def answer(self, target):
+        url = urlsplit(target)
+        if url.path == '/data':
+            return {'command': 'status', 'battery': 1, 'ready': True, 'commands': ['status'],
+                    'modules': self.modules, 'result': self.calculated()}
+        if url.path == '/events':
+            since = int(parse_qs(url.query).get('since', ['0'])[0])
+            return self.events[since:]
+        return None
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay * self.random.uniform(0.5, 1.5))
+                if self.random.random() < self.failure_rate:
+                    break  # drops the connection without an answer
+                data = self.answer(line.split()[1].decode())
+                status = '200 OK' if data is not None else '404 Not Found'
+                body = json.dumps(data).encode()
+                if self.keep_alive:
+                    head = f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'
+                else:
+                    head = f'HTTP/1.0 {status}\r\nContent-type: application/json\r\n\r\n'
+                writer.write(head.encode() + body)
+                await writer.drain()
+                if not self.keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # closed by the client or the server stops
+        finally:
+            writer.close()
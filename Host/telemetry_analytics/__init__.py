@@ -0,0 +1,16 @@
+""" Batch analytics of the telemetry history of a stack, runs on a host with CPython and NumPy.
+
+    The history is a .npy file of structured records, one per poll, memory
+    mapped so that weeks of per-cell data do not need to fit into the RAM.
+    It is converted from the bus captures of the pico, see Src/bus_capture.py.
+    The reports run vectorised over blocks of records in one pass:
+        python -m telemetry_analytics convert bus.cap history.npy
+        python -m telemetry_analytics report history.npy --bucket 3600
+        python -m telemetry_analytics bench --days 30
+"""
+
+from .history import history_dtype, create_history, open_history, record_of
+from .capture import convert_capture
+from .reports import (ImbalanceTrend, TemperatureDistribution, CycleCounter, SocHistogram,
+                      default_reports, analyse)
+from .synthetic import synthetic_history
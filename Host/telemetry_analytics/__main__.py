@@ -0,0 +1,91 @@
+""" python -m telemetry_analytics convert capture history.npy [--end-ms MS] [--group G]
+    python -m telemetry_analytics report history.npy [--bucket S]
+    python -m telemetry_analytics bench [--days 30] [--interval 1] [--keep]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from .capture import convert_capture
+from .history import open_history
+from .reports import default_reports, analyse
+from .synthetic import synthetic_history
+
+
+def to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value)} is not serializable')
+
+
+def summary(results):
+    """ the reports without the long arrays """
+    imbalance = results['imbalance']
+    return {'imbalance': {'buckets': len(imbalance['mean_mV']),
+                          'first_mean_mV': round(float(imbalance['mean_mV'][0]), 1) if len(imbalance['mean_mV']) else None,
+                          'last_mean_mV': round(float(imbalance['mean_mV'][-1]), 1) if len(imbalance['mean_mV']) else None,
+                          'max_mV': float(imbalance['max_mV'].max()) if len(imbalance['max_mV']) else None,
+                          'lowest_cells': imbalance['lowest_cells']},
+            'temperature': results['temperature']['modules'],
+            'cycles': results['cycles'],
+            'soc': {key: value for key, value in results['soc'].items() if key.startswith('stack')}}
+
+
+def bench(days, interval, keep):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'history.npy')
+    start = time.perf_counter()
+    history = synthetic_history(path, days, interval)
+    print(f'{len(history)} records of 15x16 cells, {os.path.getsize(path) / 1e9:.2f} GB, '
+          f'written in {time.perf_counter() - start:.1f} s')
+    del history
+    history = open_history(path)
+    start = time.perf_counter()
+    results = analyse(history)
+    duration = time.perf_counter() - start
+    print(json.dumps(summary(results), indent=1, default=to_json))
+    print(f'4 reports over {days} days of {interval} s data: {duration:.1f} s, '
+          f'{len(history) / duration / 1e6:.2f} M records/s')
+    del history
+    if keep:
+        print(path)
+    else:
+        os.remove(path)
+        os.rmdir(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='telemetry_analytics', description='reports over the telemetry history')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='bus capture of the pico to a history file')
+    convert.add_argument('capture')
+    convert.add_argument('history')
+    convert.add_argument('--end-ms', type=int, help='UTC in ms of the end of the capture, default its mtime')
+    convert.add_argument('--group', type=int, default=0)
+    report = commands.add_parser('report', help='reports of a history file as JSON')
+    report.add_argument('history')
+    report.add_argument('--bucket', type=int, default=3600, help='imbalance bucket in s')
+    report.add_argument('--full', action='store_true', help='with the histograms and the imbalance per bucket')
+    benchmark = commands.add_parser('bench', help='reports over a synthetic history')
+    benchmark.add_argument('--days', type=int, default=30)
+    benchmark.add_argument('--interval', type=int, default=1, help='s between the records')
+    benchmark.add_argument('--keep', action='store_true', help='keeps the history file')
+    args = parser.parse_args()
+    if args.command == 'convert':
+        history = convert_capture(args.capture, args.history, args.end_ms, args.group)
+        print(f'{len(history)} records written to {args.history}')
+    elif args.command == 'report':
+        history = open_history(args.history)
+        results = analyse(history, default_reports(history, args.bucket))
+        print(json.dumps(results if args.full else summary(results), indent=1, default=to_json))
+    else:
+        bench(args.days, args.interval, args.keep)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+""" Conversion of the bus captures of the pico (Src/bus_capture.py) into a history.
+
+    The analog answers are decoded with the decoders of the pico, single
+    module answers as well as the answers for all packs. A record of the
+    history starts with the first module of a poll, the module numbers of a
+    poll ascend. The capture holds only the time between its records, the
+    records are placed so that the capture ends at `end_ms`, by default the
+    modification time of the capture file.
+"""
+
+import os
+import sys
+from .history import MODULES, CELLS, TEMPERATURES, create_history, record_of
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'Src')
+ANALOG_CID2 = 0x42
+
+
+def pico_modules():
+    """ imports the decoder and the capture reader of the pico sources """
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+    import host_compat
+    from bus_capture import read_capture, TX, RX
+    from pylontech_decode import PylontechDecode
+    return read_capture, TX, RX, PylontechDecode
+
+
+def analog_answers(capture_path, group=0):
+    """ generator of (elapsed ms, module index, analog record) of the answers in a capture """
+    read_capture, TX, RX, PylontechDecode = pico_modules()
+    decode = PylontechDecode()
+    elapsed_us = 0
+    request = None
+    for direction, delta, frame in read_capture(capture_path):
+        elapsed_us += delta
+        if direction == TX:
+            request = frame
+            continue
+        if direction != RX or request is None or int(request[7:9], 16) != ANALOG_CID2:
+            continue
+        bulk = request[13:17].upper() == b'02FF'
+        request = None
+        decode.decode_header(frame[1:-1])
+        if decode.data['RTN'] != 0:
+            continue
+        if bulk:
+            for batt, analog in enumerate(decode.decodeAnalogValues()):
+                yield elapsed_us // 1000, batt, analog
+        else:
+            yield elapsed_us // 1000, decode.data['ADR'] - 2 - (group << 4), decode.decodeAnalogValue()
+
+
+def convert_capture(capture_path, history_path, end_ms=None, group=0,
+                    modules=MODULES, cells=CELLS, temperatures=TEMPERATURES):
+    """ writes the analog answers of a capture as history file
+    @return  the history, memory mapped
+    """
+    polls = []
+    last_batt = None
+    for elapsed, batt, analog in analog_answers(capture_path, group):
+        if not 0 <= batt < modules:
+            continue
+        if last_batt is None or batt <= last_batt:
+            polls.append((elapsed, []))
+        polls[-1][1].append((batt, analog))
+        last_batt = batt
+    if end_ms is None:
+        end_ms = int(os.path.getmtime(capture_path) * 1000)
+    start_ms = end_ms - (polls[-1][0] if polls else 0)
+    history = create_history(history_path, len(polls), modules, cells, temperatures)
+    for i, (elapsed, answers) in enumerate(polls):
+        row = history[i]
+        row['timestamp'] = start_ms + elapsed
+        for batt, analog in answers:
+            record_of(row, batt, analog)
+    history.flush()
+    return history
+
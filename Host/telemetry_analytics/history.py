@@ -0,0 +1,64 @@
+""" Telemetry history as a structured NumPy array in a .npy file.
+
+    One record per poll of the stack, the values as sent by the batteries,
+    integers in their protocol units:
+        timestamp     int64    UTC in ms
+        current       int16    per module, 0.1 A, charge positive
+        voltage       uint16   per module, mV
+        remaining     uint32   per module, mAh, 0 if the module did not answer
+        capacity      uint32   per module, mAh, 0 if the module did not answer
+        cycles        uint16   per module, CycleNumber
+        cells         uint16   per module and cell, mV, 0 for a missing cell
+        temperatures  int16    per module and sensor, 0.1 degC, MISSING_TEMPERATURE if missing
+    The file is opened memory mapped, the reports read it block by block.
+"""
+
+import numpy as np
+
+MODULES = 15
+CELLS = 16
+TEMPERATURES = 6
+MISSING_TEMPERATURE = -32768
+
+
+def history_dtype(modules=MODULES, cells=CELLS, temperatures=TEMPERATURES):
+    return np.dtype([('timestamp', '<i8'),
+                     ('current', '<i2', (modules,)),
+                     ('voltage', '<u2', (modules,)),
+                     ('remaining', '<u4', (modules,)),
+                     ('capacity', '<u4', (modules,)),
+                     ('cycles', '<u2', (modules,)),
+                     ('cells', '<u2', (modules, cells)),
+                     ('temperatures', '<i2', (modules, temperatures))])
+
+
+def shape_of(history):
+    """ (modules, cells, temperatures) of a history """
+    modules, cells = history.dtype['cells'].shape
+    return modules, cells, history.dtype['temperatures'].shape[1]
+
+
+def create_history(path, samples, modules=MODULES, cells=CELLS, temperatures=TEMPERATURES):
+    """ a new history file of samples records, memory mapped for writing """
+    history = np.lib.format.open_memmap(path, mode='w+', dtype=history_dtype(modules, cells, temperatures),
+                                        shape=(samples,))
+    history['temperatures'] = MISSING_TEMPERATURE
+    return history
+
+
+def open_history(path):
+    """ a history file memory mapped read only, no record is read before it is used """
+    return np.load(path, mmap_mode='r')
+
+
+def record_of(row, batt, analog):
+    """ copies a decoded analog record (see pylontech_registry.ANALOG) into module batt of a record """
+    cells = analog['CellVoltages'][:row['cells'].shape[1]]
+    temperatures = analog['Temperatures'][:row['temperatures'].shape[1]]
+    row['current'][batt] = int(round(analog['Current'] * 10))
+    row['voltage'][batt] = int(round(analog['Voltage'] * 1000))
+    row['remaining'][batt] = int(round(analog['RemainingCapacity'] * 1000))
+    row['capacity'][batt] = int(round(analog['ModuleCapacity'] * 1000))
+    row['cycles'][batt] = analog['CycleNumber']
+    row['cells'][batt, :len(cells)] = np.round(np.asarray(cells) * 1000)
+    row['temperatures'][batt, :len(temperatures)] = np.round(np.asarray(temperatures) * 10)
@@ -0,0 +1,202 @@
+""" Vectorised reports over a telemetry history.
+
+    Each report is an accumulator: add() takes a block of records, result()
+    returns the report. analyse() reads the memory mapped history once,
+    BLOCK records at a time, and feeds every block to all reports, so the
+    memory stays at a few blocks however long the history is.
+    - ImbalanceTrend          mean and maximum cell imbalance per time bucket, the cells most often lowest
+    - TemperatureDistribution histogram, extremes and percentiles of the temperatures per module
+    - CycleCounter            cycles per module from the CycleNumber deltas
+    - SocHistogram            time at state of charge per module and of the stack
+"""
+
+import numpy as np
+from .history import shape_of
+
+BLOCK = 65536  # records, about 40 MB of a stack of 15 modules with 16 cells
+
+
+class ImbalanceTrend:
+    """ max - min of the cell voltages of the stack in mV, per bucket of bucket_s """
+
+    def __init__(self, start_ms, end_ms, modules, cells, bucket_s=3600, top=5):
+        self.start_ms = start_ms
+        self.bucket_ms = bucket_s * 1000
+        self.top = top
+        buckets = (end_ms - start_ms) // self.bucket_ms + 1
+        self.sum = np.zeros(buckets)
+        self.max = np.zeros(buckets)
+        self.count = np.zeros(buckets, dtype=np.int64)
+        self.lowest = np.zeros(modules * cells, dtype=np.int64)
+        self.cells = cells
+
+    def add(self, block):
+        flat = block['cells'].reshape(len(block), -1)
+        present = flat > 0
+        valid = present.any(axis=1)
+        if not valid.all():
+            flat = flat[valid]
+            present = present[valid]
+            block = block[valid]
+        if not len(block):
+            return
+        v_max = flat.max(axis=1)
+        low = np.where(present, flat, np.uint16(0xffff))
+        lowest = low.argmin(axis=1)
+        imbalance = v_max.astype(np.int32) - low[np.arange(len(low)), lowest]
+        self.lowest += np.bincount(lowest, minlength=len(self.lowest))
+        bucket = (block['timestamp'] - self.start_ms) // self.bucket_ms
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+        ids = bucket[starts]
+        self.sum[ids] += np.add.reduceat(imbalance, starts)
+        self.max[ids] = np.maximum(self.max[ids], np.maximum.reduceat(imbalance, starts))
+        self.count[ids] += np.diff(np.append(starts, len(bucket)))
+
+    def result(self):
+        filled = self.count > 0
+        mean = np.zeros_like(self.sum)
+        mean[filled] = self.sum[filled] / self.count[filled]
+        order = np.argsort(self.lowest)[::-1][:self.top]
+        total = max(int(self.count.sum()), 1)
+        return {'bucket_start_ms': (self.start_ms + np.arange(len(self.sum)) * self.bucket_ms)[filled],
+                'mean_mV': mean[filled],
+                'max_mV': self.max[filled],
+                'samples': self.count[filled],
+                'lowest_cells': [(f'{i // self.cells + 1}.{i % self.cells + 1}', round(self.lowest[i] / total, 3))
+                                 for i in order if self.lowest[i]]}
+
+
+class TemperatureDistribution:
+    """ histogram of the temperatures per module in the 0.1 degC of the protocol from LOW to HIGH,
+        min, max, mean and percentiles are taken from it, the result has bins of step degC
+    """
+    LOW = -400
+    HIGH = 1000
+
+    def __init__(self, modules, low=-20, high=70, step=1):
+        self.low = low
+        self.high = high
+        self.step = step
+        self.modules = modules
+        self.width = self.HIGH - self.LOW + 2  # bin 0 holds the missing values and those below LOW
+        self.offsets = (np.arange(modules, dtype=np.int32) * self.width)[:, None]
+        self.counts = np.zeros(modules * self.width, dtype=np.int64)
+
+    def add(self, block):
+        index = block['temperatures'].astype(np.int32)
+        index -= self.LOW - 1
+        np.clip(index, 0, self.width - 1, out=index)
+        index += self.offsets
+        self.counts += np.bincount(index.ravel(), minlength=len(self.counts))
+
+    def result(self):
+        fine = self.counts.reshape(self.modules, self.width)[:, 1:]
+        values = np.arange(self.LOW, self.HIGH + 1) / 10
+        edges = np.arange(self.low, self.high + self.step, self.step)
+        first = self.low * 10 - self.LOW
+        counts = np.add.reduceat(fine[:, first:first + (len(edges) - 1) * self.step * 10],
+                                 np.arange(0, (len(edges) - 1) * self.step * 10, self.step * 10), axis=1)
+        modules = {}
+        for m in range(self.modules):
+            n = fine[m].sum()
+            if not n:
+                continue
+            present = np.flatnonzero(fine[m])
+            p5, p50, p95 = values[np.searchsorted(np.cumsum(fine[m]), np.array((0.05, 0.5, 0.95)) * n)]
+            modules[str(m + 1)] = {'min': float(values[present[0]]), 'max': float(values[present[-1]]),
+                                   'mean': round(float((fine[m] * values).sum() / n), 1),
+                                   'p5': float(p5), 'p50': float(p50), 'p95': float(p95)}
+        return {'edges': edges, 'counts': counts, 'modules': modules}
+
+
+class CycleCounter:
+    """ cycles per module: the sum of the increments of CycleNumber, a decrement is a replaced module """
+
+    def __init__(self, modules):
+        self.last = np.zeros(modules, dtype=np.int64)
+        self.seen = np.zeros(modules, dtype=bool)
+        self.first = np.zeros(modules, dtype=np.int64)
+        self.cycles = np.zeros(modules, dtype=np.int64)
+        self.resets = np.zeros(modules, dtype=np.int64)
+        self.start_ms = None
+        self.end_ms = None
+
+    def add(self, block):
+        if self.start_ms is None:
+            self.start_ms = int(block['timestamp'][0])
+        self.end_ms = int(block['timestamp'][-1])
+        cycles = block['cycles'].astype(np.int64)
+        answered = block['capacity'] > 0
+        for m in np.flatnonzero(answered.any(axis=0)):
+            values = cycles[answered[:, m], m]
+            if not self.seen[m]:
+                self.first[m] = values[0]
+                self.last[m] = values[0]
+                self.seen[m] = True
+            delta = np.diff(values, prepend=self.last[m])
+            self.cycles[m] += delta[delta > 0].sum()
+            self.resets[m] += np.count_nonzero(delta < 0)
+            self.last[m] = values[-1]
+
+    def result(self):
+        days = max((self.end_ms or 0) - (self.start_ms or 0), 1) / 86400000
+        return {str(m + 1): {'first': int(self.first[m]), 'last': int(self.last[m]),
+                             'cycles': int(self.cycles[m]), 'resets': int(self.resets[m]),
+                             'cycles_per_30_days': round(self.cycles[m] * 30 / days, 1)}
+                for m in np.flatnonzero(self.seen)}
+
+
+class SocHistogram:
+    """ samples per state of charge bin of step %, per module and of the stack (last row) """
+
+    def __init__(self, modules, step=5):
+        self.step = step
+        self.bins = 100 // step + 1  # the last bin is 100 %
+        self.modules = modules
+        self.counts = np.zeros((modules + 1, self.bins), dtype=np.int64)
+
+    def add(self, block):
+        remaining = block['remaining'].astype(np.int64)
+        capacity = block['capacity'].astype(np.int64)
+        answered = capacity > 0
+        soc = np.zeros(remaining.shape, dtype=np.int64)
+        np.floor_divide(remaining * 100, capacity, out=soc, where=answered)
+        stack_capacity = capacity.sum(axis=1)
+        stack = remaining.sum(axis=1) * 100 // np.maximum(stack_capacity, 1)
+        index = np.minimum(np.column_stack((soc, stack)) // self.step, self.bins - 1)
+        index += (np.arange(self.modules + 1) * self.bins)[None, :]
+        valid = np.column_stack((answered, stack_capacity > 0))
+        self.counts += np.bincount(index[valid], minlength=(self.modules + 1) * self.bins).reshape(self.counts.shape)
+
+    def result(self):
+        result = {'edges': np.arange(self.bins) * self.step, 'counts': self.counts}
+        total = self.counts[-1].sum()
+        if total:
+            low = 10 // self.step
+            high = 90 // self.step
+            result['stack_below_10'] = round(self.counts[-1, :low].sum() / total, 3)
+            result['stack_above_90'] = round(self.counts[-1, high:].sum() / total, 3)
+        return result
+
+
+def default_reports(history, bucket_s=3600):
+    modules, cells, _ = shape_of(history)
+    start_ms = int(history['timestamp'][0]) if len(history) else 0
+    end_ms = int(history['timestamp'][-1]) if len(history) else 0
+    return {'imbalance': ImbalanceTrend(start_ms, end_ms, modules, cells, bucket_s),
+            'temperature': TemperatureDistribution(modules),
+            'cycles': CycleCounter(modules),
+            'soc': SocHistogram(modules)}
+
+
+def analyse(history, reports=None, block=BLOCK):
+    """ one pass over the history, ordered by timestamp, through all reports
+    @return  dict name -> result of the report
+    """
+    if reports is None:
+        reports = default_reports(history)
+    for start in range(0, len(history), block):
+        records = np.asarray(history[start:start + block])  # reads the block from the file once
+        for report in reports.values():
+            report.add(records)
+    return {name: report.result() for name, report in reports.items()}
@@ -0,0 +1,42 @@
+""" Synthetic history of a stack for the benchmark: one charge and one discharge per day,
+    cells with a small spread, one weak cell which drifts low, temperatures following the load.
+"""
+
+import numpy as np
+from .history import create_history, TEMPERATURES
+
+DAY_MS = 86400000
+
+
+def synthetic_history(path, days=30, interval_s=1, modules=15, cells=16, start_ms=1700000000000, block=86400,
+                      seed=1):
+    """ writes days of records every interval_s into a history file
+    @return  the history, memory mapped
+    """
+    rng = np.random.default_rng(seed)
+    samples = days * 86400 // interval_s
+    history = create_history(path, samples, modules, cells, TEMPERATURES)
+    spread = rng.normal(0, 3, (modules, cells))
+    capacity = 50000 + 50000 * (np.arange(modules) % 2)  # US2000 and US5000 modules
+    for start in range(0, samples, block):
+        n = min(block, samples - start)
+        t = start_ms + (start + np.arange(n)) * interval_s * 1000
+        phase = (t % DAY_MS) / DAY_MS * 2 * np.pi
+        soc = 0.5 - 0.45 * np.cos(phase)  # empty in the morning, full in the evening
+        current = (np.sin(phase) * 250).astype(np.int16)  # 0.1 A
+        rows = history[start:start + n]
+        rows['timestamp'] = t
+        rows['current'] = current[:, None]
+        rows['remaining'] = (soc[:, None] * capacity).astype(np.uint32)
+        rows['capacity'] = capacity
+        rows['cycles'] = 100 + ((t - start_ms) // DAY_MS)[:, None] + np.arange(modules)
+        drift = (t - start_ms) / DAY_MS / days * 30  # the weak cell 1.3 loses 30 mV over the history
+        cell_mv = 3200 + 200 * soc[:, None, None] + current[:, None, None] * 0.08 + spread
+        cell_mv = cell_mv + rng.normal(0, 1, (n, modules, cells))
+        cell_mv[:, 0, 2] -= drift
+        rows['cells'] = cell_mv.astype(np.uint16)
+        rows['voltage'] = rows['cells'].sum(axis=2, dtype=np.uint32)
+        temperature = 200 + np.abs(current)[:, None, None] // 5 + np.arange(TEMPERATURES) * 3
+        rows['temperatures'] = temperature + (np.arange(modules) * 2)[:, None]
+    history.flush()
+    return history
@@ -0,0 +1,190 @@
+""" Alarm and protection events of the modules.
+
+    decodeAlarmInfo returns the status bytes Status1..Status5 as integers and
+    the cell, temperature, current and voltage alarms as strings. AlarmEvents
+    keeps the last state of every module and emits an event only when a
+    condition is raised or cleared, the events go into a bounded EventLog.
+    The last good record of a stale module is passed again as the same
+    object and skipped. Every polled answer is a new record, also an
+    unchanged one (a copy, see PylontechMenu.complete): its status bytes
+    are compared with one XOR per byte and only the changed bits are
+    decoded, an unchanged answer costs the comparison only. The bits of STATUS_BITS follow the alarm
+    info of the "PYLON low voltage Protocol RS485" V3.3.
+"""
+
+import _thread
+from collections import OrderedDict as Dict
+import logging
+logger = logging.getLogger('events', 'events.log')
+logger.setLevel(logging.INFO)
+
+RAISED = 'raised'
+CLEARED = 'cleared'
+ALARM = 'alarm'  # protection and error conditions
+STATE = 'state'  # switching states of the module, e.g. the MOSFETs
+
+# per status byte: (bit mask, name, kind)
+STATUS_BITS = (
+    ((0x80, 'ModuleUnderVoltage', ALARM),
+     (0x40, 'ChargeOverTemperature', ALARM),
+     (0x20, 'DischargeOverTemperature', ALARM),
+     (0x10, 'DischargeOverCurrent', ALARM),
+     (0x04, 'ChargeOverCurrent', ALARM),
+     (0x02, 'CellUnderVoltage', ALARM),
+     (0x01, 'ModuleOverVoltage', ALARM)),
+    ((0x08, 'UsingBatteryPower', STATE),
+     (0x04, 'DischargeMosfet', STATE),
+     (0x02, 'ChargeMosfet', STATE),
+     (0x01, 'PreMosfet', STATE)),
+    ((0x80, 'EffectiveChargeCurrent', STATE),
+     (0x40, 'EffectiveDischargeCurrent', STATE),
+     (0x20, 'Heater', STATE),
+     (0x08, 'FullyCharged', STATE),
+     (0x01, 'Buzzer', STATE)),
+    tuple((1 << c, f'Cell{c + 1}Error', ALARM) for c in range(8)),
+    tuple((1 << c, f'Cell{c + 9}Error', ALARM) for c in range(8)),
+)
+STATUS_KEYS = ('Status1', 'Status2', 'Status3', 'Status4', 'Status5')
+# alarm fields with a single value 'Ok', 'BelowLimit', 'AboveLimit' or 'OtherError'
+VALUE_KEYS = ('ChargeCurrent', 'ModuleVoltage', 'DischargeCurrent')
+OK = 'Ok'
+
+
+class EventLog:
+    """ the last `capacity` events in a ring, numbered by a sequence """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.sequence = 0  # number of the last event
+        self.lock = _thread.allocate_lock()
+
+    def append(self, event):
+        """ event: (timestamp, module, name, transition, value, kind) """
+        with self.lock:
+            self.sequence += 1
+            self.ring[self.sequence % self.capacity] = event
+
+    def since(self, sequence=0, limit=None):
+        """ the events after the sequence number which are still in the ring, oldest first
+        @return  list of (sequence, event)
+        """
+        with self.lock:
+            first = max(sequence + 1, self.sequence - self.capacity + 1, 1)
+            last = self.sequence
+            if limit is not None and last - first + 1 > limit:
+                first = last - limit + 1
+            return [(n, self.ring[n % self.capacity]) for n in range(first, last + 1)]
+
+    @staticmethod
+    def to_dict(sequence, event):
+        timestamp, module, name, transition, value, kind = event
+        result = Dict()
+        result['seq'] = sequence
+        result['time'] = timestamp
+        result['module'] = module
+        result['name'] = name
+        result['transition'] = transition
+        result['value'] = value
+        result['kind'] = kind
+        return result
+
+
+class AlarmEvents:
+    """ edge detection of the alarm info of each module """
+
+    def __init__(self, modules=15, capacity=64):
+        self.log = EventLog(capacity)
+        self.records = [None] * modules
+        self.status = [None] * modules  # bytes of Status1..5 of the last record
+        self.values = [None] * modules  # alarm strings of the last record
+        self.active = 0  # alarms raised and not cleared
+
+    def update(self, batt, record, timestamp=None):
+        """ compares the alarm record of a module with its last one
+        @return  the number of new events
+        """
+        if record is None or record is self.records[batt]:
+            return 0  # the last good record of a stale module
+        if timestamp is None:
+            timestamp = record.get('Timestamp')
+        before = self.log.sequence
+        module = batt + 1
+        status = bytes(record[key] for key in STATUS_KEYS)
+        values = [record[key] for key in VALUE_KEYS] + record['CellAlarm'] + record['Temperature']
+        last_status = self.status[batt]
+        last_values = self.values[batt]
+        for i in range(len(STATUS_KEYS)):
+            if last_status is None:
+                # first answer of the module: active alarms are raised, the states are taken as they are
+                changes = status[i]
+            else:
+                changes = status[i] ^ last_status[i]
+            if not changes:
+                continue
+            for mask, name, kind in STATUS_BITS[i]:
+                if not changes & mask:
+                    continue
+                on = bool(status[i] & mask)
+                if last_status is None and kind == STATE:
+                    continue
+                delta = (1 if on else -1) if kind == ALARM else 0
+                self.emit(timestamp, module, name, RAISED if on else CLEARED, on, kind, delta)
+        for i in range(len(values)):
+            value = values[i]
+            last = OK if last_values is None or i >= len(last_values) else last_values[i]
+            if value != last:
+                delta = (value != OK) - (last != OK)  # 0 from one limit to the other
+                self.emit(timestamp, module, self.value_name(i, record), RAISED if value != OK else CLEARED,
+                          value, ALARM, delta)
+        self.records[batt] = record
+        self.status[batt] = status
+        self.values[batt] = values
+        return self.log.sequence - before
+
+    @staticmethod
+    def value_name(i, record):
+        if i < len(VALUE_KEYS):
+            return VALUE_KEYS[i]
+        i -= len(VALUE_KEYS)
+        if i < len(record['CellAlarm']):
+            return f'Cell{i + 1}Voltage'
+        return f'Temperature{i - len(record["CellAlarm"]) + 1}'
+
+    def emit(self, timestamp, module, name, transition, value, kind, delta):
+        self.active += delta
+        self.log.append((timestamp, module, name, transition, value, kind))
+        logger.info(f'module {module} {name} {transition} {value}')
+
+    def events(self, since=0, limit=None):
+        """ the events after the sequence number as dicts for the API """
+        return [EventLog.to_dict(n, event) for n, event in self.log.since(since, limit)]
+
+    def summary(self, limit=10):
+        """ the last events as text per sequence number, e.g. for the html table """
+        result = Dict()
+        for n, event in self.log.since(0, limit):
+            timestamp, module, name, transition, value, kind = event
+            result[n] = f'{timestamp} module {module} {name} {transition} {value}'
+        return result
+
+
+if __name__ == '__main__':
+    import time
+    from simulated_uart import SimulatedUart, SimulatedStack
+    from pylontech_base import PylontechRS485
+    from menu import PylontechMenu
+    stack = SimulatedStack(modules=3)
+    menu = PylontechMenu(3, pylon=PylontechRS485(uart=SimulatedUart(stack)))
+    menu.update()
+    stack.status[0] = 0x01  # module over voltage
+    stack.status[1] = 0x0c  # charge MOSFET off
+    menu.update()
+    stack.status[0] = 0
+    menu.update()
+    start = time.ticks_us()
+    for _ in range(100):
+        menu.events.update(0, menu.pylonData['AlarmInfoList'][0])
+    print(f'unchanged record: {time.ticks_diff(time.ticks_us(), start) / 100:.1f} us')
+    for event in menu.events.events():
+        print(event)
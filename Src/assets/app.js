@@ -0,0 +1,58 @@
+// the page shell is cached by the browser, each refresh fetches the data of /data
+var REFRESH_MS = 15000;
+var params = new URLSearchParams(window.location.search);
+var command = params.get('command') || 'status';
+var battery = parseInt(params.get('battery') || '1', 10);
+var timer = null;
+
+function fillSelect(select, options, selected) {
+    if (select.options.length === options.length) {
+        return;
+    }
+    select.innerHTML = '';
+    options.forEach(function (option) {
+        var element = document.createElement('option');
+        element.value = element.textContent = option;
+        element.selected = String(option) === String(selected);
+        select.appendChild(element);
+    });
+}
+
+function show(data) {
+    var modules = [];
+    for (var i = 1; i <= data.modules; i++) {
+        modules.push(i);
+    }
+    fillSelect(document.getElementById('command'), data.commands, data.command);
+    fillSelect(document.getElementById('battery'), modules, data.battery);
+    document.getElementById('state').textContent = data.ready ? '' : 'starting';
+    var rows = [];
+    var result = data.result || {};
+    Object.keys(result).forEach(function (key) {
+        var value = result[key];
+        if (typeof value === 'object' && value !== null) {
+            value = JSON.stringify(value);
+        }
+        rows.push('<tr><td>' + key + '</td><td>' + value + '</td></tr>');
+    });
+    document.getElementById('values').innerHTML = rows.join('');
+}
+
+function refresh() {
+    clearTimeout(timer);
+    fetch('/data?command=' + encodeURIComponent(command) + '&battery=' + battery)
+        .then(function (response) { return response.json(); })
+        .then(show)
+        .catch(function (error) { document.getElementById('state').textContent = error; })
+        .then(function () { timer = setTimeout(refresh, REFRESH_MS); });
+}
+
+document.getElementById('choiceform').addEventListener('submit', function (event) {
+    event.preventDefault();
+    command = document.getElementById('command').value;
+    battery = parseInt(document.getElementById('battery').value, 10);
+    history.replaceState(null, '', '/?command=' + encodeURIComponent(command) + '&battery=' + battery);
+    refresh();
+});
+
+refresh();
@@ -0,0 +1,48 @@
+""" Builds the gzip precompressed dashboard files of www from the sources in assets.
+
+    Runs on a host before the files are copied to the pico:
+        python build_assets.py
+    index.html refers to the other files with ?v=<crc32 of the file>, so they
+    can be cached by the browser for a year and still change with a new build.
+    The gzip trailer holds the same crc32, static_assets uses it as ETag.
+"""
+
+import os
+import gzip
+import zlib
+
+SOURCE = 'assets'
+TARGET = 'www'
+INDEX = 'index.html'
+
+
+def compress(name, data):
+    path = os.path.join(TARGET, name + '.gz')
+    with open(path, 'wb') as f:
+        # mtime 0: the same sources give the same files
+        with gzip.GzipFile(filename=name, mode='wb', fileobj=f, compresslevel=9, mtime=0) as gz:
+            gz.write(data)
+    print(f'{path}: {len(data)} -> {os.path.getsize(path)} bytes')
+
+
+def build():
+    os.makedirs(TARGET, exist_ok=True)
+    names = sorted(os.listdir(SOURCE))
+    versions = {}
+    for name in names:
+        if name == INDEX:
+            continue
+        with open(os.path.join(SOURCE, name), 'rb') as f:
+            data = f.read()
+        versions[name] = zlib.crc32(data)
+        compress(name, data)
+    with open(os.path.join(SOURCE, INDEX), 'rb') as f:
+        index = f.read()
+    for name, crc in versions.items():
+        reference = f'"{name}"'.encode()
+        index = index.replace(reference, f'"{name}?v={crc:08x}"'.encode())
+    compress(INDEX, index)
+
+
+if __name__ == '__main__':
+    build()
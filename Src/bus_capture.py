@@ -0,0 +1,135 @@
+""" Capture of the raw bus traffic and its replay.
+
+    BusCapture writes every frame sent and received by PylontechRS485 into a
+    compact binary file, see PylontechRS485.start_capture(). A record is
+    a header of 7 bytes, little endian:
+
+        direction  B  TX, RX or TIMEOUT (no answer)
+        delta_us   I  ticks_us since the previous record, so the wrap of ticks_us does not matter
+        length     H  length of the frame
+    followed by the frame as sent/received including '~' and '\r'.
+
+    simulated_uart.ReplayUart is a UART stand-in which answers the requests of
+    PylontechMenu with the captured answers, at the original timing or as fast
+    as possible.
+    A capture of a misbehaving installation thus becomes a regression case and
+    a throughput benchmark of the decoders and the aggregation on a host.
+"""
+
+import struct
+import time
+import logging
+logger = logging.getLogger('capture', 'capture.log')
+logger.setLevel(logging.INFO)
+
+MAGIC = b'PYLC\x01'
+RECORD = '<BIH'
+RECORD_SIZE = struct.calcsize(RECORD)
+TX = 0
+RX = 1
+TIMEOUT = 2
+DIRECTION_NAMES = ('tx', 'rx', 'timeout')
+FLUSH_BYTES = 1024
+MAX_BYTES = 512 * 1024  # the capture stops before it fills the flash of the pico
+
+
+class BusCapture:
+    """ appends the frames to a capture file """
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        self.buffer = bytearray()
+        self.last = None
+        self.records = 0
+        self.dropped = 0
+
+    def record(self, direction, ticks, data=b''):
+        if self.file is None:
+            return
+        if self.size + len(self.buffer) + RECORD_SIZE + len(data) > self.max_bytes:
+            self.dropped += 1
+            return
+        delta = 0 if self.last is None else time.ticks_diff(ticks, self.last)
+        self.last = ticks
+        self.buffer += struct.pack(RECORD, direction, max(delta, 0), len(data))
+        self.buffer += data
+        self.records += 1
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None and self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.size += len(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        logger.info(f'{self.path}: {self.records} records, {self.size} bytes, {self.dropped} dropped')
+
+
+def read_capture(path):
+    """ generator of the records (direction, delta_us, frame) of a capture file """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is no bus capture')
+        while True:
+            header = f.read(RECORD_SIZE)
+            if len(header) < RECORD_SIZE:
+                return
+            direction, delta, length = struct.unpack(RECORD, header)
+            yield direction, delta, f.read(length)
+
+
+def load_exchanges(path):
+    """ the capture as list of (request, answer or None, turnaround_us) """
+    exchanges = []
+    request = None
+    elapsed = 0
+    for direction, delta, frame in read_capture(path):
+        elapsed += delta
+        if direction == TX:
+            if request is not None:
+                exchanges.append((request, None, 0))
+            request = frame
+            elapsed = 0
+        elif request is not None:
+            exchanges.append((request, frame if direction == RX else None, elapsed))
+            request = None
+    if request is not None:
+        exchanges.append((request, None, 0))
+    return exchanges
+
+
+if __name__ == '__main__':
+    # captures the polls of a simulated stack and replays them at original and maximum speed
+    from simulated_uart import SimulatedUart, SimulatedStack, ReplayUart
+    from pylontech_base import PylontechRS485
+    from menu import PylontechMenu
+    path = 'bus.cap'
+    pylon = PylontechRS485(uart=SimulatedUart(SimulatedStack(modules=8)))
+    pylon.start_capture(path)
+    menu = PylontechMenu(8, pylon=pylon)
+    for _ in range(5):
+        menu.update()
+    pylon.stop_capture()
+    for realtime in (True, False):
+        uart = ReplayUart(path, realtime)
+        replay = PylontechMenu(8, pylon=PylontechRS485(uart=uart))
+        start = time.ticks_ms()
+        polls = 0
+        while not uart.done():
+            result = replay.update()
+            polls += 1
+        duration = time.ticks_diff(time.ticks_ms(), start)
+        print(f"{'original' if realtime else 'maximum'} speed: {len(uart.exchanges)} exchanges, "
+              f"{polls} polls in {duration} ms, mismatches {uart.mismatches}, unanswered {uart.unanswered}")
+    print(result['Calculated']['Remaining_%'], result['Calculated']['MaximumCellVoltage'])
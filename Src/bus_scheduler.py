@@ -0,0 +1,229 @@
+""" Priority scheduling of the bus transactions.
+
+    All requests to the batteries are queued as transactions in five classes:
+    - INTERACTIVE  requests of a user, e.g. from the web page
+    - ALARM        alarm info of the poll cycle
+    - BRIDGE       raw frames of the clients of the TCP bridge, see rs485_bridge
+    - TELEMETRY    analog values and charge/discharge management of the poll cycle
+    - STATIC       system parameter, serial numbers and other rarely changing data
+    The scheduler runs one transaction at a time and always takes the oldest
+    transaction of the highest class, so a user request waits for at most the
+    transaction on the bus. A transaction of a lower class which waited longer
+    than the aging limit of its class is served first (anti-starvation). The
+    age counts from the moment the transaction is at the head of its queue,
+    so a poll cycle queued at once ages one transaction at a time, and after
+    an aged transaction a waiting user request is always served next.
+"""
+
+import _thread
+import time
+from menu import aggregate_stack, new_changed
+import logging
+logger = logging.getLogger('scheduler', 'scheduler.log')
+logger.setLevel(logging.INFO)
+
+INTERACTIVE = 0
+ALARM = 1
+BRIDGE = 2
+TELEMETRY = 3
+STATIC = 4
+CLASS_NAMES = ('interactive', 'alarm', 'bridge', 'telemetry', 'static')
+# a transaction waiting longer than this at the head of its queue is served before the higher classes
+AGING_MS = (0, 500, 1000, 3000, 15000)
+
+PENDING = 'pending'
+OK = 'ok'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+
+class Transaction:
+    """ one request to the bus, decoder None returns the raw answer """
+
+    def __init__(self, priority, packet, decoder=None, callback=None, tag=None):
+        self.priority = priority
+        self.packet = packet
+        self.decoder = decoder
+        self.callback = callback
+        self.tag = tag
+        self.enqueued = time.ticks_ms()
+        self.head = self.enqueued  # since when it is the next one of its class
+        self.status = PENDING
+        self.result = None
+        self.error = None
+
+    def done(self):
+        return self.status != PENDING
+
+
+class ClassMetrics:
+    def __init__(self):
+        self.submitted = 0
+        self.served = 0
+        self.max_depth = 0
+        self.total_wait_ms = 0
+        self.max_wait_ms = 0
+
+    def snapshot(self, depth):
+        return {'depth': depth,
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'served': self.served,
+                'mean_wait_ms': self.total_wait_ms // self.served if self.served else 0,
+                'max_wait_ms': self.max_wait_ms}
+
+
+class BusScheduler:
+    """ queues per priority class, thread safe submit() and run_next() """
+
+    def __init__(self, aging_ms=AGING_MS):
+        self.aging_ms = aging_ms
+        self.queues = [[] for _ in CLASS_NAMES]
+        self.metrics = [ClassMetrics() for _ in CLASS_NAMES]
+        self.lock = _thread.allocate_lock()
+        self.aged = False  # the last transaction was served for its age
+
+    def submit(self, transaction):
+        with self.lock:
+            queue = self.queues[transaction.priority]
+            if not queue:
+                transaction.head = time.ticks_ms()
+            queue.append(transaction)
+            metrics = self.metrics[transaction.priority]
+            metrics.submitted += 1
+            if len(queue) > metrics.max_depth:
+                metrics.max_depth = len(queue)
+        return transaction
+
+    def request(self, priority, packet, decoder=None, callback=None, tag=None):
+        return self.submit(Transaction(priority, packet, decoder, callback, tag))
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def next(self):
+        """ removes and returns the transaction to run next or None """
+        now = time.ticks_ms()
+        with self.lock:
+            queues = self.queues
+            if queues[INTERACTIVE] and self.aged:
+                self.aged = False
+                return self.pop(queues[INTERACTIVE], now)
+            # aged transactions of the lower classes first, the lowest class wins
+            for priority in range(len(queues) - 1, 0, -1):
+                queue = queues[priority]
+                if queue and time.ticks_diff(now, queue[0].head) > self.aging_ms[priority]:
+                    self.aged = True
+                    return self.pop(queue, now)
+            self.aged = False
+            for queue in queues:
+                if queue:
+                    return self.pop(queue, now)
+        return None
+
+    @staticmethod
+    def pop(queue, now):
+        """ removes the head of the queue, the next transaction starts to age """
+        transaction = queue.pop(0)
+        if queue:
+            queue[0].head = now
+        return transaction
+
+    def run_next(self, menu):
+        """ executes the next transaction with menu.query()
+        @return  the transaction or None if nothing was queued
+        """
+        transaction = self.next()
+        if transaction is None:
+            return None
+        wait = time.ticks_diff(time.ticks_ms(), transaction.enqueued)
+        metrics = self.metrics[transaction.priority]
+        metrics.served += 1
+        metrics.total_wait_ms += wait
+        if wait > metrics.max_wait_ms:
+            metrics.max_wait_ms = wait
+        try:
+            if transaction.decoder is None:
+                menu.pylon.send(transaction.packet)
+                result = menu.pylon.receive()
+            else:
+                result = menu.query(transaction.packet, transaction.decoder)
+            transaction.result = result
+            transaction.status = OK if result is not None else TIMEOUT
+        except Exception as ex:
+            transaction.error = ex
+            transaction.status = ERROR
+            if isinstance(ex, ValueError):
+                menu.recover()
+        if transaction.callback is not None:
+            try:
+                transaction.callback(transaction)
+            except Exception as ex:
+                logger.exception(ex, 'transaction callback')
+        return transaction
+
+    def get_metrics(self):
+        """ queue depth and wait times per class """
+        result = {}
+        for priority in range(len(CLASS_NAMES)):
+            result[CLASS_NAMES[priority]] = self.metrics[priority].snapshot(len(self.queues[priority]))
+        return result
+
+    def reset_metrics(self):
+        self.metrics = [ClassMetrics() for _ in CLASS_NAMES]
+
+
+# classes of the module requests in the order of PylontechMenu.module_requests()
+MODULE_PRIORITIES = (TELEMETRY, TELEMETRY, ALARM, STATIC)
+
+
+class PollCycle:
+    """ one update of the stack as scheduled transactions """
+
+    def __init__(self, menu, scheduler):
+        self.menu = menu
+        self.outstanding = 0
+        self.records = {}
+        self.failed = []
+        for batt in range(menu.get_module_count()):
+            if not menu.breakers.allow(batt):
+                continue
+            self.records[batt] = [None] * len(MODULE_PRIORITIES)
+            requests = menu.module_requests(batt)
+            for slot in range(len(requests)):
+                packet, decoder = requests[slot]
+                self.outstanding += 1
+                scheduler.request(MODULE_PRIORITIES[slot], packet, decoder, self.completed, (batt, slot))
+
+    def completed(self, transaction):
+        self.outstanding -= 1
+        batt, slot = transaction.tag
+        if transaction.status == OK:
+            self.records[batt][slot] = transaction.result
+        elif batt not in self.failed:
+            self.failed.append(batt)
+
+    def complete(self):
+        return self.outstanding == 0
+
+    def finish(self):
+        """ feeds the breakers and aggregates the records like PylontechMenu.update() """
+        menu = self.menu
+        staleModules = []
+        changed = new_changed()
+        modules = []
+        for batt in range(menu.get_module_count()):
+            if batt in self.records and batt not in self.failed:
+                menu.breakers.success(batt)
+                menu.last_good[batt] = tuple(self.records[batt])
+                menu.module_changed(batt, changed)
+            else:
+                if batt in self.failed:
+                    menu.breakers.failure(batt)
+                staleModules.append(batt + 1)
+            modules.append(menu.last_good[batt])
+        result = aggregate_stack(menu.pylonData, menu.cell_stats, modules, staleModules, changed, menu.events, menu.energy,
+                                 menu.resistance)
+        if menu.energy is not None:
+            menu.energy.step()  # saves the counters on the core which updates them
+        return result
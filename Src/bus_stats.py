@@ -0,0 +1,130 @@
+""" Latency histograms and error counters for the RS485 bus.
+
+    The histograms use fixed bucket limits and preallocated arrays, so recording
+    a sample does not allocate memory. One set of histograms is kept per
+    (CID2, address) pair and is created the first time the pair is seen.
+
+    Stages of one transaction:
+    - tx          writing the request frame to the UART until it is flushed
+    - turnaround  end of the request until the first answer byte arrives
+    - rx          first answer byte until the end of the answer frame
+    - transaction start of the request until the end of the answer frame
+"""
+
+from array import array
+
+# upper limits of the buckets in us, the last bucket collects everything above
+BUCKET_LIMITS_US = (100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+TX = 0
+TURNAROUND = 1
+RX = 2
+TRANSACTION = 3
+STAGES = ('tx', 'turnaround', 'rx', 'transaction')
+
+
+class Histogram:
+    """ fixed bucket histogram of durations in us """
+
+    def __init__(self, limits=BUCKET_LIMITS_US):
+        self.limits = limits
+        self.counts = array('L', [0] * (len(limits) + 1))
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def add(self, value):
+        limits = self.limits
+        n = len(limits)
+        i = 0
+        while i < n and value > limits[i]:
+            i += 1
+        self.counts[i] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return self.total // self.count
+
+    def snapshot(self):
+        return {'count': self.count,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.mean(),
+                'buckets': list(self.counts)}
+
+
+class BusStats:
+    """ collects the histograms per (CID2, address) and the bus error counters """
+
+    def __init__(self, limits=BUCKET_LIMITS_US):
+        self.limits = limits
+        self.histograms = {}
+        self.reset()
+
+    def reset(self):
+        """ clear all samples and counters, the histograms stay allocated """
+        for stages in self.histograms.values():
+            for histogram in stages:
+                histogram.reset()
+        self.transactions = 0
+        self.timeouts = 0
+        self.resyncs = 0
+        self.garbage_bytes = 0
+        self.checksum_errors = 0
+
+    def stages(self, cid2, adr):
+        key = (cid2 << 8) | adr
+        stages = self.histograms.get(key)
+        if stages is None:
+            stages = [Histogram(self.limits) for _ in STAGES]
+            self.histograms[key] = stages
+        return stages
+
+    def record(self, cid2, adr, tx_us, turnaround_us, rx_us, transaction_us):
+        """ add the durations of one completed transaction """
+        stages = self.stages(cid2, adr)
+        stages[TX].add(tx_us)
+        stages[TURNAROUND].add(turnaround_us)
+        stages[RX].add(rx_us)
+        stages[TRANSACTION].add(transaction_us)
+        self.transactions += 1
+
+    def snapshot(self):
+        """ returns the counters and histograms as a dict,
+            histograms are keyed by 'CID2:ADR' in hex, e.g. '42:02'
+        """
+        histograms = {}
+        for key in sorted(self.histograms):
+            stages = self.histograms[key]
+            name = "{:02X}:{:02X}".format(key >> 8, key & 0xff)
+            histograms[name] = {STAGES[i]: stages[i].snapshot() for i in range(len(STAGES))}
+        return {'bucket_limits_us': list(self.limits),
+                'transactions': self.transactions,
+                'timeouts': self.timeouts,
+                'resyncs': self.resyncs,
+                'garbage_bytes': self.garbage_bytes,
+                'checksum_errors': self.checksum_errors,
+                'histograms': histograms}
+
+
+if __name__ == '__main__':
+    stats = BusStats()
+    for us in (80, 150, 900, 4000, 150000):
+        stats.record(0x42, 2, us, us, us, 3 * us)
+    stats.timeouts += 1
+    print(stats.snapshot())
+    stats.reset()
+    print(stats.snapshot())
@@ -0,0 +1,254 @@
+""" Cell statistics of the battery stack.
+
+    The cell voltages and temperatures of all modules are kept in preallocated
+    arrays. compute() walks over all cells once and calculates
+    - minimum and maximum with (module, cell) location
+    - mean and standard deviation, summed as differences to the first cell:
+      the squares of the voltages would cancel in the single precision floats
+      of the pico
+    - delta (max - min) per module
+    - stack-wide imbalance (max - min over all cells)
+
+    compute_history() does the same with NumPy for recorded history on the host,
+    e.g. for an array of shape (samples, modules, cells).
+"""
+
+from array import array
+from collections import OrderedDict as Dict
+import math
+
+MAX_MODULES = 15
+MAX_CELLS = 16
+MAX_TEMPERATURES = 8
+
+
+class CellStats:
+    """ single pass statistics over the cell data of all modules """
+
+    def __init__(self, modules=MAX_MODULES, cells=MAX_CELLS, temperatures=MAX_TEMPERATURES):
+        self.modules = modules
+        self.cells = cells
+        self.temperatures = temperatures
+        self.voltage = array('f', [0.0] * (modules * cells))
+        self.temperature = array('f', [0.0] * (modules * temperatures))
+        self.cell_count = array('B', [0] * modules)
+        self.temperature_count = array('B', [0] * modules)
+        self.module_delta = array('f', [0.0] * modules)
+        self.module_count = 0
+        self.clear_results()
+
+    def clear_results(self):
+        self.min_voltage = 0.0
+        self.max_voltage = 0.0
+        self.min_voltage_location = (0, 0)
+        self.max_voltage_location = (0, 0)
+        self.mean_voltage = 0.0
+        self.std_voltage = 0.0
+        self.imbalance = 0.0
+        self.max_module_delta = 0.0
+        self.max_module_delta_module = 0
+        self.min_temperature = 0.0
+        self.max_temperature = 0.0
+        self.min_temperature_location = (0, 0)
+        self.max_temperature_location = (0, 0)
+        self.mean_temperature = 0.0
+
+    def set_module_count(self, count):
+        self.module_count = min(count, self.modules)
+
+    def set_module(self, module, voltages, temperatures):
+        """ copy the cell voltages and temperatures of one module into the arrays
+        @param module  module index 0..modules-1
+        @param voltages  sequence of cell voltages in V
+        @param temperatures  sequence of temperatures in degC
+        """
+        n = min(len(voltages), self.cells)
+        base = module * self.cells
+        v = self.voltage
+        for i in range(n):
+            v[base + i] = voltages[i]
+        self.cell_count[module] = n
+        n = min(len(temperatures), self.temperatures)
+        base = module * self.temperatures
+        t = self.temperature
+        for i in range(n):
+            t[base + i] = temperatures[i]
+        self.temperature_count[module] = n
+        if module >= self.module_count:
+            self.module_count = module + 1
+
+    def compute(self):
+        """ calculates all statistics in one pass over the arrays """
+        self.clear_results()
+        v = self.voltage
+        cells = self.cells
+        n = 0
+        total = 0.0
+        total_sq = 0.0
+        v_min = 1000.0
+        v_max = -1000.0
+        v_min_at = 0
+        v_max_at = 0
+        delta_max = -1.0
+        delta_at = 0
+        ref = 0.0
+        for m in range(self.module_count):
+            if self.cell_count[m]:
+                ref = v[m * cells]
+                break
+        for m in range(self.module_count):
+            base = m * cells
+            count = self.cell_count[m]
+            m_min = 1000.0
+            m_max = -1000.0
+            for i in range(base, base + count):
+                x = v[i]
+                d = x - ref
+                total += d
+                total_sq += d * d
+                if x < m_min:
+                    m_min = x
+                    if x < v_min:
+                        v_min = x
+                        v_min_at = i
+                if x > m_max:
+                    m_max = x
+                    if x > v_max:
+                        v_max = x
+                        v_max_at = i
+            n += count
+            delta = m_max - m_min if count else 0.0
+            self.module_delta[m] = delta
+            if delta > delta_max:
+                delta_max = delta
+                delta_at = m
+        if n:
+            mean = total / n
+            self.mean_voltage = ref + mean
+            self.std_voltage = math.sqrt(max(total_sq / n - mean * mean, 0.0))
+            self.min_voltage = v_min
+            self.max_voltage = v_max
+            self.min_voltage_location = divmod(v_min_at, cells)
+            self.max_voltage_location = divmod(v_max_at, cells)
+            self.imbalance = v_max - v_min
+            self.max_module_delta = delta_max
+            self.max_module_delta_module = delta_at
+
+        t = self.temperature
+        temps = self.temperatures
+        n = 0
+        total = 0.0
+        t_min = 1000.0
+        t_max = -1000.0
+        t_min_at = 0
+        t_max_at = 0
+        for m in range(self.module_count):
+            base = m * temps
+            for i in range(base, base + self.temperature_count[m]):
+                x = t[i]
+                total += x
+                if x < t_min:
+                    t_min = x
+                    t_min_at = i
+                if x > t_max:
+                    t_max = x
+                    t_max_at = i
+            n += self.temperature_count[m]
+        if n:
+            self.mean_temperature = total / n
+            self.min_temperature = t_min
+            self.max_temperature = t_max
+            self.min_temperature_location = divmod(t_min_at, temps)
+            self.max_temperature_location = divmod(t_max_at, temps)
+        return self
+
+    def to_dict(self):
+        """ results with 1 based module and cell numbers, voltages differences in mV """
+        result = Dict()
+        result['MinimumCellVoltage'] = round(self.min_voltage, 3)
+        result['MinimumCellVoltageAt'] = location(self.min_voltage_location)
+        result['MaximumCellVoltage'] = round(self.max_voltage, 3)
+        result['MaximumCellVoltageAt'] = location(self.max_voltage_location)
+        result['MeanCellVoltage'] = round(self.mean_voltage, 3)
+        result['StdCellVoltage_mV'] = round(self.std_voltage * 1000, 1)
+        result['CellImbalance_mV'] = round(self.imbalance * 1000, 1)
+        result['MaximumModuleDelta_mV'] = round(self.max_module_delta * 1000, 1)
+        result['MaximumModuleDeltaModule'] = self.max_module_delta_module + 1
+        result['MinimumTemperature'] = round(self.min_temperature, 1)
+        result['MinimumTemperatureAt'] = location(self.min_temperature_location)
+        result['MaximumTemperature'] = round(self.max_temperature, 1)
+        result['MaximumTemperatureAt'] = location(self.max_temperature_location)
+        result['MeanTemperature'] = round(self.mean_temperature, 1)
+        return result
+
+    def module_deltas(self):
+        return [self.module_delta[m] for m in range(self.module_count)]
+
+
+def location(module_cell):
+    """ 'module.cell' with 1 based numbers """
+    return f"{module_cell[0] + 1}.{module_cell[1] + 1}"
+
+
+def compute_history(voltages):
+    """ host side statistics with NumPy over recorded history
+    @param voltages  array like of shape (samples, modules, cells), NaN for missing cells
+    @return  dict of arrays with one value per sample
+    """
+    import numpy as np
+    v = np.asarray(voltages, dtype=np.float32)
+    samples, modules, cells = v.shape
+    flat = v.reshape(samples, modules * cells)
+    min_at = np.nanargmin(flat, axis=1)
+    max_at = np.nanargmax(flat, axis=1)
+    rows = np.arange(samples)
+    v_min = flat[rows, min_at]
+    v_max = flat[rows, max_at]
+    module_delta = np.nanmax(v, axis=2) - np.nanmin(v, axis=2)
+    return {'min': v_min,
+            'min_module': min_at // cells,
+            'min_cell': min_at % cells,
+            'max': v_max,
+            'max_module': max_at // cells,
+            'max_cell': max_at % cells,
+            'mean': np.nanmean(flat, axis=1),
+            'std': np.nanstd(flat, axis=1),
+            'module_delta': module_delta,
+            'imbalance': v_max - v_min}
+
+
+if __name__ == '__main__':
+    # benchmark with a full stack of 15 modules with 16 cells
+    import time
+    import random
+    try:
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+    except AttributeError:
+        ticks_us = lambda: int(time.perf_counter() * 1000000)
+        ticks_diff = lambda a, b: a - b
+
+    stats = CellStats()
+    for module in range(MAX_MODULES):
+        stats.set_module(module,
+                         [3.30 + random.random() * 0.02 for _ in range(MAX_CELLS)],
+                         [20.0 + random.random() * 5 for _ in range(6)])
+    runs = 100
+    start = ticks_us()
+    for _ in range(runs):
+        stats.compute()
+    duration = ticks_diff(ticks_us(), start)
+    print(f"compute() {MAX_MODULES}x{MAX_CELLS} cells: {duration / runs:.0f} us per run")
+    print(stats.to_dict())
+
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is not None:
+        samples = 86400
+        history = 3.3 + np.random.rand(samples, MAX_MODULES, MAX_CELLS).astype(np.float32) * 0.02
+        start = time.perf_counter()
+        result = compute_history(history)
+        duration = time.perf_counter() - start
+        print(f"compute_history() {samples} samples: {duration:.2f} s")
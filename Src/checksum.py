@@ -0,0 +1,140 @@
+""" Checksum kernels for the RS485 frames and the ICMP packets.
+
+    On MicroPython the byte sums are compiled with @micropython.viper, on
+    CPython (host) the pure Python versions are used. All functions take
+    bytes, bytearray or memoryview.
+
+    - frame_checksum   CHKSUM of a Pylontech frame (sum of the ASCII bytes, 2's complement)
+    - length_checksum  LENGTH field with LCHKSUM of a Pylontech frame
+    - inet_checksum    internet checksum (RFC 1071) used by ping
+    - FrameChecksum    incremental frame checksum, updated while a frame is received
+"""
+
+
+
+def _byte_sum_py(buf, start, end):
+    s = 0
+    for i in range(start, end):
+        s += buf[i]
+    return s
+
+
+def _inet_sum_py(buf, n):
+    s = 0
+    for i in range(0, n - 1, 2):
+        s += (buf[i] << 8) + buf[i + 1]
+    if n & 1:
+        s += buf[n - 1] << 8
+    return s
+
+
+try:
+    import micropython
+
+    # the literal decorator: the compiler of MicroPython only knows @micropython.viper
+    @micropython.viper
+    def _byte_sum_viper(buf, start: int, end: int) -> int:
+        p = ptr8(buf)
+        s = 0
+        i = start
+        while i < end:
+            s += p[i]
+            i += 1
+        return s
+
+    @micropython.viper
+    def _inet_sum_viper(buf, n: int) -> int:
+        p = ptr8(buf)
+        s = 0
+        i = 0
+        while i < n - 1:
+            s += (p[i] << 8) + p[i + 1]
+            i += 2
+        if n & 1:
+            s += p[n - 1] << 8
+        return s
+
+    byte_sum = _byte_sum_viper
+    inet_sum = _inet_sum_viper
+except (ImportError, AttributeError):
+    micropython = None
+    byte_sum = _byte_sum_py
+    inet_sum = _inet_sum_py
+
+
+def finish(s):
+    """ 2's complement of the 16 bit sum as used by PylontechRS485.get_chk_sum """
+    return ((~s) & 0xFFFF) + 1
+
+
+def frame_checksum(data, size=None):
+    """ checksum of the first size bytes of data """
+    if size is None:
+        size = len(data)
+    return finish(byte_sum(data, 0, size))
+
+
+def length_checksum(length):
+    """ LENGTH field: 12 bit LENID with the 4 bit LCHKSUM in front, as 4 hex digits """
+    cs = (length & 0xf) + ((length >> 4) & 0xf) + ((length >> 8) & 0xf)
+    cs = (((~cs) & 0xf) + 1) << 12
+    return "{:04X}".format((length + cs) & 0xffff)
+
+
+def inet_checksum(data):
+    """ internet checksum of an ICMP packet """
+    cs = inet_sum(data, len(data))
+    while cs >= 0x10000:
+        cs = (cs & 0xffff) + (cs >> 16)
+    return ~cs & 0xffff
+
+
+class FrameChecksum:
+    """ sums the bytes of a frame chunk by chunk while it is received """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sum = 0
+        self.size = 0
+
+    def update(self, buf, start=0, end=None):
+        if end is None:
+            end = len(buf)
+        if end > start:
+            self.sum += byte_sum(buf, start, end)
+            self.size += end - start
+
+    def value(self, tail=b''):
+        """ checksum of the bytes summed so far without the bytes of tail,
+            e.g. the received checksum digits and the end byte
+        """
+        return finish(self.sum - byte_sum(tail, 0, len(tail)))
+
+
+if __name__ == '__main__':
+    # benchmark with a single and a bulk analog answer of 15 modules
+    import time
+    try:
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+    except AttributeError:
+        ticks_us = lambda: int(time.perf_counter() * 1000000)
+        ticks_diff = lambda a, b: a - b
+
+    single = b'20024600C0AE1102100CF30CF20CF20CF20CF10CF20CF20CF30CF30CF20CF20CF20CF20CF20CF30CF2060BAE0BAE0BAE0BAE0BC20BB8FFD8CF2E9C40022710006B'
+    bulk = single + single[30:] * 14
+    for name, frame in (('single', single), ('bulk', bulk)):
+        assert frame_checksum(frame) == finish(_byte_sum_py(frame, 0, len(frame)))
+        runs = 100
+        start = ticks_us()
+        for _ in range(runs):
+            _byte_sum_py(frame, 0, len(frame))
+        python_us = ticks_diff(ticks_us(), start) / runs
+        start = ticks_us()
+        for _ in range(runs):
+            frame_checksum(frame)
+        kernel_us = ticks_diff(ticks_us(), start) / runs
+        print(f"{name} {len(frame)} bytes: python {python_us:.1f} us, kernel {kernel_us:.1f} us")
+    print('viper kernels' if micropython is not None else 'pure python kernels')
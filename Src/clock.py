@@ -0,0 +1,193 @@
+""" Wall clock time for the bus samples.
+
+    The RTC of the pico counts whole seconds and drifts. Clock keeps a
+    reference pair (ticks_us, UTC in us since 1970) and the drift of the
+    ticks against NTP, so the ticks_us taken when a frame was received map
+    to wall clock time with millisecond resolution. The times are ints:
+    the floats of the pico are single precision.
+    ticks_us wraps after 2**30 us on the pico, step() moves the reference
+    forward long before ticks_diff becomes ambiguous.
+
+    NtpClient resyncs the clock periodically on a non-blocking socket and
+    is stepped by the loop of the web server like the other tasks. The
+    name of the server is resolved once, the DNS lookup blocks; it is looked
+    up again only after RESOLVE_FAILURES failed requests in a row.
+"""
+
+import time
+if not hasattr(time, 'ticks_us'):
+    import host_compat
+import socket
+import struct
+from collections import OrderedDict as Dict
+import logging
+logger = logging.getLogger('clock', 'clock.log')
+logger.setLevel(logging.INFO)
+
+REBASE_US = 60000000  # move the reference every minute
+MAX_DRIFT_PPM = 500
+DRIFT_GAIN = 0.5  # share of a measured drift error taken over, filters the network jitter
+
+NTP_HOST = "1.de.pool.ntp.org"
+NTP_DELTA = 2208988800  # seconds from 1900 to 1970
+SYNC_INTERVAL_MS = 3600000
+RETRY_INTERVAL_MS = 30000
+ANSWER_TIMEOUT_MS = 2000
+RESOLVE_FAILURES = 3
+
+
+class Clock:
+    """ maps ticks_us to UTC, synchronised by NtpClient """
+
+    def __init__(self):
+        # (ticks_us, epoch_us, drift_ppm) replaced as a whole, a reader on core 1 sees one consistent tuple
+        self.reference = (time.ticks_us(), int(time.time()) * 1000000, 0.0)
+        self.synced = False
+        self.syncs = 0
+        self.last_sync_us = None
+        self.last_offset_us = None
+
+    def epoch_us(self, ticks=None):
+        """ UTC in us of a ticks_us value of the last minutes, default now """
+        ticks_ref, epoch_ref, drift_ppm = self.reference
+        if ticks is None:
+            ticks = time.ticks_us()
+        elapsed = time.ticks_diff(ticks, ticks_ref)
+        return epoch_ref + elapsed + int(elapsed * drift_ppm / 1000000)
+
+    def epoch_ms(self, ticks=None):
+        return self.epoch_us(ticks) // 1000
+
+    def step(self):
+        """ keeps the reference younger than the wrap of ticks_us """
+        ticks_ref, epoch_ref, drift_ppm = self.reference
+        now = time.ticks_us()
+        if time.ticks_diff(now, ticks_ref) > REBASE_US:
+            self.reference = (now, self.epoch_us(now), drift_ppm)
+
+    def sync(self, epoch_us, ticks):
+        """ epoch_us was the UTC at ticks, corrects the offset and the drift estimate """
+        drift_ppm = self.reference[2]
+        offset = epoch_us - self.epoch_us(ticks)
+        if self.synced:
+            elapsed = epoch_us - self.last_sync_us
+            if elapsed > 0:
+                drift_ppm += DRIFT_GAIN * offset * 1000000 / elapsed
+                drift_ppm = max(-MAX_DRIFT_PPM, min(MAX_DRIFT_PPM, drift_ppm))
+        self.reference = (ticks, epoch_us, drift_ppm)
+        self.last_offset_us = offset
+        self.last_sync_us = epoch_us
+        self.synced = True
+        self.syncs += 1
+        logger.info(f'sync {self.syncs}: offset {offset} us, drift {drift_ppm:.1f} ppm')
+
+    def status(self):
+        result = Dict()
+        result['synced'] = self.synced
+        result['syncs'] = self.syncs
+        result['epoch_ms'] = self.epoch_ms()
+        result['offset_us'] = self.last_offset_us
+        result['drift_ppm'] = round(self.reference[2], 2)
+        return result
+
+
+# the clock of the samples, shared by the bus and the web server
+wall_clock = Clock()
+
+
+class NtpClient:
+    """ SNTP requests without blocking, one short step per call """
+
+    def __init__(self, clock=wall_clock, host=NTP_HOST, interval_ms=SYNC_INTERVAL_MS, set_rtc=None):
+        """ set_rtc  optional function called with the UTC seconds after a sync, e.g. Wifi.set_rtc """
+        self.clock = clock
+        self.host = host
+        self.interval_ms = interval_ms
+        self.set_rtc = set_rtc
+        self.sock = None
+        self.address = None  # of the host, resolved once
+        self.sent = 0
+        self.due = time.ticks_ms()
+        self.requests = 0
+        self.failures = 0
+        self.misses = 0  # failed requests in a row
+        self.rtt_us = None
+
+    def step(self):
+        """ sends a request when due and reads the answer on the next steps
+        @return  True when the clock was synchronised in this step
+        """
+        now = time.ticks_ms()
+        try:
+            if self.sock is None:
+                if time.ticks_diff(now, self.due) >= 0:
+                    self.send()
+                return False
+            if self.receive():
+                self.misses = 0
+                self.due = time.ticks_add(now, self.interval_ms)
+                return True
+            if time.ticks_diff(now, self.sent) > ANSWER_TIMEOUT_MS:
+                raise OSError('no answer of the time server')
+        except OSError as ex:
+            self.failures += 1
+            self.misses += 1
+            if self.misses >= RESOLVE_FAILURES:
+                self.misses = 0
+                self.address = None  # the pool may have moved
+            logger.warning(f'ntp: {ex}')
+            self.close()
+            self.due = time.ticks_add(now, RETRY_INTERVAL_MS)
+        return False
+
+    def resolve(self):
+        """ looks up the address of the host, this blocks for the DNS answer """
+        self.address = socket.getaddrinfo(self.host, 123)[0][-1]
+        return self.address
+
+    def send(self):
+        address = self.address if self.address is not None else self.resolve()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.requests += 1
+        self.sent = time.ticks_ms()
+        self.sent_us = time.ticks_us()
+        self.sock.sendto(b"\x1b" + 47 * b"\0", address)
+
+    def receive(self):
+        try:
+            data = self.sock.recv(48)
+        except OSError:
+            return False  # EAGAIN, not yet answered
+        ticks = time.ticks_us()
+        self.close()
+        if len(data) < 48:
+            raise OSError('short answer of the time server')
+        seconds, fraction = struct.unpack_from('!II', data, 40)  # transmit timestamp
+        self.rtt_us = time.ticks_diff(ticks, self.sent_us)
+        epoch_us = (seconds - NTP_DELTA) * 1000000 + ((fraction * 1000000) >> 32) + self.rtt_us // 2
+        self.clock.sync(epoch_us, ticks)
+        if self.set_rtc is not None:
+            self.set_rtc(epoch_us // 1000000)
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def status(self):
+        result = self.clock.status()
+        result['requests'] = self.requests
+        result['failures'] = self.failures
+        result['rtt_us'] = self.rtt_us
+        return result
+
+
+if __name__ == '__main__':
+    ntp = NtpClient(interval_ms=10000)
+    for _ in range(3000):
+        ntp.step()
+        wall_clock.step()
+        time.sleep_ms(10)
+    print(ntp.status())
@@ -0,0 +1,220 @@
+""" RS485 poll loop on the second core of the RP2040.
+
+    The poll loop runs in a _thread, on the pico this is core 1, and writes
+    the stack data into one of two preallocated snapshot slots. When a slot
+    is complete the published index is flipped, so the web server on core 0
+    only reads the published slot and never sees a half updated snapshot.
+    A slot is overwritten one poll cycle after it was published at the
+    earliest, a reader has that long to render it.
+
+    The poll cycle and the requests of the web page are transactions of a
+    BusScheduler, a request of a user waits at most for the transaction
+    running on the bus. Commands which are not a single query are handed to
+    the poll loop through a mailbox, core 0 never drives the bus.
+"""
+
+import _thread
+import time
+from collections import OrderedDict as Dict
+from bus_scheduler import BusScheduler, PollCycle, INTERACTIVE, OK
+from menu import aggregate_stack, new_changed
+from cell_stats import CellStats
+from clock import wall_clock
+from memory import governor
+import logging
+logger = logging.getLogger('core1', 'core1.log')
+logger.setLevel(logging.INFO)
+
+POLL_INTERVAL_MS = 5000
+
+SNAPSHOT_LISTS = ('AnalogList', 'ChargeDischargeManagementList', 'AlarmInfoList',
+                  'SystemParameterList', 'StaleModules', 'SerialNumbers')
+
+
+def calculated_keys(menu):
+    """ the keys of Calculated of the menu, from an aggregation without modules """
+    scratch = Dict()
+    scratch['Calculated'] = Dict()
+    aggregate_stack(scratch, CellStats(modules=1), [], [], new_changed(), menu.events, menu.energy,
+                    menu.resistance)
+    return list(scratch['Calculated'])
+
+
+class SnapshotBuffer:
+    """ two snapshot slots and the index of the published one """
+
+    def __init__(self, calculated_keys=()):
+        # allocated once at boot with all keys, fill() only assigns values
+        self.slots = governor.preallocate('snapshots', lambda: [self.new_slot(calculated_keys),
+                                                                self.new_slot(calculated_keys)])
+        self.published = 0
+        self.sequence = 0
+
+    @staticmethod
+    def new_slot(calculated_keys):
+        slot = Dict()
+        slot['Sequence'] = 0
+        slot['Time'] = 0
+        calculated = Dict()
+        for key in calculated_keys:
+            calculated[key] = None
+        slot['Calculated'] = calculated
+        for key in SNAPSHOT_LISTS:
+            slot[key] = None
+        return slot
+
+    def back(self):
+        """ the slot the writer may fill """
+        return self.slots[1 - self.published]
+
+    def publish(self):
+        """ makes the back slot visible, a single assignment of an int """
+        self.sequence += 1
+        self.back()['Sequence'] = self.sequence
+        self.published = 1 - self.published
+
+    def read(self):
+        """ the published slot """
+        return self.slots[self.published]
+
+    def fill(self, pylonData):
+        """ copies the stack data into the back slot and publishes it """
+        slot = self.back()
+        calculated = slot['Calculated']
+        source = pylonData['Calculated']
+        for key in source:
+            calculated[key] = source[key]
+        for key in SNAPSHOT_LISTS:
+            if key in pylonData:
+                slot[key] = pylonData[key]  # the lists are created anew on each update
+        slot['Time'] = wall_clock.epoch_ms() // 1000
+        self.publish()
+
+
+class Core1Poller:
+    """ runs menu.update() on core 1 and offers the interface of PylontechMenu to core 0 """
+
+    def __init__(self, menu, interval_ms=POLL_INTERVAL_MS):
+        self.menu = menu
+        self.CID = menu.CID
+        self.events = menu.events  # filled on core 1, the log is locked
+        self.interval_ms = interval_ms
+        self.buffer = SnapshotBuffer(calculated_keys(menu))
+        self.scheduler = BusScheduler()
+        self.cycle = None
+        self.running = False
+        self.lock = _thread.allocate_lock()
+        self.mailbox = None  # (tag, command, module) for core 1
+        self.result = None  # (tag, result) of the last served command
+        self.tag = 0  # of the last posted command
+        self.cycles = 0
+        self.errors = 0
+
+    def get_module_count(self):
+        return self.menu.get_module_count()
+
+    def start(self):
+        self.running = True
+        _thread.start_new_thread(self.poll_loop, ())
+        logger.info('poll loop started')
+
+    def stop(self):
+        self.running = False
+
+    def poll_loop(self):
+        next_update = time.ticks_ms()
+        while self.running:
+            try:
+                if self.cycle is None and time.ticks_diff(time.ticks_ms(), next_update) >= 0:
+                    next_update = time.ticks_add(time.ticks_ms(), self.interval_ms)
+                    self.cycle = PollCycle(self.menu, self.scheduler)
+                start = governor.mark()
+                transaction = self.scheduler.run_next(self.menu)
+                if self.cycle is not None and self.cycle.complete():
+                    cycle = self.cycle
+                    self.cycle = None
+                    self.buffer.fill(cycle.finish())
+                    self.cycles += 1
+                governor.account('poll', start)
+            except Exception as ex:
+                self.errors += 1
+                self.cycle = None
+                transaction = None
+                logger.exception(ex, 'poll loop')
+            self.serve_mailbox()
+            if transaction is None:
+                time.sleep_ms(5)
+
+    def serve_mailbox(self):
+        with self.lock:
+            request = self.mailbox
+            self.mailbox = None
+        if request is None:
+            return
+        try:
+            result = self.menu.process_command(request[1], request[2])
+        except BaseException as ex:  # e.g. SystemExit, the poll loop must survive any command
+            logger.exception(ex, 'mailbox command')
+            result = None
+        with self.lock:
+            self.result = (request[0], result)
+
+    def snapshot(self):
+        return self.buffer.read()
+
+    def get_metrics(self):
+        return self.scheduler.get_metrics()
+
+    def process_command(self, key, batt=0, timeout_ms=10000):
+        """ 'status' is answered from the published snapshot, single queries are
+            interactive transactions, other commands are executed by the poll loop
+            between two transactions
+        """
+        if key == 'status':
+            return self.snapshot()['Calculated']
+        if key == 'events':
+            return self.events.summary()
+        if not self.menu.is_command(key):
+            logger.warning(f'unknown command {key}')
+            return None
+        request = self.menu.command_request(key, batt)
+        if request is not None:
+            transaction = self.scheduler.request(INTERACTIVE, request[0], request[1])
+            start = time.ticks_ms()
+            while not transaction.done():
+                if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+                    logger.warning(f'command {key} timed out')
+                    return None
+                time.sleep_ms(2)
+            return transaction.result if transaction.status == OK else None
+        with self.lock:
+            self.tag += 1
+            tag = self.tag
+            self.mailbox = (tag, key, batt)
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            with self.lock:
+                result = self.result
+                if result is not None and result[0] == tag:
+                    self.result = None
+                    return result[1]
+            time.sleep_ms(5)
+        with self.lock:
+            if self.mailbox is not None and self.mailbox[0] == tag:
+                self.mailbox = None  # not taken yet, a late result of a taken one is ignored by its tag
+        logger.warning(f'command {key} timed out')
+        return None
+
+
+if __name__ == '__main__':
+    from simulated_uart import SimulatedUart, SimulatedStack
+    from pylontech_base import PylontechRS485
+    from menu import PylontechMenu
+    menu = PylontechMenu(4, pylon=PylontechRS485(uart=SimulatedUart(SimulatedStack(modules=4))))
+    poller = Core1Poller(menu, interval_ms=500)
+    poller.start()
+    time.sleep_ms(1200)
+    print(poller.snapshot()['Sequence'], poller.process_command('status'))
+    print(poller.process_command('serialnumber', 2))
+    print(poller.get_metrics())
+    poller.stop()
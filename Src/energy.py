@@ -0,0 +1,201 @@
+""" Incremental energy accounting of the modules and the stack.
+
+    Each new analog record of a module adds the charge and the energy since
+    the previous record of the module (trapezoidal rule on the timestamped
+    current and voltage samples) to counters for the day, the month and the
+    lifetime, separately for charging and discharging. The stack counters
+    are the sums of the module increments. Queries read the counters, O(1).
+
+    The counters are integers, the floats of the pico are single precision
+    and would lose the increments on large lifetime values:
+        charge  in 0.05 A*ms  ((i0 + i1) * dt with i in 0.1 A, dt in ms)
+        energy  in 0.05 mW*ms ((p0 + p1) * dt with p in 0.1 mW = mV * 0.1 A)
+    The stack has to be polled every POLL_INTERVAL_MS at least, with
+    the poller on core 1 or the fixed rate polls of the web server.
+    They are saved to flash at most every SAVE_INTERVAL_MS and at the change
+    of the day, atomically through a temporary file.
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict as Dict
+import logging
+logger = logging.getLogger('energy', 'energy.log')
+logger.setLevel(logging.INFO)
+
+ENERGY_FILE = 'energy.json'
+SAVE_INTERVAL_MS = 15 * 60 * 1000
+POLL_INTERVAL_MS = 10000  # the accounting needs an analog record of every module this often
+# no integration over a longer gap, e.g. a module which did not answer; several polls may be missed
+MAX_GAP_MS = 12 * POLL_INTERVAL_MS
+
+PERIODS = ('day', 'month', 'lifetime')
+DAY = 0
+MONTH = 1
+LIFETIME = 2
+# counters per period: charge in, charge out, energy in, energy out
+CHARGE_IN = 0
+CHARGE_OUT = 1
+ENERGY_IN = 2
+ENERGY_OUT = 3
+
+AH = 2 * 10 * 3600000  # counter units per Ah
+KWH = 2 * 10000 * 3600000 * 1000  # counter units per kWh
+
+
+def split(a, b, dt):
+    """ the positive and the negative area of the trapezoid from a to b, in (a + b) * dt units """
+    if a >= 0 and b >= 0:
+        return (a + b) * dt, 0
+    if a <= 0 and b <= 0:
+        return 0, -(a + b) * dt
+    # the sign changes: two triangles meeting at the zero crossing
+    total = abs(a) + abs(b)
+    positive = max(a, b) * max(a, b) * dt // total
+    negative = min(a, b) * min(a, b) * dt // total
+    return positive, negative
+
+
+class EnergyCounters:
+    """ day, month and lifetime counters of the modules and the stack (index `modules`) """
+
+    def __init__(self, modules=15, path=ENERGY_FILE, save_interval_ms=SAVE_INTERVAL_MS):
+        self.modules = modules
+        self.path = path
+        self.save_interval_ms = save_interval_ms
+        self.counters = [self.new_counters() for _ in range(modules + 1)]
+        self.last = [None] * modules  # (timestamp ms, mV, current in 0.1 A) of the last sample
+        self.day = None  # (year, month, day) of the day counters
+        self.saved = time.ticks_ms()
+        self.dirty = False
+        self.load()
+
+    @staticmethod
+    def new_counters():
+        return [[0, 0, 0, 0] for _ in PERIODS]
+
+    def update(self, batt, analog):
+        """ integrates from the last sample of the module to this analog record """
+        timestamp = analog.get('Timestamp')
+        if timestamp is None:
+            return
+        last = self.last[batt]
+        if last is not None and timestamp <= last[0]:
+            return  # the same record again, e.g. of a stale module
+        mv = int(analog['Voltage'] * 1000 + 0.5)
+        current = int(round(analog['Current'] * 10))
+        self.last[batt] = (timestamp, mv, current)
+        self.roll(timestamp)
+        if last is None:
+            return
+        dt = timestamp - last[0]
+        if dt > MAX_GAP_MS:
+            return
+        charge_in, charge_out = split(last[2], current, dt)
+        energy_in, energy_out = split(last[1] * last[2], mv * current, dt)
+        for counters in (self.counters[batt], self.counters[self.modules]):
+            for period in counters:
+                period[CHARGE_IN] += charge_in
+                period[CHARGE_OUT] += charge_out
+                period[ENERGY_IN] += energy_in
+                period[ENERGY_OUT] += energy_out
+        self.dirty = True
+
+    def roll(self, timestamp):
+        """ resets the day and month counters when the sample belongs to a new day or month """
+        t = time.localtime(timestamp // 1000)
+        day = (t[0], t[1], t[2])
+        if day == self.day:
+            return
+        if self.day is not None:
+            for counters in self.counters:
+                counters[DAY] = [0, 0, 0, 0]
+                if day[:2] != self.day[:2]:
+                    counters[MONTH] = [0, 0, 0, 0]
+            self.day = day
+            self.save()
+            return
+        self.day = day
+
+    def step(self):
+        """ saves the counters if they changed and the save interval passed """
+        if self.dirty and time.ticks_diff(time.ticks_ms(), self.saved) >= self.save_interval_ms:
+            self.save()
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'day': self.day, 'counters': self.counters}, f)
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            os.rename(tmp, self.path)
+            self.dirty = False
+        except OSError as ex:
+            logger.exception(ex, 'save energy counters')
+        self.saved = time.ticks_ms()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        counters = saved.get('counters', [])
+        # the stack counters stay the last entry if the number of modules changed
+        for i in range(min(len(counters) - 1, self.modules)):
+            self.counters[i] = counters[i]
+        if counters:
+            self.counters[self.modules] = counters[-1]
+        self.day = tuple(saved['day']) if saved.get('day') else None
+        logger.info(f'energy counters loaded, day {self.day}')
+
+    def totals(self, index=None, period=LIFETIME):
+        """ (charged Ah, discharged Ah, charged kWh, discharged kWh) of a module or the stack (None) """
+        counters = self.counters[self.modules if index is None else index][period]
+        return (counters[CHARGE_IN] / AH, counters[CHARGE_OUT] / AH,
+                counters[ENERGY_IN] / KWH, counters[ENERGY_OUT] / KWH)
+
+    def summary(self):
+        """ the stack counters for Calculated """
+        result = Dict()
+        for period in range(len(PERIODS)):
+            name = PERIODS[period].capitalize()
+            charged_ah, discharged_ah, charged_kwh, discharged_kwh = self.totals(None, period)
+            result[f'Charged{name}_kWh'] = round(charged_kwh, 3)
+            result[f'Discharged{name}_kWh'] = round(discharged_kwh, 3)
+        return result
+
+    def table(self, modules=None):
+        """ per module and for the stack: Ah and kWh of every period, for the API """
+        if modules is None:
+            modules = self.modules
+        result = Dict()
+        for index in list(range(modules)) + [None]:
+            row = Dict()
+            for period in range(len(PERIODS)):
+                values = self.totals(index, period)
+                row[PERIODS[period]] = [round(v, 3) for v in values]
+            result['stack' if index is None else str(index + 1)] = row
+        return result
+
+
+if __name__ == '__main__':
+    # one day of a module charging with 20 A and discharging with 10 A, sampled every 5 s
+    try:
+        import host_compat
+    except ImportError:
+        pass
+    counters = EnergyCounters(modules=1, path='energy_test.json')
+    start = 1700000000000
+    for n in range(17280):
+        current = 20.0 if n < 8640 else -10.0
+        counters.update(0, {'Timestamp': start + n * 5000, 'Voltage': 52.0, 'Current': current})
+    print(counters.table())
+    started = time.ticks_us()
+    for _ in range(1000):
+        counters.summary()
+    print(f'summary: {time.ticks_diff(time.ticks_us(), started) / 1000:.1f} us')
@@ -0,0 +1,181 @@
+""" Export of the history as CSV or InfluxDB line protocol over HTTP.
+
+    /export?from=<s>&to=<s>&metrics=soc,current&format=csv|influx
+    from and to are UTC seconds, the default is the last 24 hours, all
+    METRICS of history_store by default. The rows are formatted one by one
+    into a fixed output buffer which is sent as a chunk of
+    Transfer-Encoding: chunked whenever it is full, so an export of a day
+    or a week needs the buffer and the read buffer of the store only. The
+    records not yet flushed are read from the write buffer of the store, an
+    export does not write to the flash.
+    The values are written from the scaled integers without floats.
+"""
+
+from history_store import METRICS, METRIC_NAMES
+
+DAY_S = 86400
+MEASUREMENT = 'pylontech'
+CONTENT_TYPES = {'csv': 'text/csv', 'influx': 'text/plain'}
+
+
+def send_all(sock, data):
+    """ sends all of data, lwip may accept only a part of it with one send """
+    view = memoryview(data)
+    while len(view):
+        view = view[sock.send(view):]
+
+
+class ChunkedWriter:
+    """ collects bytes in the buffer and sends each full buffer as one chunk """
+
+    def __init__(self, sock, buffer):
+        self.sock = sock
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.used = 0
+        self.chunks = 0
+        self.bytes = 0
+
+    def write(self, data):
+        size = len(self.buffer)
+        start = 0
+        while start < len(data):
+            count = min(len(data) - start, size - self.used)
+            self.view[self.used:self.used + count] = data[start:start + count]
+            self.used += count
+            start += count
+            if self.used == size:
+                self.send_chunk()
+
+    def send_chunk(self):
+        if self.used:
+            send_all(self.sock, b'%X\r\n' % self.used)
+            send_all(self.sock, self.view[:self.used])
+            send_all(self.sock, b'\r\n')
+            self.chunks += 1
+            self.bytes += self.used
+            self.used = 0
+
+    def finish(self):
+        self.send_chunk()
+        send_all(self.sock, b'0\r\n\r\n')
+
+
+def fixed(value, scale):
+    """ the scaled integer as decimal text, e.g. 1234 with scale 100 -> '12.34' """
+    if scale == 1:
+        return str(value)
+    digits = len(str(scale)) - 1
+    sign = '-' if value < 0 else ''
+    whole, fraction = divmod(abs(value), scale)
+    return f'{sign}{whole}.{fraction:0{digits}d}'
+
+
+def parse_metrics(text):
+    """ indices into METRICS of a comma separated list of names
+    @raise ValueError  for an unknown name
+    """
+    if not text:
+        return list(range(len(METRICS)))
+    indices = []
+    for name in text.split(','):
+        if name not in METRIC_NAMES:
+            raise ValueError(f'unknown metric {name}')
+        indices.append(METRIC_NAMES.index(name))
+    return indices
+
+
+def csv_rows(rows, indices):
+    yield ('time,' + ','.join(METRICS[i][0] for i in indices) + '\n').encode()
+    for record in rows:
+        yield (str(record[0]) + ',' + ','.join(fixed(record[i + 1], METRICS[i][3]) for i in indices)
+               + '\n').encode()
+
+
+def influx_rows(rows, indices, measurement=MEASUREMENT):
+    """ lines with the time in seconds, written with precision=s """
+    for record in rows:
+        fields = ','.join(METRICS[i][0] + '=' + fixed(record[i + 1], METRICS[i][3]) for i in indices)
+        yield f'{measurement} {fields} {record[0]}\n'.encode()
+
+
+def send_export(cl, request, store, buffer, now):
+    """ answers /export of the HttpRequest from the HistoryStore with the output buffer
+    @param now  UTC in seconds, the end of the default range
+    """
+    try:
+        end = int(request.param(b'to', b'%d' % (now + 1)))
+        start = int(request.param(b'from', b'%d' % (end - DAY_S)))
+        indices = parse_metrics(request.param(b'metrics', b'').decode())
+        kind = request.param(b'format', b'csv').decode()
+        if kind not in CONTENT_TYPES:
+            raise ValueError(f'unknown format {kind}')
+    except ValueError as ex:
+        send_all(cl, f'HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Type: text/plain\r\n\r\n{ex}\n'.encode())
+        return None
+    send_all(cl, f'HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPES[kind]}\r\nTransfer-Encoding: chunked\r\n'
+             f'Connection: close\r\n\r\n'.encode())
+    rows = store.rows(start, end)
+    writer = ChunkedWriter(cl, buffer)
+    for line in (csv_rows(rows, indices) if kind == 'csv' else influx_rows(rows, indices)):
+        writer.write(line)
+    writer.finish()
+    return writer
+
+
+if __name__ == '__main__':
+    # a week of records, one day exported as CSV and as line protocol into a socket pair
+    import os
+    import socket
+    import time
+    import _thread
+    import host_compat
+    from history_store import HistoryStore
+    from http_request import HttpRequest
+    store = HistoryStore(directory='history_test')
+    start = 1700000000
+    for n in range(7 * 1440):
+        store.record({'Timestamp': (start + n * 60) * 1000, 'Remaining_%': 50 + n % 50, 'Current_Amp': -12.3,
+                      'Charging_Watt': -640.0, 'RemainingEnergy_kWh': 5.12, 'MinimumCellVoltage': 3.281,
+                      'MaximumCellVoltage': 3.305, 'CellImbalance_mV': 24.0, 'MinimumTemperature': -1.5,
+                      'MaximumTemperature': 23.0, 'ActiveAlarms': 0})
+    output = bytearray(512)
+    request = HttpRequest(bytearray(512))
+    for query in (f'from={start + 86400}&to={start + 2 * 86400}',
+                  f'from={start + 86400}&to={start + 2 * 86400}&format=influx&metrics=soc,current'):
+        client, server = socket.socketpair()
+        received = []
+
+        def read(sock):
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                received.append(data)
+
+        _thread.start_new_thread(read, (client,))
+        client.send(f'GET /export?{query} HTTP/1.1\r\n\r\n'.encode())
+        request.read(server)
+        started = time.ticks_ms()
+        writer = send_export(server, request, store, output, start + 7 * 86400)
+        duration = time.ticks_diff(time.ticks_ms(), started)
+        server.close()
+        time.sleep_ms(100)
+        body = b''.join(received)
+        header, _, chunked = body.partition(b'\r\n\r\n')
+        data = b''
+        while chunked:
+            size, _, chunked = chunked.partition(b'\r\n')
+            size = int(size, 16)
+            data += chunked[:size]
+            chunked = chunked[size + 2:]
+            if not size:
+                break
+        lines = data.decode().splitlines()
+        print(f'{query}: {len(lines)} lines, {writer.bytes} bytes in {writer.chunks} chunks of '
+              f'{len(output)} bytes, {duration} ms')
+        print('  ' + '\n  '.join(lines[:2]))
+        client.close()
+    for day in store.days():
+        os.remove(store.path(day))
+    os.rmdir(store.directory)
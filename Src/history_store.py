@@ -0,0 +1,188 @@
+""" History of the stack values on the flash of the pico.
+
+    Every SAMPLE_INTERVAL_MS the values of METRICS are taken from the stack
+    status and appended as a fixed-size record to the file of the day,
+    history/YYYYMMDD.bin; the files of the last MAX_DAYS days are kept.
+    A record is the UTC in seconds (I) followed by the metrics as scaled
+    integers, little endian. The records are collected in a preallocated
+    buffer and written FLUSH_RECORDS at a time, which spares the flash.
+    rows() reads a time range back through a fixed read buffer, see export.
+    Under memory pressure shed() writes the pending records and frees the
+    read buffer until the next export.
+"""
+
+import os
+import struct
+import time
+from collections import OrderedDict as Dict
+import logging
+logger = logging.getLogger('history', 'history.log')
+logger.setLevel(logging.INFO)
+
+HISTORY_DIR = 'history'
+SAMPLE_INTERVAL_MS = 60000
+MAX_DAYS = 7  # about 30 kB per day
+FLUSH_RECORDS = 16
+READ_RECORDS = 32
+
+# name, key of the stack status, struct format, scale of the stored integer
+METRICS = (
+    ('soc', 'Remaining_%', 'H', 10),
+    ('current', 'Current_Amp', 'h', 10),
+    ('power', 'Charging_Watt', 'i', 1),
+    ('remaining_energy', 'RemainingEnergy_kWh', 'I', 1000),
+    ('cell_min', 'MinimumCellVoltage', 'H', 1000),
+    ('cell_max', 'MaximumCellVoltage', 'H', 1000),
+    ('imbalance', 'CellImbalance_mV', 'H', 10),
+    ('temperature_min', 'MinimumTemperature', 'h', 10),
+    ('temperature_max', 'MaximumTemperature', 'h', 10),
+    ('alarms', 'ActiveAlarms', 'B', 1),
+)
+METRIC_NAMES = tuple(metric[0] for metric in METRICS)
+RECORD = '<I' + ''.join(metric[2] for metric in METRICS)
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+def day_name(seconds):
+    t = time.localtime(seconds)
+    return '{:04d}{:02d}{:02d}'.format(t[0], t[1], t[2])
+
+
+class HistoryStore:
+    """ day files of the stack records with a write and a read buffer """
+
+    def __init__(self, directory=HISTORY_DIR, interval_ms=SAMPLE_INTERVAL_MS, max_days=MAX_DAYS):
+        self.directory = directory
+        self.interval_ms = interval_ms
+        self.max_days = max_days
+        self.buffer = bytearray(FLUSH_RECORDS * RECORD_SIZE)
+        self.pending = 0  # records in the buffer
+        self.day = None  # day of the records in the buffer
+        self.read_buffer = bytearray(READ_RECORDS * RECORD_SIZE)
+        self.sampled = None
+        self.last_timestamp = 0
+        self.records = 0
+        self.errors = 0
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # exists
+
+    def step(self, status):
+        """ takes a sample of the stack status every interval
+        @param status  function returning the Calculated values of the last poll, it must not poll
+        """
+        now = time.ticks_ms()
+        if self.sampled is not None and time.ticks_diff(now, self.sampled) < self.interval_ms:
+            return
+        self.sampled = now
+        calculated = status()
+        if calculated:
+            self.record(calculated)
+
+    def record(self, calculated):
+        """ appends the metrics of a stack status, once per status """
+        timestamp = calculated.get('Timestamp')
+        if not timestamp or timestamp // 1000 <= self.last_timestamp:
+            return
+        seconds = timestamp // 1000
+        day = day_name(seconds)
+        if day != self.day:
+            self.flush()
+            self.day = day
+        values = [seconds]
+        for name, key, fmt, scale in METRICS:
+            values.append(int(round((calculated.get(key) or 0) * scale)))
+        try:
+            struct.pack_into(RECORD, self.buffer, self.pending * RECORD_SIZE, *values)
+        except (OverflowError, struct.error) as ex:  # a value out of the range of its format
+            self.errors += 1
+            logger.warning(f'record {seconds}: {ex}')
+            return
+        self.last_timestamp = seconds
+        self.pending += 1
+        self.records += 1
+        if self.pending == FLUSH_RECORDS:
+            self.flush()
+
+    def path(self, day):
+        return f'{self.directory}/{day}.bin'
+
+    def days(self):
+        """ names of the stored days, oldest first """
+        return sorted(name[:8] for name in os.listdir(self.directory) if name.endswith('.bin'))
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            with open(self.path(self.day), 'ab') as f:
+                f.write(memoryview(self.buffer)[:self.pending * RECORD_SIZE])
+            self.pending = 0
+            days = self.days()
+            for day in days[:-self.max_days]:
+                os.remove(self.path(day))
+        except OSError as ex:
+            self.errors += 1
+            self.pending = 0  # the buffer is needed for the next records
+            logger.exception(ex, 'history flush')
+
+    def shed(self):
+        """ frees the read buffer and writes the pending records, for the memory governor """
+        self.flush()
+        self.read_buffer = None
+
+    def rows(self, start, end):
+        """ generator of the records (seconds, metric values...) with start <= seconds < end,
+            the stored ones and those still in the buffer, as scaled integers
+        """
+        first = day_name(start)
+        last = day_name(end - 1)
+        if self.read_buffer is None:
+            self.read_buffer = bytearray(READ_RECORDS * RECORD_SIZE)
+        buffer = self.read_buffer
+        for day in self.days():
+            if day < first or day > last:
+                continue
+            with open(self.path(day), 'rb') as f:
+                count = f.readinto(buffer) // RECORD_SIZE
+                while count:
+                    for i in range(count):
+                        record = struct.unpack_from(RECORD, buffer, i * RECORD_SIZE)
+                        if record[0] >= end:
+                            return  # the records ascend, the buffer is newer still
+                        if record[0] >= start:
+                            yield record
+                    count = f.readinto(buffer) // RECORD_SIZE
+        for i in range(self.pending):
+            record = struct.unpack_from(RECORD, self.buffer, i * RECORD_SIZE)
+            if start <= record[0] < end:
+                yield record
+
+    def status(self):
+        result = Dict()
+        result['days'] = self.days()
+        result['records'] = self.records
+        result['pending'] = self.pending
+        result['errors'] = self.errors
+        result['last'] = self.last_timestamp
+        return result
+
+
+if __name__ == '__main__':
+    # a week of records every minute written and read back
+    import host_compat
+    store = HistoryStore(directory='history_test', interval_ms=0)
+    start = 1700000000
+    for n in range(7 * 1440):
+        store.record({'Timestamp': (start + n * 60) * 1000, 'Remaining_%': 50 + n % 50, 'Current_Amp': -12.3,
+                      'Charging_Watt': -640.0, 'RemainingEnergy_kWh': 5.12, 'MinimumCellVoltage': 3.281,
+                      'MaximumCellVoltage': 3.305, 'CellImbalance_mV': 24.0, 'MinimumTemperature': 19.5,
+                      'MaximumTemperature': 23.0, 'ActiveAlarms': 0})
+    print(store.status())
+    started = time.ticks_ms()
+    count = sum(1 for _ in store.rows(start + 86400, start + 2 * 86400))
+    print(f'{count} records of a day read in {time.ticks_diff(time.ticks_ms(), started)} ms')
+    for day in store.days():
+        os.remove(store.path(day))
+    os.rmdir(store.directory)
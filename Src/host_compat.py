@@ -0,0 +1,65 @@
+""" MicroPython functions which CPython lacks.
+
+    Importing this module on a host adds the ticks/sleep functions of the
+    MicroPython time module and sys.print_exception, so the protocol code can
+    run on a PC with a simulated UART. On the pico it does nothing.
+"""
+
+import sys
+import time
+import gc
+
+if not hasattr(time, 'ticks_us'):
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_ms():
+        return time.perf_counter_ns() // 1000000
+
+    def ticks_diff(new, old):
+        return new - old
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def sleep_us(us):
+        time.sleep(us / 1000000)
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+    time.ticks_us = ticks_us
+    time.ticks_ms = ticks_ms
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    time.sleep_us = sleep_us
+    time.sleep_ms = sleep_ms
+
+if not hasattr(gc, 'mem_free'):
+    # the heap of the pico W with the network stack, allocations are counted while tracemalloc runs
+    import tracemalloc
+    HEAP_SIZE = 192 * 1024
+    gc_threshold = [-1]
+
+    def mem_alloc():
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def mem_free():
+        return max(HEAP_SIZE - mem_alloc(), 0)
+
+    def threshold(amount=None):
+        if amount is None:
+            return gc_threshold[0]
+        gc_threshold[0] = amount
+
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = mem_free
+    gc.threshold = threshold
+
+if not hasattr(sys, 'print_exception'):
+    import traceback
+
+    def print_exception(exception, file=sys.stderr):
+        traceback.print_exception(type(exception), exception, exception.__traceback__, file=file)
+
+    sys.print_exception = print_exception
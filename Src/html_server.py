@@ -1,18 +1,107 @@
 import time
-import network
+BOOT_START = time.ticks_ms()
 import socket
-from machine import UART, Pin, RTC, reset
+import select
+import json
+from machine import reset
 from wlan import Wifi, led_off
-import menu
+from startup import Boot
+from wifi_supervisor import WifiSupervisor
+from clock import wall_clock, NtpClient
+from memory import governor
+from pylontech_base import PylontechRS485
+from http_request import HttpRequest
+from static_assets import StaticAssets, CHUNK
+from history_store import HistoryStore
+from export import send_export
+from energy import POLL_INTERVAL_MS
 import logging
-import memory
 
 #logger = logging.getLogger('html','html.log')
 logger = logging.getLogger('html')
 
-"""connect to the local network and init (RTC) time fro a timeserver"""
-wlan = Wifi()
-menu = menu.PylontechMenu()
+# poll the batteries on core 1, the web server then only reads published snapshots
+CORE1_POLLING = False
+# raw access to the bus for other tools over TCP, see rs485_bridge
+RS485_BRIDGE = False
+WIFI_TIMEOUT_MS = 10000
+HTTP_BUFFER = 2048  # request line and headers of a browser
+CLIENT_TIMEOUT_S = 5  # a client which sends nothing must not stop the loop
+EXPORT_BUFFER = 1024  # one chunk of an /export answer
+
+# the web server listens first, wifi, time and the battery bus are started
+# as stages of the boot while it answers
+boot = Boot(BOOT_START)
+# the long-lived buffers are allocated before wifi and the sockets fragment the heap
+pylon = PylontechRS485(baud=115200)  # the UART with its receive ring
+http_buffer = governor.reserve('http', HTTP_BUFFER)
+assets = StaticAssets(buffer=governor.reserve('static', CHUNK))
+export_buffer = governor.reserve('export', EXPORT_BUFFER)
+# the stack values every minute on the flash, its read buffer is optional
+history = HistoryStore()
+governor.register('history', history.shed, 2)
+polled = None  # ticks of the last poll without the poller on core 1
+wlan = None
+supervisor = None
+ntp = None
+menu = None
+bridge = None
+
+def start_wifi():
+    """connect to the local network, the supervisor joins it and retries with backoff"""
+    global wlan, supervisor
+    wlan = Wifi(connect=False)
+    # stepped by the server loop from now on, it also watches and reconnects the link
+    supervisor = WifiSupervisor(wlan, join=True)
+    start = time.ticks_ms()
+    waiting = True
+    while not supervisor.connected():
+        if waiting and time.ticks_diff(time.ticks_ms(), start) > WIFI_TIMEOUT_MS:
+            waiting = False
+            logger.warning(f"no network yet: {supervisor.last_error}, retrying")
+        yield
+
+def start_ntp():
+    """init (RTC) time from a timeserver, the server loop resyncs it every hour"""
+    global ntp
+    client = NtpClient(wall_clock, set_rtc=wlan.set_rtc)
+    try:
+        client.resolve()  # once here, the resyncs of the server loop use the address
+    except OSError as ex:
+        logger.warning(f"ntp: {ex}")
+    yield
+    while not client.step():
+        if client.failures >= 3:
+            ntp = client  # keeps trying in the server loop
+            raise RuntimeError("no answer of the time server")
+        yield
+    ntp = client
+
+def start_bus():
+    """probe the battery modules, one module per step"""
+    global menu, bridge
+    import menu as menu_module
+    bus = menu_module.PylontechMenu(pylon=pylon, probe=False)
+    # optional under memory pressure: a running capture first, then the decoded frames
+    governor.register('capture', pylon.stop_capture, 0)
+    governor.register('frames', bus.clear_frame_cache, 1)
+    for _ in bus.discover():
+        yield
+    if CORE1_POLLING:
+        import core1_poller
+        bus = core1_poller.Core1Poller(bus)
+        bus.start()
+    if RS485_BRIDGE:
+        from rs485_bridge import Rs485Bridge
+        if CORE1_POLLING:
+            bridge = Rs485Bridge(bus.scheduler)  # the poller runs the transactions on core 1
+        else:
+            bridge = Rs485Bridge(menu=bus)
+    menu = bus
+
+boot.add('wifi', start_wifi)
+boot.add('ntp', start_ntp, ('wifi',))
+boot.add('bus', start_bus)
 
 def print_dict(d : Dict):
     for key in d:
@@ -84,8 +173,12 @@ def make_html(data, command, battery):
              '<label>Choose a command and battery:</label>'\
              '<input type="submit" value="Request"></form>'
            
-    html_com = make_command_select(menu.CID,command)
-    html_bat = make_battery_select(menu.get_module_count(),battery)
+    if menu is None:
+        html_com = make_command_select([], command)
+        html_bat = make_battery_select(0, battery)
+    else:
+        html_com = make_command_select(menu.CID,command)
+        html_bat = make_battery_select(menu.get_module_count(),battery)
   
     html_table = make_table(head,table)
     
@@ -107,66 +200,196 @@ except Exception as ex:
     logger.exception(ex,"socket exception")
     led_off()
     s.close()
-    machine.soft_reset()
+    reset()
     raise RuntimeError(ex)
 
 
+JSON_HEADER = "HTTP/1.0 200 OK\r\nContent-type: application/json\r\n\r\n"
+
+def send_ready(cl, request):
+    ready = boot.ready('bus') and not boot.busy()
+    cl.send("HTTP/1.0 200 OK\r\n" if ready else "HTTP/1.0 503 Service Unavailable\r\n")
+    cl.send("Content-type: application/json\r\n\r\n")
+    cl.send(json.dumps(boot.status()))
+    boot.answered()
+
+def send_time(cl, request):
+    status = ntp.status() if ntp is not None else wall_clock.status()
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(status))
+
+def send_events(cl, request):
+    """/events?since=<seq> returns the alarm events after the sequence number"""
+    since = int(request.param(b'since', b'0'))
+    events = menu.events.events(since) if menu is not None else []
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(events))
+
+def send_energy(cl, request):
+    table = menu.process_command('energy') if menu is not None else {}
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(table))
+
+def send_memory(cl, request):
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(governor.status()))
+
+def send_bridge(cl, request):
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(bridge.status() if bridge is not None else {}))
+
+def send_history(cl, request):
+    """/export?from=<s>&to=<s>&metrics=<names>&format=csv|influx streams the history"""
+    send_export(cl, request, history, export_buffer, wall_clock.epoch_ms() // 1000)
+
+def send_wifi(cl, request):
+    metrics = supervisor.get_metrics() if supervisor is not None else {}
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(metrics))
+
+def send_data(cl, request):
+    """the data of the dashboard, /data?command=<command>&battery=<module number>"""
+    command = request.param(b'command', b'status').decode()
+    battery = int(request.param(b'battery', b'1'))
+    data = {'command': command, 'battery': battery, 'ready': menu is not None}
+    if menu is None:
+        data['commands'] = []
+        data['modules'] = 0
+        data['result'] = {name: stage['state'] for name, stage in boot.status()['stages'].items()}
+    else:
+        data['commands'] = menu.CID
+        data['modules'] = menu.get_module_count()
+        data['result'] = stack_status() if command == 'status' else menu.process_command(command, battery - 1)
+    cl.send(JSON_HEADER)
+    cl.send(json.dumps(data))
+    boot.answered()
+
+def send_page(cl, request):
+    """the html page of a command, /?command=<command>&battery=<module number>,
+       generated when the precompressed dashboard of www is missing"""
+    command = request.param(b'command', b'status').decode()
+    battery = int(request.param(b'battery', b'1')) - 1
+    if menu is None:
+        # still starting, show the state of the boot stages
+        result_dict = {}
+        for name, stage in boot.status()['stages'].items():
+            result_dict[name] = stage['state']
+    elif command == 'status':
+        result_dict = stack_status()
+    else:
+        result_dict = menu.process_command(command, battery)
+    response = make_html(result_dict,command, battery)
+    logger.debug(response)
+    cl.send("HTTP/1.0 200 OK\r\nContent-type: text/html\r\n\r\n")
+    cl.send(response)
+    boot.answered()
+
+# path -> handler(client socket, HttpRequest), other paths are static files or the html page
+ROUTES = {
+    b'/data': send_data,
+    b'/ready': send_ready,
+    b'/time': send_time,
+    b'/events': send_events,
+    b'/energy': send_energy,
+    b'/memory': send_memory,
+    b'/wifi': send_wifi,
+    b'/bridge': send_bridge,
+    b'/export': send_history,
+}
+
+request = HttpRequest(http_buffer)
+
+def stack_status():
+    """ the stack values of the last poll, only poll() and the poller on core 1 drive the bus """
+    if CORE1_POLLING:
+        return menu.process_command('status')  # the published snapshot
+    return menu.pylonData['Calculated']
+
+def poll():
+    """ without the poller on core 1 the stack is polled at a fixed rate, the energy
+        accounting integrates between the polls
+    """
+    global polled
+    if CORE1_POLLING:
+        return
+    now = time.ticks_ms()
+    if polled is not None and time.ticks_diff(now, polled) < POLL_INTERVAL_MS:
+        return
+    polled = now
+    start = governor.mark()
+    menu.update()
+    governor.account('poll', start)
+
 def main():
     logger.setLevel(logging.INFO)
     #logger.setLevel(logger.INFO)
     #memory.memory_thread()
     STOP = False
-    command = 'status'
-    battery = 1
-    command_dict = {}
-    wlan.create_heartbeat()
+    listener = select.poll()
+    listener.register(s, select.POLLIN)
     while not STOP:
         logger.debug("Listen for connections")
+        cl = None
         try:
+            if boot.busy():
+                start = governor.mark()
+                boot.step()
+                governor.account('boot', start)
+            if supervisor is not None:
+                supervisor.step()
+            if ntp is not None:
+                ntp.step()
+            wall_clock.step()
+            governor.step()
+            if bridge is not None:
+                bridge.step()
+            if menu is not None:
+                poll()
+                history.step(stack_status)
+            if not listener.poll(5 if boot.busy() else 50):
+                continue
             logger.info("listening on" + str(addr))
             cl, addr_cl = s.accept()
-            cl_file = cl.makefile("rwb", 0)
+            cl.settimeout(CLIENT_TIMEOUT_S)
+            request_start = governor.mark()
             logger.info("\r\nclient connected from" + str( addr_cl))
-            line = cl_file.readline()
-            logger.debug(line)
-            if line.startswith(b'GET') and b'?' in line:
-                str1 = str(line,'utf-8')
-                result = str1.split()[1].split('?')
-                if len(result) > 1:
-                    requests = result[1].split('&')
-                    for el in requests:
-                        spl = (el.split('='))
-                        command_dict[spl[0]] = spl[1]
-                        if 'command' in command_dict:
-                            command = command_dict['command']
-                        if 'battery' in command_dict:
-                            battery = int(command_dict['battery'])-1
-            while True:
-                line = cl_file.readline()
-                logger.debug(f"readline={line}")
-                if not line or line == b"\r\n":
-                    break
-            result_dict = menu.process_command(command, battery)
-            response = make_html(result_dict,command, battery) 
-            logger.debug(response)
-            cl.send("HTTP/1.0 200 OK\r\nContent-type: text/html\r\n\r\n")
-            cl.send(response)
+            try:
+                if not request.read(cl):
+                    continue
+            except ValueError as ex:
+                logger.warning(f'bad request: {ex}')
+                cl.send("HTTP/1.0 400 Bad Request\r\n\r\n")
+                continue
+            path = request.get_path()
+            logger.debug(path)
+            handler = ROUTES.get(path)
+            if handler is not None:
+                handler(cl, request)
+                continue
+            asset = assets.find(path)
+            if asset is not None:
+                assets.send(cl, asset, request)
+                boot.answered()
+            else:
+                send_page(cl, request)
         except OSError as ex:
             logger.exception(ex,'OSError')
         except KeyboardInterrupt:
             logger.info("Keyboard Interrupt")
             STOP = True
             s.close()
-            wlan.stop_heartbeat()
-            wlan.disconnect()
+            if wlan is not None:
+                wlan.disconnect()
             raise SystemExit
         except Exception as ex:
             logger.exception(ex,'Exception in server loop')
         except BaseException as ex:
             logger.exception(ex,'BaseException in server loop')
         finally:
-            logger.info("closing connection")
-            cl.close()
+            if cl is not None:
+                logger.info("closing connection")
+                cl.close()
+                governor.account('http', request_start)
 
 
 if __name__ == "__main__":
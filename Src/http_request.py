@@ -0,0 +1,251 @@
+""" HTTP request parser on a reusable buffer.
+
+    The request is read with readinto into one preallocated bytearray, see
+    memory.governor, and parsed in place: the method, the path, the query
+    and the headers of HEADERS are kept as offsets into the buffer. Only
+    the values asked for are copied, e.g. the path for the lookup in the
+    route table of the web server. The scan for the end of the header is
+    compiled with @micropython.viper on the pico like the checksum kernels,
+    elsewhere bytes.find is used on a copy of the searched range.
+"""
+
+
+# headers whose values are kept, lower case
+HEADERS = (b'accept-encoding', b'connection', b'content-length', b'if-none-match')
+SPACE = 0x20
+QUESTION = 0x3f
+AMPERSAND = 0x26
+EQUALS = 0x3d
+COLON = 0x3a
+CR = 0x0d
+LF = 0x0a
+
+
+def _header_end_py(buf, start, end):
+    """ index after the empty line which ends the header, -1 if it is not yet received;
+        searches a bytes copy, the bytearray of MicroPython has no find()
+    """
+    i = bytes(memoryview(buf)[start:end]).find(b'\r\n\r\n')
+    return -1 if i < 0 else start + i + 4
+
+
+def _find_py(buf, start, end, byte):
+    i = bytes(memoryview(buf)[start:end]).find(bytes((byte,)))
+    return -1 if i < 0 else start + i
+
+
+try:
+    import micropython
+
+    # the literal decorator: the compiler of MicroPython only knows @micropython.viper
+    @micropython.viper
+    def _header_end_viper(buf, start: int, end: int) -> int:
+        p = ptr8(buf)
+        i = start
+        while i < end - 3:
+            if p[i] == 13 and p[i + 1] == 10 and p[i + 2] == 13 and p[i + 3] == 10:
+                return i + 4
+            i += 1
+        return -1
+
+    @micropython.viper
+    def _find_viper(buf, start: int, end: int, byte: int) -> int:
+        p = ptr8(buf)
+        i = start
+        while i < end:
+            if p[i] == byte:
+                return i
+            i += 1
+        return -1
+
+    header_end = _header_end_viper
+    find = _find_viper
+except (ImportError, AttributeError):
+    micropython = None
+    header_end = _header_end_py
+    find = _find_py
+
+
+def _strip(buf, start, end):
+    """ offsets without the spaces and the CR around the value """
+    while start < end and buf[start] == SPACE:
+        start += 1
+    while end > start and (buf[end - 1] == SPACE or buf[end - 1] == CR):
+        end -= 1
+    return start, end
+
+
+def _equals(buf, start, end, name):
+    if end - start != len(name):
+        return False
+    for i in range(len(name)):
+        if buf[start + i] != name[i]:
+            return False
+    return True
+
+
+def _is_name(buf, start, end, name):
+    """ compares a header name in the buffer case insensitive with a lower case name """
+    if end - start != len(name):
+        return False
+    for i in range(len(name)):
+        if buf[start + i] | 0x20 != name[i]:
+            return False
+    return True
+
+
+class HttpRequest:
+    """ one request at a time in the buffer, read() starts the next one """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.length = 0
+        self.header_length = 0
+        self.method = (0, 0)
+        self.path = (0, 0)
+        self.query = (0, 0)
+        self.headers = [None] * len(HEADERS)  # (start, end) of the values
+
+    def read(self, sock):
+        """ reads until the end of the header and parses it
+        @return  False if the client closed the connection before
+        @raise ValueError  if the header does not fit into the buffer or the request line is invalid
+        """
+        readinto = sock.readinto if hasattr(sock, 'readinto') else sock.recv_into
+        size = len(self.buffer)
+        received = 0
+        end = -1
+        while end < 0:
+            if received == size:
+                raise ValueError('request header too large')
+            count = readinto(self.view[received:])
+            if not count:
+                return False
+            end = header_end(self.buffer, max(received - 3, 0), received + count)
+            received += count
+        self.length = received
+        self.header_length = end
+        self.parse()
+        return True
+
+    def parse(self):
+        buf = self.buffer
+        end = self.header_length
+        line_end = find(buf, 0, end, LF)
+        first = find(buf, 0, line_end, SPACE)
+        second = find(buf, first + 1, line_end, SPACE) if first >= 0 else -1
+        if second < 0:
+            raise ValueError('invalid request line')
+        self.method = (0, first)
+        question = find(buf, first + 1, second, QUESTION)
+        if question < 0:
+            self.path = (first + 1, second)
+            self.query = (second, second)
+        else:
+            self.path = (first + 1, question)
+            self.query = (question + 1, second)
+        headers = self.headers
+        for i in range(len(headers)):
+            headers[i] = None
+        start = line_end + 1
+        while start < end:
+            line_end = find(buf, start, end, LF)
+            colon = find(buf, start, line_end, COLON)
+            if colon > 0:
+                for i in range(len(HEADERS)):
+                    if _is_name(buf, start, colon, HEADERS[i]):
+                        headers[i] = _strip(buf, colon + 1, line_end)
+                        break
+            start = line_end + 1
+
+    def get_method(self):
+        return bytes(self.view[self.method[0]:self.method[1]])
+
+    def get_path(self):
+        return bytes(self.view[self.path[0]:self.path[1]])
+
+    def param(self, name, default=None):
+        """ value of a query parameter as bytes, name as bytes """
+        buf = self.buffer
+        start, end = self.query
+        while start < end:
+            stop = find(buf, start, end, AMPERSAND)
+            if stop < 0:
+                stop = end
+            equals = find(buf, start, stop, EQUALS)
+            if equals >= 0 and _equals(buf, start, equals, name):
+                return bytes(self.view[equals + 1:stop])
+            start = stop + 1
+        return default
+
+    def header(self, name, default=None):
+        """ value of one of the HEADERS as bytes, name in lower case """
+        offsets = self.headers[HEADERS.index(name)]
+        if offsets is None:
+            return default
+        return bytes(self.view[offsets[0]:offsets[1]])
+
+    def accepts(self, encoding):
+        """ True if the client accepts the content encoding, e.g. b'gzip' """
+        offsets = self.headers[0]
+        if offsets is None:
+            return False
+        return bytes(self.view[offsets[0]:offsets[1]]).find(encoding) >= 0
+
+
+if __name__ == '__main__':
+    # requests per second of this parser against the makefile/readline/split parser it replaced,
+    # both read from a connected socket pair like from a client of the web server
+    import socket
+    import time
+    try:
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+    except AttributeError:
+        ticks_us = lambda: int(time.perf_counter() * 1000000)
+        ticks_diff = lambda a, b: a - b
+
+    REQUEST = (b'GET /?command=analog&battery=3 HTTP/1.1\r\n'
+               b'Host: 192.168.178.40\r\n'
+               b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n'
+               b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+               b'Accept-Language: de,en-US;q=0.7,en;q=0.3\r\n'
+               b'Accept-Encoding: gzip, deflate\r\n'
+               b'Connection: keep-alive\r\n'
+               b'Upgrade-Insecure-Requests: 1\r\n\r\n')
+
+    def readline_parser(cl):
+        cl_file = cl.makefile("rwb", 0)
+        line = cl_file.readline()
+        command_dict = {}
+        str1 = str(line, 'utf-8')
+        result = str1.split()[1].split('?')
+        if len(result) > 1:
+            for el in result[1].split('&'):
+                spl = el.split('=')
+                command_dict[spl[0]] = spl[1]
+        while True:
+            line = cl_file.readline()
+            if not line or line == b"\r\n":
+                break
+        return command_dict['command'], int(command_dict['battery']) - 1
+
+    request = HttpRequest(bytearray(1024))
+
+    def buffer_parser(cl):
+        request.read(cl)
+        request.get_path()
+        return request.param(b'command'), int(request.param(b'battery')) - 1
+
+    client, server = socket.socketpair()
+    for name, parser in (('readline', readline_parser), ('readinto', buffer_parser)):
+        runs = 2000
+        start = ticks_us()
+        for _ in range(runs):
+            client.send(REQUEST)
+            result = parser(server)
+        duration = ticks_diff(ticks_us(), start)
+        print(f'{name}: {runs * 1000000 // duration} requests/s {result}')
+    print(request.get_method(), request.get_path(), request.header(b'connection'), request.accepts(b'gzip'))
+    print('viper kernels' if micropython is not None else 'pure python kernels')
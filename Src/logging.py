@@ -3,6 +3,10 @@
 import sys
 import time
 import os
+try:
+    from micropython import const
+except ImportError:
+    const = lambda x: x
 
 DEFAULT= "Geen bericht, goed bericht"
 
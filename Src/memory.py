@@ -1,3 +1,14 @@
+""" Memory of the pico: logging of the sram and the flash, and the governor.
+
+    MemoryGovernor preallocates the long-lived buffers at boot, before wifi
+    and the sockets fragment the heap, and tunes gc.threshold to the largest
+    allocation of one step of a subsystem: a collection then runs about
+    every second step instead of when the heap is exhausted, short and with
+    less fragmentation. When the free heap falls below LOW_WATER after a
+    collection the registered optional caches are shed, the cheapest first,
+    before an allocation of the poller fails.
+"""
+
 import logging
 logger = logging.getLogger("memory","memory.log")
 logger.setLevel(logging.INFO)
@@ -7,6 +18,9 @@ import gc
 import os
 import time
 import _thread
+from collections import OrderedDict as Dict
+if not hasattr(gc, 'mem_free'):
+    import host_compat
 
 KILO = 1000
 STOP = False
@@ -49,13 +63,138 @@ def memory_thread():
        STOP = True
        thr.exit()
 
-        
+
+
+LOW_WATER = 24 * 1024  # free heap below which the caches are shed
+MIN_THRESHOLD = 4 * 1024
+CHECK_INTERVAL_MS = 1000
+
+
+class MemoryGovernor:
+    """ preallocated buffers, high-water marks per subsystem and shedding of caches """
+
+    def __init__(self, low_water=LOW_WATER, check_interval_ms=CHECK_INTERVAL_MS):
+        self.low_water = low_water
+        self.check_interval_ms = check_interval_ms
+        self.buffers = Dict()
+        self.objects = Dict()  # long-lived structures which are not plain buffers
+        self.high_water = Dict()  # subsystem -> largest allocation of one step in bytes
+        self.shedders = []  # (priority, name, function)
+        self.shed_counts = Dict()
+        self.threshold = None
+        self.min_free = gc.mem_free()
+        self.collections = 0
+        self.pressure = 0  # checks which found the heap below low_water after a collection
+        self.checked = time.ticks_ms()
+
+    def reserve(self, name, size):
+        """ the buffer of the name, allocated on the first call """
+        buffer = self.buffers.get(name)
+        if buffer is None or len(buffer) < size:
+            buffer = bytearray(size)
+            self.buffers[name] = buffer
+        return buffer
+
+    def preallocate(self, name, create):
+        """ the long-lived object of the name, made by create() on the first call """
+        value = self.objects.get(name)
+        if value is None:
+            value = create()
+            self.objects[name] = value
+        return value
+
+    @staticmethod
+    def mark():
+        """ start of a measured step, see account() """
+        return gc.mem_alloc()
+
+    def account(self, name, start):
+        """ keeps the high-water mark of the bytes allocated since mark().
+            A collection in between makes the difference negative, it is ignored;
+            the allocations of the other core are counted, too.
+        """
+        allocated = gc.mem_alloc() - start
+        if allocated > self.high_water.get(name, 0):
+            self.high_water[name] = allocated
+
+    def register(self, name, shed, priority=0):
+        """ shed() frees an optional cache, lower priorities are shed first """
+        self.shedders.append((priority, name, shed))
+        self.shedders.sort(key=lambda entry: entry[0])
+        self.shed_counts[name] = 0
+
+    def step(self):
+        """ checks the free heap every check_interval_ms, sheds caches under pressure """
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.checked) < self.check_interval_ms:
+            return
+        self.checked = now
+        free = gc.mem_free()
+        if free < self.low_water:
+            gc.collect()
+            self.collections += 1
+            free = gc.mem_free()
+            if free < self.low_water:
+                self.pressure += 1
+                free = self.shed(free)
+        self.min_free = min(self.min_free, free)
+        self.tune(free)
+
+    def shed(self, free):
+        for priority, name, shed in self.shedders:
+            try:
+                shed()
+            except Exception as ex:
+                logger.exception(ex, f'shed {name}')
+            self.shed_counts[name] += 1
+            gc.collect()
+            self.collections += 1
+            free = gc.mem_free()
+            logger.warning(f'memory pressure: shed {name}, {free} bytes free')
+            if free >= self.low_water:
+                break
+        return free
+
+    def tune(self, free):
+        """ threshold twice the largest step, at most half of the free heap """
+        largest = max(self.high_water.values()) if self.high_water else 0
+        threshold = max(MIN_THRESHOLD, min(2 * largest, free // 2))
+        if self.threshold is None or abs(threshold - self.threshold) > self.threshold // 4:
+            gc.threshold(threshold)
+            self.threshold = threshold
+
+    def status(self):
+        result = Dict()
+        result['free'] = gc.mem_free()
+        result['allocated'] = gc.mem_alloc()
+        result['min_free'] = self.min_free
+        result['low_water'] = self.low_water
+        result['threshold'] = self.threshold
+        result['collections'] = self.collections
+        result['pressure'] = self.pressure
+        result['buffers'] = Dict((name, len(buffer)) for name, buffer in self.buffers.items())
+        result['objects'] = list(self.objects)
+        result['high_water'] = self.high_water
+        result['shed'] = self.shed_counts
+        return result
+
+
+# the governor of the application, shared by the web server and the poller
+governor = MemoryGovernor()
+
+
 if __name__ == '__main__':
-    try:
-        thr=memory_thread()
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        STOP = True
-        #thr.exit()
+    import tracemalloc
+    tracemalloc.start()
+    cache = {}
+    governor.check_interval_ms = 0
+    governor.low_water = gc.mem_free() - 100 * 1024  # pressure after about 100 polls
+    governor.register('cache', cache.clear)
+    governor.reserve('http', 2048)
+    for n in range(500):
+        start = governor.mark()
+        cache[n] = bytearray(1024)
+        governor.account('poll', start)
+        governor.step()
+    print(governor.status())
         
\ No newline at end of file
@@ -1,11 +1,21 @@
 # PylontechRS485 handles send & receive and Prefix/suffix/checksum and timeout handling.
 import time
-import machine
+try:
+    import machine
+except ImportError:
+    machine = None  # running on a host with a simulated UART
 import sys
 from collections import OrderedDict as Dict
 from pylontech_base import PylontechRS485
 from pylontech_decode import PylontechDecode
 from pylontech_encode import PylontechEncode
+from cell_stats import CellStats
+from retry_policy import RetryPolicy, CircuitBreakers
+from clock import wall_clock
+from alarm_events import AlarmEvents
+from energy import EnergyCounters
+from resistance import ResistanceEstimator
+from pylontech_registry import COMMANDS
 import logging 
 
 #logging.basicConfig(logging.INFO,'menu.log')
@@ -14,6 +24,28 @@ logger.setLevel(logging.INFO)
 
 DEBUG = False
 
+# answers which are almost always identical between polls, the decoded record
+# is reused as long as the raw frame does not change
+CACHED_CID2 = (0x44, 0x47, 0x92, 0x93)  # alarm, system parameter, charging, serial number
+
+# commands whose answer does not depend on the battery number
+STACK_COMMANDS = ('protocol', 'manufactory', 'systemparameter', 'status')
+# the requests of a module poll in the order of the records
+MODULE_COMMANDS = ('analog', 'charging', 'alarm', 'systemparameter')
+# commands which can be executed by query_many()
+BATCH_COMMANDS = ('protocol', 'manufactory', 'analog', 'alarm', 'charging', 'serialnumber',
+                  'systemparameter', 'status')
+# backoff before the bulk form is tried again after a timeout or a damaged answer
+BULK_RETRY = RetryPolicy(base_delay_ms=10000, max_delay_ms=600000)
+
+def copy_record(record):
+    """ a copy of a decoded record with copies of its lists, the other values are immutable """
+    copy = Dict()
+    for key in record:
+        value = record[key]
+        copy[key] = list(value) if isinstance(value, list) else value
+    return copy
+
 def print_dict(d : Dict):
     for key in d:
         print(key,':', str(d[key]))
@@ -31,6 +63,130 @@ def strip_header(data):
         del data['ADR']
     return data
 
+def aggregate_stack(pylonData, cell_stats, modules, staleModules, changed, events=None, energy=None,
+                    resistance=None):
+    """ fills pylonData with the record lists and the calculated stack values
+    @param modules  per module a tuple (analog, charging, alarm, parameter) or None
+    @param staleModules  1 based numbers of the modules with old records
+    @param changed  Dict list name -> True if a cached record changed
+    @param events  optional AlarmEvents fed with the alarm records
+    @param energy  optional EnergyCounters fed with the analog records
+    @param resistance  optional ResistanceEstimator fed with the analog records
+    """
+    analogList = []
+    chargeDischargeManagementList = []
+    alarmInfoList = []
+    systemParameterList = []
+
+    totalCapacity = 0
+    remainCapacity = 0
+    totalCurrent = 0
+    total_power = 0
+    remainEnergy = 0
+    totalEnergy = 0
+    timestamp = None
+
+    module_voltage = True
+    discharge_current = True
+    charge_current = True
+    temperature = True
+    cell_alarm = True
+
+    for batt in range(len(modules)):
+        records = modules[batt]
+        if records is None:
+            analogList.append(None)
+            chargeDischargeManagementList.append(None)
+            alarmInfoList.append(None)
+            systemParameterList.append(None)
+            cell_stats.set_module(batt, (), ())
+            continue
+        analog, charging, alarm, parameter = records
+
+        analogList.append(analog)
+        if timestamp is None or analog['Timestamp'] > timestamp:
+            timestamp = analog['Timestamp']
+        cell_stats.set_module(batt, analog['CellVoltages'], analog['Temperatures'])
+        remainCapacity = remainCapacity + analog['RemainingCapacity']
+        totalCapacity = totalCapacity + analog['ModuleCapacity']
+        # energy with the voltage of the module instead of a nominal 48 V
+        remainEnergy = remainEnergy + analog['RemainingCapacity'] * analog['Voltage']
+        totalEnergy = totalEnergy + analog['ModuleCapacity'] * analog['Voltage']
+        if energy is not None:
+            energy.update(batt, analog)
+        if resistance is not None:
+            resistance.update(batt, analog)
+        totalCurrent = totalCurrent + analog['Current']
+        total_power = total_power + (analog['Voltage'] * analog['Current'])
+
+        chargeDischargeManagementList.append(charging)
+
+        alarmInfoList.append(alarm)
+        if events is not None:
+            events.update(batt, alarm)
+        # True while all values of the stack are 'Ok'
+        temperaturesList = alarm['Temperature']
+        for temp_ok in temperaturesList:
+            temperature = temperature and temp_ok == 'Ok'
+        discharge_current = discharge_current and alarm['DischargeCurrent'] == 'Ok'
+        charge_current = charge_current and alarm['ChargeCurrent'] == 'Ok'
+        module_voltage = module_voltage and alarm['ModuleVoltage'] == 'Ok'
+        cellList = alarm['CellAlarm']
+        for cell in cellList:
+            cell_alarm = cell_alarm and cell == 'Ok'
+
+        systemParameterList.append(parameter)
+
+    pylonData['Changed'] = changed
+    pylonData['StaleModules'] = staleModules
+    pylonData['AnalogList'] = analogList
+    pylonData['ChargeDischargeManagementList'] = chargeDischargeManagementList
+    pylonData['AlarmInfoList'] = alarmInfoList
+    pylonData['SystemParameterList']= systemParameterList
+    cell_stats.set_module_count(len(modules))
+    cell_stats.compute()
+
+    calculated = pylonData['Calculated']
+    if totalCapacity > 0:
+        calculated['Remaining_%'] = round((remainCapacity / totalCapacity) * 100, 1)
+    else:
+        calculated['Remaining_%'] = 0
+    calculated['RemainingEnergy_kWh'] = round(remainEnergy / 1000, 3)
+    calculated['Capacity_kWh'] = round(totalEnergy / 1000, 3)
+    calculated['RemainingCapacity_Ah'] = round(remainCapacity,1)
+    calculated['TotalCapacity_Ah'] = round(totalCapacity,1)
+    calculated['Charging_Watt'] = round(total_power, 1)
+    calculated['Current_Amp'] = round(totalCurrent,1)
+    calculated['ChargeCurrent'] = charge_current
+    calculated['DischargeCurrent'] = discharge_current
+    calculated['ModuleVoltage'] = module_voltage
+    calculated['CellAlarm'] = cell_alarm
+    calculated['Temperature'] = temperature
+    if energy is not None:
+        energy_results = energy.summary()
+        for key in energy_results:
+            calculated[key] = energy_results[key]
+    if resistance is not None:
+        resistance_results = resistance.summary(len(modules))
+        for key in resistance_results:
+            calculated[key] = resistance_results[key]
+    if events is not None:
+        calculated['ActiveAlarms'] = events.active
+        calculated['LastEvent'] = events.log.sequence
+    cell_results = cell_stats.to_dict()
+    for key in cell_results:
+        calculated[key] = cell_results[key]
+    calculated['StaleModules'] = len(staleModules)
+    calculated['Timestamp'] = timestamp  # UTC in ms of the newest analog sample
+    return pylonData
+
+def new_changed():
+    changed = Dict()
+    changed['ChargeDischargeManagementList'] = False
+    changed['AlarmInfoList'] = False
+    changed['SystemParameterList'] = False
+    return changed
+
 class PylontechMenu:
     """! Whole battery stack abstraction layer.
     This class provides an easy-to-use interface to poll all batteries and get
@@ -46,159 +202,235 @@ class PylontechMenu:
            'serialnumber',
            'systemparameter',
            'status',
+           'events',
+           'energy',
+           'resistance',
            'reboot',
            'undefined']
 
-    def __init__(self, manualBattcountLimit=15, group=0):
+    def __init__(self, manualBattcountLimit=15, group=0, device=0, pylon=None, probe=True, energy=True,
+                 resistance=True):
         """! The class initializer.
-        @param device  RS485 device number 0/1.
+        @param device  RS485 device number 0/1 or a host transport like 'serial:/dev/ttyUSB0', see transport.
         @param baud  RS485 baud rate. Usually 9500 or 115200 for 
         @param manualBattcountLimit  Class probes for the number of batteries in stack which takes some time.
         @param group Group number if more than one battery groups are configured
+        @param pylon  optional PylontechRS485 instance, e.g. shared by two groups or with a simulated UART
+        @param probe  False skips the probe of the modules, discover() probes them step by step later
+        @param energy  False for a menu which is part of a MultiBusMenu, it keeps the energy counters
+        @param resistance  False for a menu which is part of a MultiBusMenu, it keeps the resistance estimator
 
         @return  An instance of the Sensor class initialized with the specified name.
         """
-        self.pylon = PylontechRS485(0, baud=115200)
+        if pylon is None:
+            pylon = PylontechRS485(device, baud=115200)
+        self.pylon = pylon
         self.encode = PylontechEncode()
         self.decode =  PylontechDecode()
         self.pylonData = Dict()
         self.group = group
+        self.frames = {}  # (adr << 8 | cid2) -> (raw frame, decoded record)
+        self.changed = {}  # (adr << 8 | cid2) -> False if the last answer was identical
+        self.last_changed = True
+        self.cell_stats = CellStats(modules=manualBattcountLimit)
+        self.events = AlarmEvents(modules=manualBattcountLimit)
+        self.energy = EnergyCounters(modules=manualBattcountLimit) if energy else None
+        self.resistance = ResistanceEstimator(modules=manualBattcountLimit) if resistance else None
+        # decoders of the registry bound to self.decode and the handlers of the other commands
+        self.decoders = {}
+        self.bulk_decoders = {}
+        for name, command in COMMANDS.items():
+            self.decoders[name] = self.bind(command.decode)
+            if command.packs is not None:
+                self.bulk_decoders[name] = self.bind(command.decode_packs)
+        self.handlers = {'protocol': self.protocol_version,
+                         'status': self.stack_status,
+                         'events': self.event_summary,
+                         'energy': self.energy_table,
+                         'resistance': self.resistance_table,
+                         'reboot': self.reboot}
+        self.retry = RetryPolicy()
+        self.breakers = CircuitBreakers(modules=manualBattcountLimit)
+        self.last_good = [None] * manualBattcountLimit
+        self.bulk_supported = True  # False once the stack rejected the bulk form
+        self.bulk_failures = 0  # timeouts and damaged answers in a row
+        self.bulk_due = 0  # ticks_ms from when the bulk form is tried again
+        self.manualBattcountLimit = manualBattcountLimit
+        self.battcount = 0
+        self.pylonData['SerialNumbers'] = []
+        self.pylonData['Calculated'] = Dict()
+        if probe:
+            for _ in self.discover():
+                pass
 
+    def discover(self):
+        """ generator probing the modules by their serial number, yields after each module
+            so a caller can do other work in between
+        """
         serialList = []
-        for batt in range(0, manualBattcountLimit, 1):
+        for batt in range(0, self.manualBattcountLimit, 1):
             decoded = self.poll_serial_number(batt)
             if decoded == None:
                 break
             serialList.append(decoded['ModuleSerialNumber'])
+            yield batt
         self.pylonData['SerialNumbers'] = serialList
         self.battcount = len(serialList)
         logger.info(f'batteries: {self.battcount} {serialList}')
-        self.pylonData['Calculated'] = Dict()
-    
+
     def get_module_count(self):
         return self.battcount
 
+    def query(self, packet, decoder, timeout_us=20000):
+        """ send a request, receive the answer and decode it with the given decoder method.
+            Answers of the CACHED_CID2 commands that are byte-identical to the previous
+            answer of the same address return a copy of the previous record without
+            decoding; the lists (e.g. CellAlarm) are copied too, nothing is shared with
+            the cache or other callers.
+            self.last_changed tells if the record is new.
+        @return  the decoded record without header or None on timeout
+        """
+        self.begin(packet)
+        return self.complete(decoder, timeout_us)
+
+    def begin(self, packet):
+        """ first half of a query: sends the request """
+        self.pylon.send(packet)
+
+    def complete(self, decoder, timeout_us=20000):
+        """ second half of a query: receives and decodes the answer to the request of begin().
+            The record gets the UTC in ms of the reception of the frame as 'Timestamp'.
+        """
+        raws = self.pylon.receive(timeout_us)
+        if not raws:
+            return None
+        timestamp = wall_clock.epoch_ms(self.pylon.rs485.receive_end_time)
+        cid2 = self.pylon.cid2
+        key = (self.pylon.adr << 8) | cid2
+        if cid2 in CACHED_CID2:
+            cached = self.frames.get(key)
+            if cached is not None and cached[0] == raws:
+                self.changed[key] = False
+                self.last_changed = False
+                decoded = copy_record(cached[1])  # the caller may keep or change the record
+                decoded['Timestamp'] = timestamp
+                return decoded
+        self.decode.decode_header(raws)
+        decoded = strip_header(decoder())
+        decoded['Timestamp'] = timestamp
+        if cid2 in CACHED_CID2:
+            self.frames[key] = (raws, copy_record(decoded))
+        self.changed[key] = True
+        self.last_changed = True
+        return decoded
+
+    def is_changed(self, adr, cid2):
+        """ False if the last answer of the address to the command was identical to the one before """
+        return self.changed.get((adr << 8) | cid2, True)
+
+    def clear_frame_cache(self):
+        self.frames.clear()
+        self.changed.clear()
+
     def poll_serial_number(self, batt, retries=2):
         retryCount = 0
         packet_data = self.encode.getSerialNumber(battNumber=batt, group=self.group)
-        self.pylon.send(packet_data)
-        raws = self.pylon.receive(20000)  # serial number should provide a fast answer.
-        if raws is not None:
-            self.decode.decode_header(raws)
-            try:
-                decoded = self.decode.decodeSerialNumber()
-                return decoded
-            except Exception as ex:
-                logger.exception(ex,"serial number")
+        try:
+            # serial number should provide a fast answer.
+            return self.query(packet_data, self.decode.decodeSerialNumber, 20000)
+        except Exception as ex:
+            logger.exception(ex,"serial number")
         return None
  
+    def module_address(self, batt):
+        return 2 + batt + (self.group << 4)
+
+    def request(self, packet, decoder):
+        """ query which raises an exception if the module does not answer """
+        decoded = self.query(packet, decoder)
+        if decoded is None:
+            raise Exception(f"no answer from address {self.pylon.adr:02X}")
+        return decoded
+
+    def bind(self, decode):
+        """ decoder without arguments on the header decoded by self.decode """
+        return lambda: decode(self.decode.data)
+
+    def module_requests(self, batt):
+        """ the (packet, decoder) pairs to poll analog values, charge/discharge management,
+            alarm info and system parameter of one module
+        """
+        return tuple(self.command_request(key, batt) for key in MODULE_COMMANDS)
+
+    def poll_module(self, batt):
+        """ polls one module, each request is repeated according to the retry policy.
+        @return  tuple of the four decoded records (analog, charging, alarm, parameter)
+        """
+        records = []
+        for request in self.module_requests(batt):
+            records.append(self.retry.call(self.request, request, self.on_bus_error))
+        return tuple(records)
+
+    def module_changed(self, batt, changed):
+        """ marks the lists in changed whose cached records of the module changed """
+        adr = self.module_address(batt)
+        changed['ChargeDischargeManagementList'] |= self.is_changed(adr, 0x92)
+        changed['AlarmInfoList'] |= self.is_changed(adr, 0x44)
+        changed['SystemParameterList'] |= self.is_changed(2, 0x47)
+
+    def poll_module_guarded(self, batt):
+        """ polls one module unless its circuit breaker is open.
+        @return  the new records, or the last good records (None if never polled) and
+                 True if the records are stale
+        """
+        if self.breakers.allow(batt):
+            try:
+                records = self.poll_module(batt)
+                self.breakers.success(batt)
+                self.last_good[batt] = records
+                return records, False
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                logger.exception(ex, f"module {batt + 1} failed")
+                self.breakers.failure(batt)
+        return self.last_good[batt], True
+
+    def on_bus_error(self, ex, attempt):
+        """ if the batteries start to give wrong answers we ask the simplest questions
+            until we get correct answers again """
+        if isinstance(ex, ValueError):
+            self.recover()
+
+    def collect(self):
+        """ polls all modules
+        @return  list of the records per module, the stale module numbers and the changed flags
+        """
+        modules = []
+        staleModules = []
+        changed = new_changed()
+        for batt in range(0, self.battcount):
+            records, stale = self.poll_module_guarded(batt)
+            if stale:
+                staleModules.append(batt + 1)
+            else:
+                self.module_changed(batt, changed)
+            modules.append(records)
+        return modules, staleModules, changed
+
     def update(self):
         """! Stack polling function.
+        A module which does not answer is skipped for a cool-down period by its circuit
+        breaker, its last good records are used and it is listed in 'StaleModules'.
         @return  A dict with all collected Information.
         """
         starttime=time.time()
         logger.debug("start update")
-        analogList = []
-        chargeDischargeManagementList = []
-        alarmInfoList = []
-        systemParameterList = []
-        
-        totalCapacity = 0
-        remainCapacity = 0
-        totalCurrent = 0
-        total_power = 0
-        minimum_cell_voltage = 4.0
-        maximum_cell_voltage = 2.0
-        minimum_temperature = 60.0
-        maximum_temperature = -10.0
-
-        module_voltage = True
-        discharge_current = True
-        charge_current = True
-        temperature = True
-        cell_alarm = True
-
-        for batt in range(0, self.battcount):
-            self.pylon.send(self.encode.getAnalogValue(battNumber=batt, group=self.group))
-            raws = self.pylon.receive()
-            self.decode.decode_header(raws)
-            decoded = self.decode.decodeAnalogValue()
-            strip_header(decoded)
-            analogList.append(decoded)
-
-            cellVoltageList = decoded['CellVoltages']
-            for voltage in cellVoltageList:
-                if voltage > maximum_cell_voltage:
-                    maximum_cell_voltage = voltage
-                elif voltage < minimum_cell_voltage:
-                    minimum_cell_voltage= voltage
-
-            temperaturesList = decoded['Temperatures']
-            for temperature in temperaturesList:
-                if temperature > maximum_temperature:
-                    maximum_temperature = temperature
-                elif temperature < minimum_temperature:
-                    minimum_temperature = temperature
-            
-            remainCapacity = remainCapacity + decoded['RemainingCapacity']
-            totalCapacity = totalCapacity + decoded['ModuleCapacity']
-            totalCurrent = totalCurrent + decoded['Current']
-            total_power = total_power + (decoded['Voltage'] * decoded['Current'])
-            #print('charging') 
-            self.pylon.send(self.encode.getChargeDischargeManagement(battNumber=batt, group=self.group))
-            raws = self.pylon.receive()
-            self.decode.decode_header(raws)
-            decoded = self.decode.decodeChargeDischargeManagementInfo()
-            strip_header(decoded)
-            chargeDischargeManagementList.append(decoded)
-            #print('AlarmInfo')
-            self.pylon.send(self.encode.getAlarmInfo())
-            raws = self.pylon.receive()
-            self.decode.decode_header(raws)
-            decoded = self.decode.decodeAlarmInfo()
-            strip_header(decoded)
-            alarmInfoList.append(decoded)
-            temperaturesList = decoded['Temperature']
-            for temp_ok in temperaturesList:
-                temperature = temperature and temp_ok
-            discharge_current = discharge_current and decoded['DischargeCurrent']
-            charge_current = charge_current and decoded['ChargeCurrent']
-            module_voltage = module_voltage and decoded['ModuleVoltage']
-            cellList = decoded['CellAlarm']
-            for cell in cellList:
-                cell_alarm = cell_alarm and cell
-                
-            self.pylon.send(self.encode.getSystemParameter())
-            raws = self.pylon.receive()
-            self.decode.decode_header(raws)
-            decoded = self.decode.decodeSystemParameter()
-            strip_header(decoded)
-            systemParameterList.append(decoded)
-            
-        self.pylonData['AnalogList'] = analogList
-        self.pylonData['ChargeDischargeManagementList'] = chargeDischargeManagementList
-        self.pylonData['AlarmInfoList'] = alarmInfoList
-        self.pylonData['SystemParameterList']= systemParameterList
-         
-        if totalCapacity > 0:
-            self.pylonData['Calculated']['Remaining_%'] = round((remainCapacity / totalCapacity) * 100, 1)
-        else:
-            self.pylonData['Calculated']['Remaining_%'] = 0
-        self.pylonData['Calculated']['RemainingEnergy_kWh'] = round(48 * remainCapacity /1000, 3)
-        self.pylonData['Calculated']['Capacity_kWh'] = round(48 * totalCapacity/1000,3)
-        self.pylonData['Calculated']['RemainingCapacity_Ah'] = round(remainCapacity,1)
-        self.pylonData['Calculated']['TotalCapacity_Ah'] = round(totalCapacity,1)
-        self.pylonData['Calculated']['Charging_Watt'] = round(total_power, 1)
-        self.pylonData['Calculated']['Current_Amp'] = round(totalCurrent,1)
-        self.pylonData['Calculated']['ChargeCurrent'] = charge_current
-        self.pylonData['Calculated']['DischargeCurrent'] = discharge_current
-        self.pylonData['Calculated']['ModuleVoltage'] = module_voltage
-        self.pylonData['Calculated']['MinimumCellVoltage'] = round(minimum_cell_voltage,2)
-        self.pylonData['Calculated']['MaximumCellVoltage'] = round(maximum_cell_voltage,2)
-        self.pylonData['Calculated']['CellAlarm'] = cell_alarm
-        self.pylonData['Calculated']['MinimumTemperature'] = round(minimum_temperature,1)
-        self.pylonData['Calculated']['MaximumTemperature'] = round(maximum_temperature,1)
-        self.pylonData['Calculated']['Temperature'] = temperature
+        modules, staleModules, changed = self.collect()
+        aggregate_stack(self.pylonData, self.cell_stats, modules, staleModules, changed, self.events, self.energy,
+                        self.resistance)
+        if self.energy is not None:
+            self.energy.step()
         logger.debug("end update: "+ str(time.time()-starttime))
         return self.pylonData
 
@@ -217,103 +449,181 @@ class PylontechMenu:
             pass               
 
 
+    def command_request(self, key, batt=0):
+        """ the (packet, decoder) pair of a command which is a single query, otherwise None """
+        command = COMMANDS.get(key)
+        if command is None or not command.query:
+            return None
+        return command.frame(batt, self.group), self.decoders[key]
+
+    def is_command(self, key):
+        """ True for a command of process_command """
+        if key in self.handlers:
+            return True
+        command = COMMANDS.get(key)
+        return command is not None and command.query
+
+    def execute_command(self, key, batt=0):
+        request = self.command_request(key, batt)
+        if request is not None:
+            return self.query(request[0], request[1])
+        handler = self.handlers.get(key)
+        if handler is None:
+            logger.debug('Invalid process command')
+            raise SystemExit('Invalid process command')
+        return handler(batt)
+
+    def protocol_version(self, batt=0):
+        self.pylon.send(self.encode.getProtocolVersion())
+        raws =self.pylon.receive()
+        if raws:
+            self.decode.decode_header(raws)
+            decoded_p = self.decode.decodePotocolVersion()
+            return decoded_p
+        else:
+            return None
+
+    def stack_status(self, batt=0):
+        stackResult = self.update()
+        if DEBUG :
+            results = list(stackResult)
+            for it in results :
+                print('\n\r', it, '\n\r')
+                if it == 'Calculated' or it == 'SystemParameter' or it == 'SerialNumbers':
+                    print_dict(stackResult['Calculated'])
+                else:
+                    print_dict(stackResult[it][0])
+        return stackResult['Calculated']
+
+    def event_summary(self, batt=0):
+        return self.events.summary()
+
+    def energy_table(self, batt=0):
+        if self.energy is None:
+            return None
+        return self.energy.table(self.battcount)
+
+    def resistance_table(self, batt=0):
+        if self.resistance is None:
+            return None
+        return self.resistance.table(self.battcount)
+
+    def reboot(self, batt=0):
+        machine.soft_reset()
+
+    def bulk_request(self, key):
+        """ the (packet, decoder) pair to get a command for all packs in one answer """
+        decoder = self.bulk_decoders.get(key)
+        if decoder is None:
+            return None
+        return COMMANDS[key].all_frame(), decoder
+
+    def query_bulk(self, key):
+        """ one request for all packs
+        @return  list of the records per module or None. An error RTN or a wrong number of
+                 packs turns the bulk form off, after a timeout or a damaged answer it is
+                 tried again after a backoff
+        """
+        packet, decoder = self.bulk_request(key)
+        try:
+            self.pylon.send(packet)
+            raws = self.pylon.receive()
+            if not raws:
+                raise Exception(f"bulk {key}: no answer")
+            timestamp = wall_clock.epoch_ms(self.pylon.rs485.receive_end_time)
+            header = self.decode.decode_header(raws)
+            if header['RTN'] != 0:
+                logger.info(f"bulk {key} rejected, RTN {header['RTN']:02X}")
+                self.bulk_supported = False
+                return None
+            packs = decoder()
+        except Exception as ex:
+            # a timeout or a damaged answer, the bulk form is tried again after a backoff
+            delay = BULK_RETRY.delay_ms(self.bulk_failures)
+            self.bulk_failures += 1
+            self.bulk_due = time.ticks_add(time.ticks_ms(), delay)
+            logger.warning(f"bulk {key}: {ex}, next try in {delay} ms")
+            return None
+        if len(packs) != self.battcount:
+            logger.info(f"bulk {key}: {len(packs)} packs instead of {self.battcount}")
+            self.bulk_supported = False
+            return None
+        self.bulk_failures = 0
+        for pack in packs:
+            pack['Timestamp'] = timestamp
+        return packs
+
+    def bulk_allowed(self):
+        """ the stack answers the bulk form and no backoff after a failure is running """
+        return self.bulk_supported and (not self.bulk_failures
+                                        or time.ticks_diff(time.ticks_ms(), self.bulk_due) >= 0)
+
+    def query_many(self, items, use_bulk=True):
+        """ executes a batch of (command, battery) requests back to back.
+            Identical requests are sent once, 'analog' and 'alarm' for all modules use the
+            bulk form ('02ff') while the batteries answer it correctly.
+            Failures do not stop the batch, every item gets its own status.
+        @param items  sequence of (command, battery) with 0 based battery numbers
+        @return  list with a Dict per item: command, battery, status ('ok', 'timeout',
+                 'error', 'invalid') and data
+        """
+        plan = []
+        for command, batt in items:
+            key = (command, 0 if command in STACK_COMMANDS else batt)
+            if key not in plan:
+                plan.append(key)
+        results = {}
+        if use_bulk and self.battcount > 1:
+            for command in ('analog', 'alarm'):
+                batteries = sorted(key[1] for key in plan if key[0] == command)
+                if batteries != list(range(self.battcount)) or not self.bulk_allowed():
+                    continue
+                packs = self.query_bulk(command)
+                if packs is None:
+                    continue
+                for batt in batteries:
+                    results[(command, batt)] = ('ok', packs[batt])
+        for key in plan:
+            if key in results:
+                continue
+            command, batt = key
+            if command not in BATCH_COMMANDS:
+                results[key] = ('invalid', None)
+                continue
+            try:
+                data = self.execute_command(command, batt)
+                results[key] = ('ok', data) if data is not None else ('timeout', None)
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                if isinstance(ex, ValueError):
+                    self.recover()
+                results[key] = ('error', str(ex))
+        output = []
+        for command, batt in items:
+            status, data = results[(command, 0 if command in STACK_COMMANDS else batt)]
+            result = Dict()
+            result['command'] = command
+            result['battery'] = batt
+            result['status'] = status
+            result['data'] = data
+            output.append(result)
+        return output
+
     def process_command(self, key, batt=0):
-      """ while loop to repeat the request in case of exceptions"""
-      SUCCESS = False
-      while not SUCCESS:
+        """ executes the command, repeats it according to the retry policy in case of exceptions
+        @return  the decoded record or None if all attempts failed or the command is unknown
+        """
+        if not self.is_command(key):
+            logger.warning(f'unknown command {key}')
+            return None
         try:
-            if key == 'protocol':
-                self.pylon.send(self.encode.getProtocolVersion())
-                raws =self.pylon.receive()
-                if raws:
-                    self.decode.decode_header(raws)
-                    decoded_p = self.decode.decodePotocolVersion()
-                    return decoded_p
-                else:
-                    return None
-            elif key == 'manufactory':
-               self.pylon.send(self.encode.getManufacturerInfo())
-               raws =self.pylon.receive()
-               if raws:
-                   self.decode.decode_header(raws)
-                   decoded_m = self.decode.decodeManufacturerInfo()
-                   return strip_header(decoded_m)
-               else:
-                    return None
-            elif key == 'alarm':
-               self.pylon.send(self.encode.getAlarmInfo(batt))
-               raws =self.pylon.receive()
-               if raws:
-                    self.decode.decode_header(raws)
-                    return strip_header(self.decode.decodeAlarmInfo())
-               else:
-                    return None
-            elif key == 'charging':
-                self.pylon.send(self.encode.getChargeDischargeManagement(batt))
-                raws =self.pylon.receive()
-                if raws:
-                    self.decode.decode_header(raws)
-                    return strip_header(self.decode.decodeChargeDischargeManagementInfo())
-                else:
-                    return None
-            elif key == 'analog':
-                self.pylon.send(self.encode.getAnalogValue(batt))
-                raws =self.pylon.receive()
-                if raws:
-                    self.decode.decode_header(raws)
-                    return strip_header(self.decode.decodeAnalogValue())
-                else:
-                    return None
-            elif key == 'serialnumber':
-                self.pylon.send(self.encode.getSerialNumber(batt))
-                raws =self.pylon.receive()
-                if raws:
-                    self.decode.decode_header(raws)
-                    return strip_header(self.decode.decodeSerialNumber())
-                else:
-                    return None
-            elif key == 'systemparameter':
-                self.pylon.send(self.encode.getSystemParameter())
-                raws =self.pylon.receive()
-                if raws:
-                    self.decode.decode_header(raws)
-                    return strip_header(self.decode.decodeSystemParameter())
-                else:
-                    return None
-            elif key == 'status' :
-                stackResult = self.update()
-                if DEBUG :
-                    results = list(stackResult)
-                    for it in results :
-                        print('\n\r', it, '\n\r')
-                        if it == 'Calculated' or it == 'SystemParameter' or it == 'SerialNumbers':
-                            print_dict(stackResult['Calculated'])
-                        else:
-                            print_dict(stackResult[it][0])
-                return stackResult['Calculated']
-            elif key == 'reboot':
-                machine.soft_reset()
-            else:
-                logger.debug('Invalid process command')
-                raise SystemExit('Invalid process command')
-            SUCCESS = True
- 
-            """ if the battries start to give wrong answers we ask the simplest questions
-                until we get correct answers again """
-        except ValueError as ex:
-            logger.exception(ex,"Value Error")
-            self.recover()
-            continue
+            return self.retry.call(self.execute_command, (key, batt), self.on_bus_error)
         except KeyboardInterrupt as ex:
             sys.exit(1)
-            raise SystemExit
         except Exception as ex:
-            logger.exception(ex,"exception") 
-            self.recover()
-            continue
-        except UnicodeError as ex:
-            logger.warning(ex,ex.args())
-            continue
+            logger.exception(ex, f"command {key} failed")
+            return None
 
 
 
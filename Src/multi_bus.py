@@ -0,0 +1,214 @@
+""" Polling of several RS485 buses or battery groups as one stack.
+
+    Every PylontechMenu keeps its own queue of transactions. In each round the
+    next request of every bus is sent first and the answers are collected
+    afterwards, so the batteries on the two channels of the waveshare module
+    answer at the same time and the poll rate nearly doubles.
+    Groups which share a bus are served one after the other.
+"""
+
+import time
+from collections import OrderedDict as Dict
+from pylontech_base import PylontechRS485
+from cell_stats import CellStats
+from alarm_events import AlarmEvents
+from energy import EnergyCounters
+from resistance import ResistanceEstimator
+from menu import PylontechMenu, aggregate_stack, new_changed
+import logging
+logger = logging.getLogger('multibus', 'multibus.log')
+logger.setLevel(logging.INFO)
+
+
+def create(channels=((0, 0), (1, 0)), manualBattcountLimit=15):
+    """ creates a MultiBusMenu for the (device, group) pairs,
+        groups on the same device share one PylontechRS485
+    """
+    buses = {}
+    menus = []
+    for device, group in channels:
+        if device not in buses:
+            buses[device] = PylontechRS485(device, baud=115200)
+        menus.append(PylontechMenu(manualBattcountLimit, group=group, pylon=buses[device], energy=False,
+                                   resistance=False))
+    return MultiBusMenu(menus)
+
+
+class MultiBusMenu:
+    """ merges the modules of several PylontechMenu instances into one stack view,
+        module numbers continue over the buses in the order of the menus
+    """
+    CID = PylontechMenu.CID
+
+    def __init__(self, menus):
+        self.menus = menus
+        self.battcount = 0
+        serialList = []
+        for menu in menus:
+            self.battcount += menu.get_module_count()
+            serialList.extend(menu.pylonData['SerialNumbers'])
+        self.cell_stats = CellStats(modules=max(self.battcount, 1))
+        self.events = AlarmEvents(modules=max(self.battcount, 1))
+        self.energy = EnergyCounters(modules=max(self.battcount, 1))
+        self.resistance = ResistanceEstimator(modules=max(self.battcount, 1))
+        self.pylonData = Dict()
+        self.pylonData['SerialNumbers'] = serialList
+        self.pylonData['Calculated'] = Dict()
+        logger.info(f'batteries on {len(menus)} buses: {self.battcount}')
+
+    def get_module_count(self):
+        return self.battcount
+
+    def locate(self, batt):
+        """ menu and module index on that menu of a stack module index """
+        for menu in self.menus:
+            if batt < menu.get_module_count():
+                return menu, batt
+            batt -= menu.get_module_count()
+        return None, batt
+
+    def plan(self, menu):
+        """ transaction queue of one bus: [module, requests, records, attempt, retry time] per module to poll """
+        queue = []
+        for batt in range(menu.get_module_count()):
+            if menu.breakers.allow(batt):
+                queue.append([batt, menu.module_requests(batt), [], 0, None])
+        return queue
+
+    def failed(self, menu, queue, ex, failures):
+        """ repeats the transaction according to the retry policy of the menu, the backoff delays
+            only this bus, after the last attempt the module counts as failed in this round
+        """
+        entry = queue[0]
+        retry = menu.retry
+        if entry[3] < retry.retries:
+            logger.warning(f"group {menu.group} module {entry[0] + 1} attempt {entry[3] + 1} failed: {ex}")
+            menu.on_bus_error(ex, entry[3])
+            entry[4] = time.ticks_add(time.ticks_ms(), retry.delay_ms(entry[3]))
+            entry[3] += 1
+            return
+        queue.pop(0)
+        logger.exception(ex, f"group {menu.group} module {entry[0] + 1} failed")
+        menu.breakers.failure(entry[0])
+        failures.append(entry[0])
+
+    def run(self, queues):
+        """ processes the queues round by round, one transaction per bus and round
+        @return  the modules per menu which failed in this run
+        """
+        menus = self.menus
+        failures = [[] for _ in menus]
+        while True:
+            active = []
+            busy = []
+            waiting = None  # ms until the next retry of a bus in backoff
+            now = time.ticks_ms()
+            for i in range(len(menus)):
+                menu = menus[i]
+                queue = queues[i]
+                if not queue or menu.pylon in busy:
+                    continue
+                entry = queue[0]
+                if entry[4] is not None:
+                    wait = time.ticks_diff(entry[4], now)
+                    if wait > 0:
+                        waiting = wait if waiting is None else min(waiting, wait)
+                        continue
+                    entry[4] = None
+                packet, decoder = entry[1][len(entry[2])]
+                try:
+                    menu.begin(packet)
+                except Exception as ex:
+                    self.failed(menu, queue, ex, failures[i])
+                    continue
+                active.append((i, decoder))
+                busy.append(menu.pylon)
+            if not active:
+                if waiting is None:
+                    return failures
+                time.sleep_ms(waiting)
+                continue
+            for i, decoder in active:
+                menu = menus[i]
+                queue = queues[i]
+                entry = queue[0]
+                try:
+                    record = menu.complete(decoder)
+                    if record is None:
+                        raise Exception(f"no answer from address {menu.pylon.adr:02X}")
+                except Exception as ex:
+                    self.failed(menu, queue, ex, failures[i])
+                    continue
+                entry[2].append(record)
+                entry[3] = 0
+                if len(entry[2]) == len(entry[1]):
+                    queue.pop(0)
+                    batt = entry[0]
+                    menu.breakers.success(batt)
+                    menu.last_good[batt] = tuple(entry[2])
+
+    def collect(self):
+        """ polls all buses
+        @return  list of the records per module, the stale module numbers and the changed flags,
+                 a module is stale if its breaker is open or it failed in this round
+        """
+        queues = [self.plan(menu) for menu in self.menus]
+        polled = [[entry[0] for entry in queue] for queue in queues]
+        failures = self.run(queues)
+        modules = []
+        staleModules = []
+        changed = new_changed()
+        offset = 0
+        for i, menu in enumerate(self.menus):
+            for batt in range(menu.get_module_count()):
+                if batt not in polled[i] or batt in failures[i]:
+                    staleModules.append(offset + batt + 1)
+                else:
+                    menu.module_changed(batt, changed)
+                modules.append(menu.last_good[batt])
+            offset += menu.get_module_count()
+        return modules, staleModules, changed
+
+    def update(self):
+        """! polls all buses and merges the results into one stack view
+        @return  A dict with all collected Information.
+        """
+        starttime = time.ticks_ms()
+        modules, staleModules, changed = self.collect()
+        aggregate_stack(self.pylonData, self.cell_stats, modules, staleModules, changed, self.events, self.energy,
+                        self.resistance)
+        self.energy.step()
+        logger.debug(f"end update: {time.ticks_diff(time.ticks_ms(), starttime)} ms")
+        return self.pylonData
+
+    def process_command(self, key, batt=0):
+        if key == 'status':
+            return self.update()['Calculated']
+        if key == 'events':
+            return self.events.summary()
+        if key == 'energy':
+            return self.energy.table(self.battcount)
+        if key == 'resistance':
+            return self.resistance.table(self.battcount)
+        menu, batt = self.locate(batt)
+        if menu is None:
+            return None
+        return menu.process_command(key, batt)
+
+
+if __name__ == '__main__':
+    # two simulated buses with 8 modules each, sequential against parallel polling
+    from simulated_uart import SimulatedUart, SimulatedStack
+    menus = [PylontechMenu(8, pylon=PylontechRS485(uart=SimulatedUart(SimulatedStack(modules=8))), energy=False,
+                           resistance=False)
+             for _ in range(2)]
+    start = time.ticks_ms()
+    for menu in menus:
+        menu.update()
+    sequential = time.ticks_diff(time.ticks_ms(), start)
+    multi = MultiBusMenu(menus)
+    start = time.ticks_ms()
+    data = multi.update()
+    parallel = time.ticks_diff(time.ticks_ms(), start)
+    print(f"{multi.get_module_count()} modules: sequential {sequential} ms, parallel {parallel} ms")
+    print(data['Calculated'])
@@ -8,9 +8,12 @@
     Pi Pico as hardware 
 """
 
-from machine import UART, Pin
 import time
+from transport import open_transport
 import logging
+from bus_stats import BusStats
+from checksum import FrameChecksum, frame_checksum
+import bus_capture
 log = logging.getLogger("base","base.log")
 
 CHKSUM_BYTES = 4
@@ -21,16 +24,26 @@ class Rs485Handler:
     """ Handles the serial to RS485 adapter provides sending and receiving
         frames defined by start byte and end byte preset for
         - 115200 baud,8n1
-        - UART0 as serial device
+        - UART0 as serial device, UART1 for the second channel
+        - or a host transport, e.g. device 'serial:/dev/ttyUSB0' or 'tcp:host:port', see transport
+        A UART stand-in with the same methods can be passed as uart.
     """
     VERBOSE_1 = False
     
-    def __init__(self, device=0, baud=115200, bits=8, parity=None,stop=1):
+    def __init__(self, device=0, baud=115200, bits=8, parity=None,stop=1, uart=None):
         self.device=device
+        self.uart = uart
         self.baud=baud
         self.bits = bits
         self.parity = parity
         self.stop = stop
+        self.send_start_time = time.ticks_us()
+        self.send_end_time = self.send_start_time
+        self.send_duration = 0
+        self.turnaround_duration = 0
+        self.receive_duration = 0
+        self.discarded_bytes = 0
+        self.rx_checksum = FrameChecksum()
         self.connect()
         
     def connect(self):
@@ -38,10 +51,12 @@ class Rs485Handler:
             # open serial port:
             if self.VERBOSE_1:
                 print(self.device,self.baud,self.bits,self.parity,self.stop)
-            self.ser = UART(self.device,self.baud,tx=Pin(0),rx = Pin(1))
-            self.ser.init(self.baud, self.bits,self.parity,self.stop)
+            if self.uart is not None:
+                self.ser = self.uart
+                return
+            self.ser = open_transport(self.device, self.baud, self.bits, self.parity, self.stop)
         except OSError:
-            print("UART not found: " + device)
+            print("UART not found: " + str(self.device))
             exit(1)
 
     def verbose_print(self, data):
@@ -58,7 +73,8 @@ class Rs485Handler:
         self.ser.write(data)
         while self.ser.flush():
             time.sleep_us(10) # 10
-        self.send_duration = time.ticks_us() - self.send_start_time
+        self.send_end_time = time.ticks_us()
+        self.send_duration = time.ticks_diff(self.send_end_time, self.send_start_time)
 
     def receive_frame(self, end_wait_time, start=b'~', end=b'\r'):
         """ receives a frame defined by a start byte/prefix and end byte/suffix
@@ -72,15 +88,23 @@ class Rs485Handler:
             the frame as binary data,
             e.g. b'~200246000000FDB2\r'
             returns after the first end byte.
+            The turnaround time and the number of bytes discarded before the
+            start byte are kept for the bus statistics.
+            The bytes after the start byte are summed in rx_checksum while the
+            frame is received.
         """
+        self.discarded_bytes = 0
         while self.ser.any() == 0:
             time.sleep_us(10)
             if time.ticks_us() > end_wait_time:
                log.info('Timeout waiting for an answer.')
                return None
+        self.turnaround_duration = time.ticks_diff(time.ticks_us(), self.send_end_time)
         char = self.ser.read(1)
         # wait for leading byte / start byte
         while char != start:
+            if char:
+                self.discarded_bytes += 1
             char = self.ser.read(1)
             if time.ticks_us() > end_wait_time:
                 raise Exception('Timeout waiting for start byte.')
@@ -88,7 +112,18 @@ class Rs485Handler:
         self.receive_start_time = time.ticks_us()  # just for Timeout handling
         # receive the whole transmission with the trialing byte / end bytes:
         frame = start + self.ser.read()  # this uses the inter_byte_timeout on failure.
-        self.receive_duration = time.ticks_us() - self.receive_start_time  # just for Timeout handling
+        self.rx_checksum.reset()
+        self.rx_checksum.update(frame, 1)
+        while frame[-1:] != end and time.ticks_diff(end_wait_time, time.ticks_us()) > 0:
+            # rest of a frame which was not complete after the character timeout
+            chunk = self.ser.read()
+            if chunk:
+                self.rx_checksum.update(chunk)
+                frame += chunk
+            else:
+                time.sleep_us(100)
+        self.receive_end_time = time.ticks_us()
+        self.receive_duration = time.ticks_diff(self.receive_end_time, self.receive_start_time)
         frame_lgt = len(frame)
         #self.verbose_print("\r <- " + frame.decode())
         self.verbose_print(f"send    duration:{self.send_duration:6d} us;\r\nreceive duration {self.receive_duration:6d} us")
@@ -113,14 +148,20 @@ class PylontechRS485:
     valid_chars = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F']
     verbose = 0
 
-    def __init__(self, device=0, baud=115200, bits=8, parity=None, stop=1):
+    def __init__(self, device=0, baud=115200, bits=8, parity=None, stop=1, uart=None):
         """ init function of the pylontech rs485 protocol handler
             UART0 == 0, UART1 == 1
         :param baud:
             valid baud rate, identical to the setting at the Battery,
             e.g. 9600 or 115200
+        :param uart:
+            optional UART stand-in, e.g. simulated_uart.SimulatedUart
         """
-        self.rs485 = Rs485Handler(device, baud, bits=8, parity=None, stop=1)
+        self.rs485 = Rs485Handler(device, baud, bits=8, parity=None, stop=1, uart=uart)
+        self.stats = BusStats()
+        self.capture = None
+        self.adr = 0
+        self.cid2 = 0
 
     def verbose(self, level):
         self.verbose = level
@@ -138,10 +179,26 @@ class PylontechRS485:
         start_byte = b'~'
         end_byte = b'\r'
         end_waiting_time = time.ticks_us() + timeout_us
-        data = self.rs485.receive_frame(end_waiting_time, start=start_byte, end=end_byte)
+        try:
+            data = self.rs485.receive_frame(end_waiting_time, start=start_byte, end=end_byte)
+        except Exception:
+            self.stats.timeouts += 1
+            if self.capture is not None:
+                self.capture.record(bus_capture.TIMEOUT, time.ticks_us())
+            raise
+        if self.capture is not None:
+            if data is None:
+                self.capture.record(bus_capture.TIMEOUT, time.ticks_us())
+            else:
+                self.capture.record(bus_capture.RX, self.rs485.receive_end_time, data)
+        if self.rs485.discarded_bytes:
+            self.stats.resyncs += 1
+            self.stats.garbage_bytes += self.rs485.discarded_bytes
         # check len
         if data is None:
+            self.stats.timeouts += 1
             return None
+        self.record_stats()
         if len(data) < 16: # smaller then minimal size
             return None
         start = data.index(b'~')   # check prefix and suffix
@@ -152,23 +209,51 @@ class PylontechRS485:
         if data[-1] != end_byte[0]:   # default: end = 0xd = '\r', suffix missing
             raise ValueError("no suffix '{}' received:\nreceived:\n{}".format(end_byte, data[-1]))
         package = data[1:-1]  # packet stripped, - without prefix, suffix
-        chksum = self.get_chk_sum(package, len(package))
+        if start == 0 and self.rs485.rx_checksum.size == len(data) - 1:
+            # summed while receiving, only the checksum digits and the end byte are removed
+            chksum = self.rs485.rx_checksum.value(data[-CHKSUM_BYTES - EOI_BYTES:])
+        else:
+            chksum = self.get_chk_sum(package, len(package))
         chksum_from_pkg = int(package[-4:].decode(),16)
         if chksum == chksum_from_pkg:
             return package
         else:
             print('checksum error')
+            self.stats.checksum_errors += 1
             raise ValueError(f"crc error;  Soll<->ist: {chksum:04x} --- {chksum_from_pkg:04x}")
         
+    def record_stats(self):
+        """ add the durations of the last transaction to the bus statistics """
+        rs485 = self.rs485
+        self.stats.record(self.cid2, self.adr,
+                          rs485.send_duration,
+                          rs485.turnaround_duration,
+                          rs485.receive_duration,
+                          time.ticks_diff(rs485.receive_end_time, rs485.send_start_time))
+
+    def start_capture(self, path, max_bytes=None):
+        """ records the frames sent and received into the file, see bus_capture """
+        self.stop_capture()
+        if max_bytes is None:
+            self.capture = bus_capture.BusCapture(path)
+        else:
+            self.capture = bus_capture.BusCapture(path, max_bytes)
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def get_stats(self):
+        """ snapshot of the latency histograms and error counters """
+        return self.stats.snapshot()
+
+    def reset_stats(self):
+        self.stats.reset()
+
     @staticmethod
     def get_chk_sum(data, size):
-        sum = 0
-        for byte in data[0:size - CHKSUM_BYTES]:
-            sum += byte
-        sum = ~sum
-        sum &= 0xFFFF
-        sum += 1
-        return sum
+        return frame_checksum(data, size - CHKSUM_BYTES)
 
     def send(self, data):
         """
@@ -179,9 +264,13 @@ class PylontechRS485:
                      e.g. given b'2002464FC0048520' will be sent as b'~2002464FC0048520....\r'
         :return:     -
         """
+        self.adr = int(data[2:4], 16)
+        self.cid2 = int(data[6:8], 16)
         chksum = self.get_chk_sum(data, len(data) + CHKSUM_BYTES)
         package = ("~" + data.decode() + "{:04X}".format(chksum) + "\r").encode()
         self.rs485.send(package)
+        if self.capture is not None:
+            self.capture.record(bus_capture.TX, self.rs485.send_start_time, package)
 
     def reconnect(self):
         """ force reconnect to serial port"""
@@ -199,4 +288,5 @@ if __name__ == '__main__':
     handler.send(frame)
     raw = handler.receive()
     log.info(f'raw {raw}')
+    log.info(f'stats {handler.get_stats()}')
 
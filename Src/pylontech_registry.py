@@ -0,0 +1,385 @@
+""" Declarative registry of the Pylontech commands.
+
+    Every command (CID2) is declared once: the address and INFO of the
+    request and the fields of the answer with their size in bytes, sign,
+    scaling and repeat counts. At import the answer layouts are compiled:
+    consecutive fixed fields become one struct format with precomputed
+    offsets, so an answer is converted from hex once with
+    binascii.unhexlify and decoded with a few struct.unpack_from calls
+    instead of an int(hex, 16) per field. The request frames are constant
+    per module and cached.
+
+    PylontechEncode and PylontechDecode delegate to this registry and
+    PylontechMenu dispatches the commands through COMMANDS, a dict lookup.
+    A command of the V3.3 protocol is added by declaring it in COMMANDS.
+"""
+
+import struct
+import binascii
+from collections import OrderedDict as Dict
+from checksum import length_checksum
+
+PROTOCOL_VERSION = '20'
+CID1 = '46'  # Li battery
+
+# --- conversions of the raw values -------------------------------------------------
+
+def cell_voltage(v):
+    return v / 1000.0
+
+def module_voltage(v):
+    return v / 1000.0
+
+def module_current(v):  # charge +
+    return v / 10.0
+
+def capacity(v):
+    return v / 1000.0
+
+def temperature(v):
+    return (v - 2731) / 10.0
+
+ALARM_NAMES = ('Ok', 'BelowLimit', 'AboveLimit')
+
+def alarm(v):
+    return ALARM_NAMES[v] if v < 3 else 'OtherError'
+
+def detected_capacity(v):
+    return '>65Ah' if v == 4 else '<=65Ah'
+
+def on_off(v):
+    return 'on' if v else 'off'
+
+def text(v):
+    return v.decode('ascii').rstrip('\x00')
+
+# --- field declarations ------------------------------------------------------------
+# size in bytes of the decoded hex, signed fields are two's complement
+
+def U(name, size=1, convert=None):
+    return ('field', name, size, False, convert)
+
+def S(name, size=2, convert=None):
+    return ('field', name, size, True, convert)
+
+def Text(name, size):
+    return ('field', name, size, None, text)
+
+def Bits(*flags):
+    """ one byte with several flags: (name, mask, convert) """
+    return ('bits', flags)
+
+def Repeat(name, count, size=2, signed=True, convert=None):
+    """ list of `count` values, count is the name of a field decoded before """
+    return ('repeat', name, count, size, signed, convert)
+
+def When(name, value, *fields):
+    """ fields which follow only if the decoded field has the value """
+    return ('when', name, value, fields)
+
+
+CODES = {(1, False): 'B', (1, True): 'b', (2, False): 'H', (2, True): 'h', (4, False): 'I', (4, True): 'i'}
+
+
+def field_code(size, signed):
+    """ struct code of a field, texts and sizes without a code are read as bytes """
+    if signed is None or (size, signed) not in CODES:
+        return f'{size}s'
+    return CODES[(size, signed)]
+
+
+class Run:
+    """ fixed fields decoded with one struct format """
+
+    def __init__(self):
+        self.format = '>'
+        self.size = 0
+        self.fields = []  # (name, convert, as_int), name None for the flags of Bits in convert
+
+    def add(self, name, size, signed, convert):
+        code = field_code(size, signed)
+        self.format += code
+        self.size += size
+        # numbers without a struct code, e.g. 3 bytes, are read as bytes
+        self.fields.append((name, convert, signed is not None and code.endswith('s')))
+
+    def add_bits(self, flags):
+        self.format += 'B'
+        self.size += 1
+        self.fields.append((None, flags, False))
+
+    def decode(self, buf, pos, data):
+        values = struct.unpack_from(self.format, buf, pos)
+        i = 0
+        for name, convert, as_int in self.fields:
+            v = values[i]
+            i += 1
+            if as_int:
+                v = int.from_bytes(v, 'big')
+            if name is None:
+                for flag, mask, flag_convert in convert:
+                    data[flag] = flag_convert(v & mask)
+            elif convert is None:
+                data[name] = v
+            else:
+                data[name] = convert(v)
+        return pos + self.size
+
+
+class RepeatStep:
+    def __init__(self, name, count, size, signed, convert):
+        self.name = name
+        self.count = count
+        self.size = size
+        self.code = field_code(size, signed)
+        self.convert = convert
+        self.formats = {}  # count -> struct format
+
+    def decode(self, buf, pos, data):
+        n = data[self.count]
+        fmt = self.formats.get(n)
+        if fmt is None:
+            fmt = '>' + self.code * n
+            self.formats[n] = fmt
+        values = struct.unpack_from(fmt, buf, pos)
+        convert = self.convert
+        data[self.name] = [convert(v) for v in values] if convert else list(values)
+        return pos + self.size * n
+
+
+class WhenStep:
+    def __init__(self, name, value, layout):
+        self.name = name
+        self.value = value
+        self.layout = layout
+
+    def decode(self, buf, pos, data):
+        if data[self.name] == self.value:
+            return self.layout.decode_steps(buf, pos, data)
+        return pos
+
+
+class Layout:
+    """ compiled field declarations of an answer """
+
+    def __init__(self, fields, size_check=False):
+        self.steps = []
+        self.fixed = True
+        run = None
+        for field in fields:
+            kind = field[0]
+            if kind in ('field', 'bits'):
+                if run is None:
+                    run = Run()
+                    self.steps.append(run)
+                if kind == 'field':
+                    run.add(field[1], field[2], field[3], field[4])
+                else:
+                    run.add_bits(field[1])
+                continue
+            run = None
+            self.fixed = False
+            if kind == 'repeat':
+                self.steps.append(RepeatStep(*field[1:]))
+            elif kind == 'when':
+                self.steps.append(WhenStep(field[1], field[2], Layout(field[3])))
+        # size of the payload in hex digits if it has to match exactly
+        self.hex_size = 2 * sum(step.size for step in self.steps) if size_check and self.fixed else None
+
+    def decode_steps(self, buf, pos, data):
+        for step in self.steps:
+            pos = step.decode(buf, pos, data)
+        return pos
+
+    def decode(self, data):
+        """ adds the fields of the PAYLOAD of the decoded header `data` to it """
+        if data['ID'] != 0x46:
+            raise ValueError('wrong decoder selected')
+        payload = data['PAYLOAD']
+        if self.hex_size is not None and len(payload) != self.hex_size:
+            raise ValueError(f"format error, payload length: {len(payload)} instead of {self.hex_size}")
+        self.decode_steps(binascii.unhexlify(payload), 0, data)
+        return data
+
+
+class PacksLayout:
+    """ answer to the request for all packs: InfoFlag, number of packs and a block per pack """
+
+    def __init__(self, block):
+        self.head = Layout((U('InfoFlag'), U('PackCount')))
+        self.block = block
+
+    def decode(self, data):
+        if data['ID'] != 0x46:
+            raise ValueError('wrong decoder selected')
+        buf = binascii.unhexlify(data['PAYLOAD'])
+        head = {}
+        pos = self.head.decode_steps(buf, 0, head)
+        packs = []
+        for p in range(head['PackCount']):
+            pack = Dict()
+            pos = self.block.decode_steps(buf, pos, pack)
+            packs.append(pack)
+        return packs
+
+
+# --- the commands ------------------------------------------------------------------
+
+ANALOG_BLOCK = (
+    U('CellCount'),
+    Repeat('CellVoltages', 'CellCount', 2, True, cell_voltage),
+    U('TemperatureCount'),
+    Repeat('Temperatures', 'TemperatureCount', 2, True, temperature),
+    S('Current', 2, module_current),
+    U('Voltage', 2, module_voltage),
+    U('RemainingCapacity', 2, capacity),
+    U('DetectedCapacity', 1, detected_capacity),
+    U('ModuleCapacity', 2, capacity),
+    U('CycleNumber', 2),
+    When('DetectedCapacity', '>65Ah',
+         U('RemainingCapacity', 3, capacity),
+         U('ModuleCapacity', 3, capacity)),
+)
+
+ALARM_BLOCK = (
+    U('CellCount'),
+    Repeat('CellAlarm', 'CellCount', 1, False, alarm),
+    U('TemperatureCount'),
+    Repeat('Temperature', 'TemperatureCount', 1, False, alarm),
+    U('ChargeCurrent', 1, alarm),
+    U('ModuleVoltage', 1, alarm),
+    U('DischargeCurrent', 1, alarm),
+    U('Status1'),
+    U('Status2'),
+    U('Status3'),
+    U('Status4'),
+    U('Status5'),
+)
+
+CHARGING_FIELDS = (
+    U('CommandValue'),
+    U('ChargeVoltageLimit', 2, module_voltage),
+    U('DischargeVoltageLimit', 2, module_voltage),
+    S('MaxChargeCurrent', 2, module_current),
+    S('MaxDischargeCurrent', 2, module_current),
+    Bits(('ChargeEnable', 0x80, on_off),
+         ('DischargeEnable', 0x40, on_off),
+         ('ChargeImmediately1', 0x20, on_off),
+         ('ChargeImmediately2', 0x10, on_off),
+         ('FullChargeRequired', 0x08, on_off)),
+)
+
+SYSTEM_PARAMETER_FIELDS = (
+    U('InfoFlag'),
+    S('CellUpperVoltageLimit', 2, cell_voltage),
+    S('CellLowVoltageLimit', 2, cell_voltage),
+    S('CellUnderVoltageLimit', 2, cell_voltage),
+    S('ChargeUpperTemperatureLimit', 2, temperature),
+    S('ChargeLowerTemperatureLimit', 2, temperature),
+    S('ChargeCurrentLimit', 2, module_current),
+    U('UpperVoltageLimit', 2, module_voltage),
+    U('LowerVoltageLimit', 2, module_voltage),
+    U('UnderVoltageLimit', 2, module_voltage),
+    S('DischargeUpperTemperatureLimit', 2, temperature),
+    S('DischargeLowerTemperatureLimit', 2, temperature),
+    S('DischargeCurrentLimit', 2, module_current),
+)
+
+MANUFACTURER_FIELDS = (
+    Text('BatteryName', 10),
+    U('SoftwareVersion', 2),
+    Text('ManufacturerName', 20),
+)
+
+SERIAL_NUMBER_FIELDS = (
+    U('CommandValue'),
+    Text('ModuleSerialNumber', 16),
+)
+
+# request kinds: the address of the module or the first module, INFO with the module number
+MODULE = 'module'
+FIRST = 'first'
+
+
+class Command:
+    """ a CID2 with its request and the compiled layout of the answer """
+
+    def __init__(self, name, cid2, address=MODULE, info=False, fields=(), size_check=False,
+                 packs=None, query=True):
+        """ info  True if INFO holds the address and the number of the module
+            packs  block of one pack if the command can be requested for all packs
+            query  False for commands which are not a single request, e.g. protocol
+        """
+        self.name = name
+        self.cid2 = cid2
+        self.address = address
+        self.info = info
+        self.layout = Layout(fields, size_check)
+        self.packs = PacksLayout(Layout(packs)) if packs is not None else None
+        self.query = query
+        self.frames = {}  # (batt, group) -> request frame
+
+    def frame(self, batt=0, group=0):
+        """ request frame without prefix, checksum and suffix, as PylontechRS485.send expects it """
+        key = (batt, group)
+        frame = self.frames.get(key)
+        if frame is None:
+            adr = 2 + batt + (group << 4) if self.address == MODULE else 2
+            info = "{:02x}{:02x}".format(adr, batt + 1) if self.info else ''
+            frame = gen_frame(adr, self.cid2, info)
+            self.frames[key] = frame
+        return frame
+
+    def all_frame(self):
+        """ request for all packs """
+        return gen_frame(2, self.cid2, '02ff')
+
+    def decode(self, data):
+        return self.layout.decode(data)
+
+    def decode_packs(self, data):
+        return self.packs.decode(data)
+
+
+def gen_frame(adr, cid2, info):
+    command = PROTOCOL_VERSION + "{:02X}".format(adr) + CID1 + "{:02X}".format(cid2)
+    return bytes(command + length_checksum(len(info)) + info, 'ascii')
+
+
+ANALOG = Command('analog', 0x42, info=True, fields=(U('InfoFlag'), U('CommandValue')) + ANALOG_BLOCK,
+                 packs=ANALOG_BLOCK)
+ALARM = Command('alarm', 0x44, info=True, fields=(U('InfoFlag'), U('CommandValue')) + ALARM_BLOCK,
+                packs=ALARM_BLOCK)
+SYSTEM_PARAMETER = Command('systemparameter', 0x47, address=FIRST, fields=SYSTEM_PARAMETER_FIELDS,
+                           size_check=True)
+PROTOCOL = Command('protocol', 0x4F, address=FIRST, query=False)
+MANUFACTURER = Command('manufactory', 0x51, fields=MANUFACTURER_FIELDS)
+CHARGING = Command('charging', 0x92, info=True, fields=CHARGING_FIELDS, size_check=True)
+SERIAL_NUMBER = Command('serialnumber', 0x93, info=True, fields=SERIAL_NUMBER_FIELDS, size_check=True)
+
+# the commands by name and by CID2
+COMMANDS = {}
+BY_CID2 = {}
+for command in (ANALOG, ALARM, SYSTEM_PARAMETER, PROTOCOL, MANUFACTURER, CHARGING, SERIAL_NUMBER):
+    COMMANDS[command.name] = command
+    BY_CID2[command.cid2] = command
+
+
+if __name__ == '__main__':
+    import time
+    try:
+        ticks_us = time.ticks_us
+        ticks_diff = time.ticks_diff
+    except AttributeError:
+        ticks_us = lambda: int(time.perf_counter() * 1000000)
+        ticks_diff = lambda a, b: a - b
+    from pylontech_decode import PylontechDecode
+    frame = b'20024600C0AE1102100CF30CF20CF20CF20CF10CF20CF20CF30CF30CF20CF20CF20CF20CF20CF30CF2060BAE0BAE0BAE0BAE0BC20BB8FFD8CF2E9C40022710006B'
+    decode = PylontechDecode()
+    runs = 200
+    start = ticks_us()
+    for _ in range(runs):
+        decode.decode_header(frame)
+        record = decode.decodeAnalogValue()
+    print(f'analog answer: {ticks_diff(ticks_us(), start) / runs:.1f} us per decode')
+    print(record)
@@ -0,0 +1,180 @@
+""" Streaming estimate of the internal resistance of the modules and cells.
+
+    Between two analog records of a module the open circuit voltage hardly
+    changes, a change of the current dI changes the voltage of the module
+    and of each cell by R * dI. Each step of the current larger than
+    MIN_STEP adds dI * dV and dI * dI to exponentially weighted sums, the
+    slope of the regression through the origin R = sum dI dV / sum dI^2 is the
+    resistance. The state per module and per cell is the last voltage and
+    the two sums, no history is kept; an update is O(cells).
+
+    A cell whose resistance is OUTLIER_RATIO above the median of the cells
+    of its module is flagged, likewise a module against the median of the
+    modules, only after MIN_STEPS steps of the module.
+"""
+
+from array import array
+from collections import OrderedDict as Dict
+
+MAX_MODULES = 15
+MAX_CELLS = 16
+MIN_STEP = 20  # in 0.1 A, smaller steps are within the noise of the mV resolution
+MAX_GAP_MS = 60000  # the open circuit voltage drifts over a longer gap
+WEIGHT = 0.05  # of a new step, about the last 20 steps count
+MIN_STEPS = 5
+OUTLIER_RATIO = 0.5
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return 0.0
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+class ResistanceEstimator:
+    """ exponentially weighted dV/dI regression per module and per cell """
+
+    def __init__(self, modules=MAX_MODULES, cells=MAX_CELLS, weight=WEIGHT):
+        self.modules = modules
+        self.cells = cells
+        self.weight = weight
+        size = modules * (cells + 1)  # the cells of a module followed by the module itself
+        self.sum_ii = array('f', [0.0] * size)
+        self.sum_iv = array('f', [0.0] * size)
+        self.voltage = array('i', [0] * size)  # mV of the last record
+        self.current = array('i', [0] * modules)  # 0.1 A of the last record
+        self.timestamp = [None] * modules
+        self.steps = array('H', [0] * modules)
+        self.cell_count = array('B', [0] * modules)
+
+    def update(self, batt, analog):
+        """ adds the step from the last analog record of the module to this one """
+        timestamp = analog.get('Timestamp')
+        if timestamp is None or batt >= self.modules:
+            return
+        last = self.timestamp[batt]
+        if last is not None and timestamp <= last:
+            return  # the same record again
+        voltages = analog['CellVoltages']
+        n = min(len(voltages), self.cells)
+        current = int(round(analog['Current'] * 10))
+        base = batt * (self.cells + 1)
+        module = base + self.cells
+        v = self.voltage
+        step = current - self.current[batt]
+        if (last is not None and n == self.cell_count[batt] and timestamp - last <= MAX_GAP_MS
+                and (step >= MIN_STEP or step <= -MIN_STEP)):
+            keep = 1.0 - self.weight
+            ii = self.weight * step * step
+            sum_ii = self.sum_ii
+            sum_iv = self.sum_iv
+            for i in range(base, base + n):
+                mv = int(voltages[i - base] * 1000 + 0.5)
+                sum_ii[i] = keep * sum_ii[i] + ii
+                sum_iv[i] = keep * sum_iv[i] + self.weight * step * (mv - v[i])
+                v[i] = mv
+            mv = int(analog['Voltage'] * 1000 + 0.5)
+            sum_ii[module] = keep * sum_ii[module] + ii
+            sum_iv[module] = keep * sum_iv[module] + self.weight * step * (mv - v[module])
+            v[module] = mv
+            if self.steps[batt] < 0xffff:
+                self.steps[batt] += 1
+        else:
+            for i in range(n):
+                v[base + i] = int(voltages[i] * 1000 + 0.5)
+            v[module] = int(analog['Voltage'] * 1000 + 0.5)
+        self.cell_count[batt] = n
+        self.current[batt] = current
+        self.timestamp[batt] = timestamp
+
+    def resistance(self, batt, cell=None):
+        """ mOhm of a cell or of the module (cell None), 0.0 without steps """
+        i = batt * (self.cells + 1) + (self.cells if cell is None else cell)
+        if self.sum_ii[i] <= 0.0:
+            return 0.0
+        return 10 * self.sum_iv[i] / self.sum_ii[i]  # mV per 0.1 A
+
+    def estimated(self, modules=None):
+        """ indices of the modules with enough steps """
+        if modules is None:
+            modules = self.modules
+        return [batt for batt in range(min(modules, self.modules)) if self.steps[batt] >= MIN_STEPS]
+
+    def cell_outliers(self, batt):
+        """ indices of the cells of the module above the median of the module """
+        cells = [self.resistance(batt, cell) for cell in range(self.cell_count[batt])]
+        limit = median(cells) * (1 + OUTLIER_RATIO)
+        return [cell for cell in range(len(cells)) if cells[cell] > limit]
+
+    def module_outliers(self, modules=None):
+        batts = self.estimated(modules)
+        limit = median([self.resistance(batt) for batt in batts]) * (1 + OUTLIER_RATIO)
+        return [batt for batt in batts if self.resistance(batt) > limit]
+
+    def summary(self, modules=None):
+        """ stack values for Calculated, the numbers are 1 based """
+        result = Dict()
+        batts = self.estimated(modules)
+        module_r = [self.resistance(batt) for batt in batts]
+        result['MeanModuleResistance_mOhm'] = round(sum(module_r) / len(module_r), 2) if batts else 0.0
+        maximum = 0.0
+        at = '0.0'
+        outliers = []
+        for batt in batts:
+            for cell in range(self.cell_count[batt]):
+                r = self.resistance(batt, cell)
+                if r > maximum:
+                    maximum = r
+                    at = f'{batt + 1}.{cell + 1}'
+            outliers += [f'{batt + 1}.{cell + 1}' for cell in self.cell_outliers(batt)]
+        result['MaximumCellResistance_mOhm'] = round(maximum, 2)
+        result['MaximumCellResistanceAt'] = at
+        result['ResistanceOutlierModules'] = [batt + 1 for batt in self.module_outliers(modules)]
+        result['ResistanceOutlierCells'] = outliers
+        return result
+
+    def table(self, modules=None):
+        """ per module the resistance of the module and of its cells in mOhm, for the API """
+        if modules is None:
+            modules = self.modules
+        result = Dict()
+        for batt in range(min(modules, self.modules)):
+            row = Dict()
+            row['steps'] = self.steps[batt]
+            row['module'] = round(self.resistance(batt), 2)
+            row['cells'] = [round(self.resistance(batt, cell), 2) for cell in range(self.cell_count[batt])]
+            row['outliers'] = [cell + 1 for cell in self.cell_outliers(batt)] if self.steps[batt] >= MIN_STEPS else []
+            result[str(batt + 1)] = row
+        return result
+
+
+if __name__ == '__main__':
+    # four modules of 16 cells with 0.8 mOhm, cell 3.7 of 1.6 mOhm, under a current changing every 5 s
+    import random
+    import time
+    try:
+        import host_compat
+    except ImportError:
+        pass
+    estimator = ResistanceEstimator(modules=4)
+    start = 1700000000000
+    for n in range(720):
+        current = random.choice((-40.0, -10.0, 0.0, 15.0, 30.0))
+        for batt in range(4):
+            ocv = 3.30 + n * 0.00002  # slowly charging
+            cells = [round(ocv + current * (1.6 if (batt, cell) == (2, 6) else 0.8) / 1000
+                           + random.uniform(-0.0005, 0.0005), 3) for cell in range(16)]
+            analog = {'Timestamp': start + n * 5000, 'CellVoltages': cells,
+                      'Voltage': round(sum(cells) + current * 0.002, 3), 'Current': current}
+            estimator.update(batt, analog)
+    print(estimator.summary(4))
+    print(estimator.table(4)['3'])
+    started = time.ticks_us()
+    for n in range(100):
+        estimator.update(0, {'Timestamp': start + (720 + n) * 5000, 'CellVoltages': cells,
+                             'Voltage': 52.8, 'Current': 30.0 if n % 2 else -30.0})
+    print(f'update of a module: {time.ticks_diff(time.ticks_us(), started) / 100:.0f} us')
@@ -0,0 +1,94 @@
+""" Retry policy and circuit breakers for the battery modules.
+
+    RetryPolicy repeats a failing request a bounded number of times with an
+    exponential backoff between the attempts.
+    CircuitBreakers keep a breaker per module: after `threshold` failed polls
+    in a row the module is skipped for `cooldown_ms`, then one trial poll is
+    allowed (half open). A successful poll closes the breaker again.
+"""
+
+import time
+import logging
+logger = logging.getLogger("retry", "retry.log")
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+STATE_NAMES = ('closed', 'open', 'half-open')
+
+
+class RetryPolicy:
+    """ bounded retries with exponential backoff """
+
+    def __init__(self, retries=2, base_delay_ms=20, max_delay_ms=500, factor=2):
+        self.retries = retries
+        self.base_delay_ms = base_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.factor = factor
+
+    def delay_ms(self, attempt):
+        """ backoff before retry number attempt (0 based) """
+        return min(self.base_delay_ms * self.factor ** attempt, self.max_delay_ms)
+
+    def call(self, function, args=(), on_error=None):
+        """ calls function(*args) and retries on exceptions.
+        @param on_error  optional callback(exception, attempt) before each retry,
+                         e.g. to resynchronise the bus
+        @return  the result of the first successful call,
+                 the exception of the last attempt is raised
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(*args)
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"attempt {attempt + 1} failed: {ex}")
+                if on_error is not None:
+                    on_error(ex, attempt)
+                time.sleep_ms(self.delay_ms(attempt))
+                attempt += 1
+
+
+class CircuitBreakers:
+    """ one circuit breaker per module """
+
+    def __init__(self, modules=15, threshold=3, cooldown_ms=60000):
+        self.threshold = threshold
+        self.cooldown_ms = cooldown_ms
+        self.state = [CLOSED] * modules
+        self.failures = [0] * modules
+        self.opened_at = [0] * modules
+
+    def allow(self, module):
+        """ True if the module may be polled now """
+        state = self.state[module]
+        if state == OPEN:
+            if time.ticks_diff(time.ticks_ms(), self.opened_at[module]) < self.cooldown_ms:
+                return False
+            self.state[module] = HALF_OPEN
+        return True
+
+    def success(self, module):
+        if self.state[module] != CLOSED:
+            logger.info(f"module {module + 1} answers again")
+        self.state[module] = CLOSED
+        self.failures[module] = 0
+
+    def failure(self, module):
+        self.failures[module] += 1
+        if self.state[module] == HALF_OPEN or self.failures[module] >= self.threshold:
+            if self.state[module] != OPEN:
+                logger.warning(f"module {module + 1} skipped for {self.cooldown_ms} ms")
+            self.state[module] = OPEN
+            self.opened_at[module] = time.ticks_ms()
+
+    def is_open(self, module):
+        return self.state[module] == OPEN
+
+    def status(self):
+        """ state name and consecutive failures per module """
+        return [(STATE_NAMES[self.state[m]], self.failures[m]) for m in range(len(self.state))]
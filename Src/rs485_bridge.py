@@ -0,0 +1,315 @@
+""" Raw access to the RS485 bus over TCP for other tools.
+
+    Clients connect to BRIDGE_PORT and send raw frames '~...\r' as on the
+    bus. Only the pico drives the bus: each request becomes a transaction of
+    the class BRIDGE of the BusScheduler, between the alarm and the telemetry
+    polls, and the answer frame goes back to the client which sent the
+    request, no answer means a timeout like on the bus.
+    - a request with a wrong checksum is dropped
+    - each client has a token bucket, a request without a token is dropped,
+      answers from the cache take a token, too
+    - the same request of several clients is sent to the bus once
+    - the answers of the read commands are reused for CACHE_MS, a tool
+      polling the analog values does not double the polls of the pico; at
+      most MAX_CACHE answers are kept
+    The sockets are served by the loop of the web server (step()); with the
+    poller on core 1 the transactions run there, otherwise step() runs them.
+"""
+
+import socket
+import select
+import time
+import _thread
+from collections import OrderedDict as Dict
+from bus_scheduler import BusScheduler, Transaction, BRIDGE, OK
+from checksum import frame_checksum
+from pylontech_registry import BY_CID2
+import logging
+logger = logging.getLogger('bridge', 'bridge.log')
+logger.setLevel(logging.INFO)
+
+BRIDGE_PORT = 4196
+MAX_CLIENTS = 4
+MAX_FRAME = 128  # the requests are short, a longer frame is garbage
+RATE_PER_S = 10  # requests per second and client
+BURST = 5
+CACHE_MS = 1000
+MAX_CACHE = 32  # answers, the expired ones are dropped first
+READ_CID2 = tuple(BY_CID2)  # commands which only read, their answers may be reused
+
+
+def key_of(sock):
+    return sock.fileno() if hasattr(sock, 'fileno') else id(sock)
+
+
+class BridgeClient:
+    """ a connected tool with its receive buffer and token bucket """
+
+    def __init__(self, sock, address, burst=BURST):
+        self.sock = sock
+        self.address = address
+        self.rx = bytearray()
+        self.tokens = burst
+        self.refilled = time.ticks_ms()
+        self.requests = 0
+        self.answered = 0
+        self.limited = 0
+        self.invalid = 0
+
+    def take_token(self, rate, burst):
+        now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, self.refilled)
+        if elapsed * rate >= 1000:
+            self.tokens = min(burst, self.tokens + elapsed * rate // 1000)
+            self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def status(self):
+        result = Dict()
+        result['address'] = str(self.address)
+        result['requests'] = self.requests
+        result['answered'] = self.answered
+        result['limited'] = self.limited
+        result['invalid'] = self.invalid
+        return result
+
+
+class Rs485Bridge:
+    """ TCP server of the raw frames, one transaction queue with the poller """
+
+    def __init__(self, scheduler=None, menu=None, port=BRIDGE_PORT, rate=RATE_PER_S, burst=BURST,
+                 cache_ms=CACHE_MS):
+        """ menu  given when no other loop runs the transactions of the scheduler, step() runs them """
+        self.scheduler = scheduler if scheduler is not None else BusScheduler()
+        self.menu = menu
+        self.rate = rate
+        self.burst = burst
+        self.cache_ms = cache_ms
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(socket.getaddrinfo('0.0.0.0', port)[0][-1])
+        self.listener.listen(2)
+        self.listener.setblocking(False)
+        self.poller = select.poll()
+        self.poller.register(self.listener, select.POLLIN)
+        self.clients = {}
+        self.waiting = {}  # request packet -> clients waiting for its answer
+        self.done = []  # (packet, answer frame or None) completed by the scheduler
+        self.lock = _thread.allocate_lock()
+        self.cache = {}  # request packet -> (ticks_ms, answer frame)
+        self.transactions = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.timeouts = 0
+
+    def step(self):
+        """ accepts, reads the requests, runs a transaction if it owns the bus and sends the answers """
+        for obj, event in self.poller.poll(0):
+            key = obj if isinstance(obj, int) else key_of(obj)
+            if key == key_of(self.listener):
+                self.accept()
+                continue
+            client = self.clients.get(key)
+            if client is not None:
+                self.receive(client, event)
+        if self.menu is not None and self.scheduler.pending():
+            self.scheduler.run_next(self.menu)
+        self.deliver()
+
+    def accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except OSError:
+            return
+        if len(self.clients) >= MAX_CLIENTS:
+            logger.warning(f'bridge: refused {address}, {MAX_CLIENTS} clients connected')
+            sock.close()
+            return
+        sock.setblocking(False)
+        self.poller.register(sock, select.POLLIN)
+        self.clients[key_of(sock)] = BridgeClient(sock, address, self.burst)
+        logger.info(f'bridge: client {address}')
+
+    def drop(self, client):
+        self.clients.pop(key_of(client.sock), None)
+        try:
+            self.poller.unregister(client.sock)
+        except (OSError, ValueError, KeyError):
+            pass
+        client.sock.close()
+        for clients in self.waiting.values():
+            while client in clients:
+                clients.remove(client)
+
+    def receive(self, client, event):
+        try:
+            data = client.sock.recv(256)
+        except OSError:
+            data = None if event & (select.POLLHUP | select.POLLERR) else b''
+            if data == b'':
+                return
+        if not data:
+            self.drop(client)
+            return
+        rx = client.rx
+        rx += data
+        while True:
+            start = rx.find(b'~')
+            if start < 0:
+                client.rx = bytearray()
+                return
+            end = rx.find(b'\r', start)
+            if end < 0:
+                if len(rx) - start > MAX_FRAME:
+                    client.invalid += 1
+                    client.rx = bytearray()
+                else:
+                    client.rx = rx[start:]
+                return
+            self.request(client, bytes(rx[start:end + 1]))
+            rx = rx[end + 1:]
+
+    def request(self, client, frame):
+        """ a frame '~...\r' of a client """
+        client.requests += 1
+        packet = frame[1:-5]
+        try:
+            valid = len(frame) >= 18 and int(frame[-5:-1], 16) == frame_checksum(frame[1:-5])
+        except ValueError:
+            valid = False
+        if not valid:
+            client.invalid += 1
+            return
+        if not client.take_token(self.rate, self.burst):
+            client.limited += 1
+            return
+        cached = self.cache.get(packet)
+        if cached is not None and time.ticks_diff(time.ticks_ms(), cached[0]) < self.cache_ms:
+            self.cached += 1
+            self.send(client, cached[1])
+            return
+        with self.lock:
+            clients = self.waiting.get(packet)
+            if clients is not None:
+                clients.append(client)  # already queued for another client
+                self.coalesced += 1
+                return
+            self.waiting[packet] = [client]
+        self.transactions += 1
+        self.scheduler.submit(Transaction(BRIDGE, packet, None, self.completed, packet))
+
+    def completed(self, transaction):
+        """ called by the scheduler, on core 1 with the poller there """
+        answer = None
+        if transaction.status == OK:
+            answer = b'~' + transaction.result + b'\r'
+        with self.lock:
+            self.done.append((transaction.tag, answer))
+
+    def deliver(self):
+        with self.lock:
+            if not self.done:
+                return
+            done = self.done
+            self.done = []
+        for packet, answer in done:
+            with self.lock:
+                clients = self.waiting.pop(packet, [])
+            if answer is None:
+                self.timeouts += 1
+                continue
+            if int(packet[6:8], 16) in READ_CID2:
+                self.remember(packet, answer)
+            for client in clients:
+                self.send(client, answer)
+
+    def remember(self, packet, answer):
+        """ caches the answer, drops the expired answers and the oldest beyond MAX_CACHE """
+        if not self.cache_ms:
+            return
+        now = time.ticks_ms()
+        cache = self.cache
+        for key in [key for key, entry in cache.items() if time.ticks_diff(now, entry[0]) >= self.cache_ms]:
+            del cache[key]
+        if packet not in cache and len(cache) >= MAX_CACHE:
+            oldest = None
+            for key, entry in cache.items():
+                if oldest is None or time.ticks_diff(entry[0], cache[oldest][0]) < 0:
+                    oldest = key
+            del cache[oldest]
+        cache[packet] = (now, answer)
+
+    def send(self, client, answer):
+        try:
+            client.sock.send(answer)
+            client.answered += 1
+        except OSError:
+            self.drop(client)
+
+    def status(self):
+        result = Dict()
+        result['clients'] = [client.status() for client in self.clients.values()]
+        result['transactions'] = self.transactions
+        result['coalesced'] = self.coalesced
+        result['cached'] = self.cached
+        result['cache_size'] = len(self.cache)
+        result['timeouts'] = self.timeouts
+        result['scheduler'] = self.scheduler.get_metrics()
+        return result
+
+    def close(self):
+        for client in list(self.clients.values()):
+            self.drop(client)
+        self.listener.close()
+
+
+if __name__ == '__main__':
+    # three tools on the bridge while the poll cycle of the pico runs on the same scheduler,
+    # with the answer cache and without it, where the flooding tool runs into its rate limit
+    from simulated_uart import SimulatedUart, SimulatedStack
+    from pylontech_base import PylontechRS485
+    from menu import PylontechMenu
+    from bus_scheduler import PollCycle
+    menu = PylontechMenu(4, pylon=PylontechRS485(uart=SimulatedUart(SimulatedStack(modules=4))), energy=False)
+
+    def tool(port, results, name, packet, count, pause_ms):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.settimeout(0.2)
+        frame = b'~' + packet + '{:04X}'.format(frame_checksum(packet)).encode() + b'\r'
+        answers = 0
+        for _ in range(count):
+            sock.send(frame)
+            try:
+                answer = sock.recv(1024)
+                answers += answer.startswith(b'~') and answer.endswith(b'\r')
+            except OSError:
+                pass
+            time.sleep_ms(pause_ms)
+        sock.close()
+        results[name] = f'{answers} of {count} answered'
+
+    analog = menu.encode.getAnalogValue(battNumber=0)
+    alarm = menu.encode.getAlarmInfo(battNumber=1)
+    for cache_ms in (CACHE_MS, 0):
+        bridge = Rs485Bridge(menu=menu, port=0, cache_ms=cache_ms)
+        port = bridge.listener.getsockname()[1]
+        results = {}
+        _thread.start_new_thread(tool, (port, results, 'viewer', analog, 20, 100))
+        _thread.start_new_thread(tool, (port, results, 'script', analog, 20, 100))
+        _thread.start_new_thread(tool, (port, results, 'flood', alarm, 40, 0))
+        cycle = None
+        start = time.ticks_ms()
+        while len(results) < 3 and time.ticks_diff(time.ticks_ms(), start) < 15000:
+            if cycle is None or cycle.complete():
+                cycle = PollCycle(menu, bridge.scheduler)
+            bridge.step()
+            time.sleep_ms(1)
+        status = bridge.status()
+        print(f'cache {cache_ms} ms: {results}')
+        print({key: status[key] for key in ('transactions', 'coalesced', 'cached', 'timeouts')})
+        print('bridge', status['scheduler']['bridge'])
+        print('telemetry', status['scheduler']['telemetry'])
+        bridge.close()
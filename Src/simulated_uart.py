@@ -0,0 +1,204 @@
+""" Simulated UART with a stack of Pylontech batteries behind it.
+
+    SimulatedUart is a stand-in for machine.UART: a written request frame is
+    answered by SimulatedStack, the first byte of the answer becomes readable
+    after the request was transmitted and the turnaround time. Like the UART
+    with its character timeout, read() returns once the whole answer was
+    transmitted at the configured baud rate.
+    ReplayUart answers with the frames of a bus capture, see bus_capture.
+    They are used to run PylontechMenu without hardware, e.g. on a host:
+
+        import host_compat
+        from simulated_uart import SimulatedUart, SimulatedStack
+        from pylontech_base import PylontechRS485
+        pylon = PylontechRS485(uart=SimulatedUart(SimulatedStack(modules=3)))
+"""
+
+import time
+from pylontech_encode import PylontechEncode
+from bus_capture import load_exchanges
+
+
+def hex_ascii(text, size):
+    """ text as hex of `size` bytes padded with zeros """
+    raw = text.encode()[:size]
+    return ''.join("{:02X}".format(c) for c in raw) + '00' * (size - len(raw))
+
+
+class SimulatedStack:
+    """ answers the requests of the protocol for a number of modules """
+
+    def __init__(self, modules=3, cells=16, temperatures=6, group=0, base_voltage=3300):
+        self.modules = modules
+        self.cells = cells
+        self.temperatures = temperatures
+        self.group = group
+        self.base_voltage = base_voltage
+        self.current = 25  # in 0.1 A as decoded by PylontechDecode.moduleCurrent
+        self.status = [0, 0x0e, 0x40, 0, 0]  # alarm status 1..5
+        self.encode = PylontechEncode()
+        self.requests = 0
+
+    def module(self, adr):
+        """ module index of the address or None if there is no module """
+        batt = adr - 2 - (self.group << 4)
+        if 0 <= batt < self.modules:
+            return batt
+        return None
+
+    def answer(self, adr, info):
+        command = "20{:02X}4600".format(adr) + self.encode.lenChecksum(len(info)) + info
+        chksum = 0
+        for c in command.encode():
+            chksum += c
+        chksum = ((~chksum) & 0xffff) + 1
+        return ("~" + command + "{:04X}".format(chksum & 0xffff) + "\r").encode()
+
+    def analog(self, batt):
+        info = "11{:02X}{:02X}".format(batt + 2, self.cells)
+        for cell in range(self.cells):
+            info += "{:04X}".format(self.base_voltage + batt * 3 + cell)
+        info += "{:02X}".format(self.temperatures)
+        for t in range(self.temperatures):
+            info += "{:04X}".format(2731 + 200 + batt * 5 + t)
+        info += "{:04X}".format(self.current & 0xffff)
+        info += "{:04X}".format((self.base_voltage + 5) * self.cells)
+        info += "{:04X}{:02X}{:04X}{:04X}".format(40000, 2, 50000, 100 + batt)
+        return info
+
+    def alarm(self, batt):
+        info = "00{:02X}{:02X}".format(batt + 2, self.cells)
+        info += "00" * self.cells
+        info += "{:02X}".format(self.temperatures) + "00" * self.temperatures
+        info += "000000"
+        for status in self.status:
+            info += "{:02X}".format(status)
+        return info
+
+    def request(self, frame):
+        """ answer frame for a request frame or None if no module answers """
+        self.requests += 1
+        if len(frame) < 18 or frame[0:1] != b'~':
+            return None
+        adr = int(frame[3:5], 16)
+        cid2 = int(frame[7:9], 16)
+        if cid2 == 0x4F:
+            return self.answer(adr, "")
+        if cid2 == 0x47:
+            return self.answer(2, "11" + "0E420BB80A8C0D030B7F01F4D6D8AFC8A5F40D030B7FFE0C")
+        if cid2 == 0x51:
+            return self.answer(2, hex_ascii("US5000", 10) + "0100" + hex_ascii("PYLON", 20))
+        if adr == 2 and cid2 in (0x42, 0x44) and frame[13:17].upper() == b'02FF':
+            # all packs: InfoFlag, number of packs and the blocks without InfoFlag/CommandValue
+            block = self.analog if cid2 == 0x42 else self.alarm
+            info = "11{:02X}".format(self.modules)
+            for batt in range(self.modules):
+                info += block(batt)[4:]
+            return self.answer(adr, info)
+        batt = self.module(adr)
+        if batt is None:
+            return None
+        if cid2 == 0x42:
+            return self.answer(adr, self.analog(batt))
+        if cid2 == 0x44:
+            return self.answer(adr, self.alarm(batt))
+        if cid2 == 0x92:
+            return self.answer(adr, "{:02X}D2F0AFC801F4FE0CC0".format(adr))
+        if cid2 == 0x93:
+            return self.answer(adr, "{:02X}".format(adr) + hex_ascii("PPTBH0%010d" % (batt + 1), 16))
+        return None
+
+
+class SimulatedUart:
+    """ stand-in for machine.UART connected to a SimulatedStack """
+
+    def __init__(self, stack, baud=115200, turnaround_us=2000):
+        self.stack = stack
+        self.byte_us = 10000000 // baud  # 10 bits per byte
+        self.turnaround_us = turnaround_us
+        self.rx = b''
+        self.ready_at = 0
+        self.complete_at = 0
+        self.written = 0
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        self.written += len(data)
+        answer = self.stack.request(bytes(data))
+        now = time.ticks_us()
+        if answer:
+            self.rx = answer
+            self.ready_at = time.ticks_add(now, len(data) * self.byte_us + self.turnaround_us)
+            self.complete_at = time.ticks_add(self.ready_at, len(answer) * self.byte_us)
+        else:
+            self.rx = b''
+        return len(data)
+
+    def flush(self):
+        return None
+
+    def any(self):
+        if self.rx and time.ticks_diff(time.ticks_us(), self.ready_at) >= 0:
+            return len(self.rx)
+        return 0
+
+    def read(self, n=None):
+        if not self.any():
+            return None
+        wait = time.ticks_diff(self.complete_at, time.ticks_us())
+        if wait > 0:
+            time.sleep_us(wait)
+        if n is None:
+            n = len(self.rx)
+        data = self.rx[:n]
+        self.rx = self.rx[n:]
+        return data
+
+    def deinit(self):
+        self.rx = b''
+
+
+class ReplayUart(SimulatedUart):
+    """ answers the requests with the answers of a capture.
+        realtime False makes an answer readable right after its request.
+        A request which differs from the next captured one is looked up further on,
+        the skipped exchanges are counted as mismatches.
+    """
+
+    def __init__(self, path, realtime=True, baud=115200):
+        SimulatedUart.__init__(self, None, baud)
+        self.exchanges = load_exchanges(path)
+        self.realtime = realtime
+        self.position = 0
+        self.mismatches = 0
+        self.unanswered = 0
+
+    def done(self):
+        return self.position >= len(self.exchanges)
+
+    def write(self, data):
+        data = bytes(data)
+        self.written += len(data)
+        self.rx = b''
+        for i in range(self.position, len(self.exchanges)):
+            if self.exchanges[i][0] == data:
+                self.mismatches += i - self.position
+                request, answer, turnaround = self.exchanges[i]
+                self.position = i + 1
+                break
+        else:
+            self.unanswered += 1
+            return len(data)
+        if answer:
+            now = time.ticks_us()
+            self.rx = answer
+            if self.realtime:
+                # the recorded time from the request to the end of the answer
+                self.ready_at = time.ticks_add(now, max(turnaround - len(answer) * self.byte_us, 0))
+                self.complete_at = time.ticks_add(now, turnaround)
+            else:
+                self.ready_at = now
+                self.complete_at = now
+        return len(data)
@@ -0,0 +1,126 @@
+""" Staged, non-blocking start of the web server.
+
+    Every stage is a generator which does a small piece of work on each
+    step and yields while it waits, e.g. for the Wi-Fi association or an
+    answer of a battery. The web server binds its socket first and calls
+    Boot.step() in its loop, so it answers within milliseconds and the
+    stages run in the background. A stage starts when the stages it
+    requires are ready; a failed stage does not stop the others.
+"""
+
+import time
+from collections import OrderedDict as Dict
+import logging
+logger = logging.getLogger('startup', 'startup.log')
+logger.setLevel(logging.INFO)
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class Stage:
+    def __init__(self, name, function, requires=()):
+        self.name = name
+        self.function = function
+        self.requires = requires
+        self.state = PENDING
+        self.generator = None
+        self.started = 0
+        self.duration_ms = 0
+        self.error = None
+
+
+class Boot:
+    """ runs the stages cooperatively, one step of each running stage per call of step() """
+
+    def __init__(self, start=None):
+        """ start: ticks_ms of the power on if it was taken before the imports """
+        self.start = time.ticks_ms() if start is None else start
+        self.stages = []
+        self.first_answer_ms = None
+
+    def add(self, name, function, requires=()):
+        """ function() has to return a generator, its last value is ignored """
+        self.stages.append(Stage(name, function, requires))
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def ready(self, name):
+        stage = self.stage(name)
+        return stage is not None and stage.state == READY
+
+    def busy(self):
+        """ True while a stage is pending or running """
+        for stage in self.stages:
+            if stage.state in (PENDING, RUNNING):
+                return True
+        return False
+
+    def step(self):
+        for stage in self.stages:
+            if stage.state == PENDING:
+                blocked = False
+                for name in stage.requires:
+                    required = self.stage(name)
+                    if required.state == FAILED:
+                        stage.state = FAILED
+                        stage.error = f"{name} failed"
+                    if required.state != READY:
+                        blocked = True
+                if blocked or stage.state == FAILED:
+                    continue
+                stage.state = RUNNING
+                stage.started = time.ticks_ms()
+                stage.generator = stage.function()
+                logger.info(f"stage {stage.name} started")
+            if stage.state != RUNNING:
+                continue
+            try:
+                next(stage.generator)
+            except StopIteration:
+                self.finish(stage, READY)
+            except Exception as ex:
+                logger.exception(ex, f"stage {stage.name}")
+                stage.error = str(ex)
+                self.finish(stage, FAILED)
+
+    def finish(self, stage, state):
+        stage.state = state
+        stage.generator = None
+        stage.duration_ms = time.ticks_diff(time.ticks_ms(), stage.started)
+        logger.info(f"stage {stage.name} {state} after {stage.duration_ms} ms")
+
+    def answered(self):
+        """ call after a response was sent, keeps the time to the first answer """
+        if self.first_answer_ms is None:
+            self.first_answer_ms = time.ticks_diff(time.ticks_ms(), self.start)
+            logger.info(f"first answer {self.first_answer_ms} ms after start")
+
+    def status(self):
+        """ readiness of the stages for the API """
+        result = Dict()
+        result['uptime_ms'] = time.ticks_diff(time.ticks_ms(), self.start)
+        result['first_answer_ms'] = self.first_answer_ms
+        stages = Dict()
+        for stage in self.stages:
+            info = Dict()
+            info['state'] = stage.state
+            info['duration_ms'] = stage.duration_ms
+            if stage.error:
+                info['error'] = stage.error
+            stages[stage.name] = info
+        result['stages'] = stages
+        return result
+
+
+def wait_ms(ms):
+    """ generator which yields until ms have passed """
+    start = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), start) < ms:
+        yield
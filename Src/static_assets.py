@@ -0,0 +1,105 @@
+""" Static files of the dashboard, gzip precompressed in flash.
+
+    The files in www are built by build_assets.py on a host. They are sent
+    as they are with Content-Encoding: gzip in chunks of one preallocated
+    buffer, the pico neither compresses nor holds a whole file. A client
+    which does not accept gzip gets the file decompressed by the deflate
+    module where the firmware has it.
+    The crc32 of the gzip trailer is the ETag, the decompressed variant has
+    its own ETag and all answers carry Vary: Accept-Encoding, so a cache
+    never serves one encoding for the other. index.html is revalidated on
+    each load and answered with 304 when it did not change, the scripts and
+    style sheets are referenced with their version and cached for a year.
+    The data of the page comes from the JSON endpoint /data.
+"""
+
+import os
+import struct
+try:
+    import deflate
+except ImportError:
+    deflate = None
+import logging
+logger = logging.getLogger('static', 'static.log')
+logger.setLevel(logging.INFO)
+
+ROOT = 'www'
+CHUNK = 512
+INDEX = 'index.html'
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'js': 'application/javascript',
+    'css': 'text/css',
+    'json': 'application/json',
+    'svg': 'image/svg+xml',
+    'ico': 'image/x-icon',
+}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+class StaticAssets:
+    """ url path -> precompressed file of ROOT """
+
+    def __init__(self, root=ROOT, buffer=None):
+        self.root = root
+        self.buffer = buffer if buffer is not None else bytearray(CHUNK)
+        self.view = memoryview(self.buffer)
+        self.assets = {}
+        self.sent = 0
+        self.not_modified = 0
+        self.scan()
+
+    def scan(self):
+        """ (path, size, etag, content type, cache control) per url path """
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            logger.warning(f'no static files in {self.root}')
+            return
+        for file_name in names:
+            if not file_name.endswith('.gz'):
+                continue
+            name = file_name[:-3]
+            path = self.root + '/' + file_name
+            size = os.stat(path)[6]
+            with open(path, 'rb') as f:
+                f.seek(size - 8)
+                crc = struct.unpack('<I', f.read(4))[0]
+            content_type = CONTENT_TYPES.get(name.split('.')[-1], 'application/octet-stream')
+            cache = REVALIDATE if name == INDEX else IMMUTABLE
+            asset = (path, size, f'"{crc:08x}"', content_type, cache)
+            self.assets[b'/' + name.encode()] = asset
+            if name == INDEX:
+                self.assets[b'/'] = asset
+        logger.info(f'{len(self.assets)} static files')
+
+    def find(self, path):
+        return self.assets.get(path)
+
+    def send(self, cl, asset, request):
+        path, size, etag, content_type, cache = asset
+        gzip = request.accepts(b'gzip')
+        if not gzip:
+            etag = etag[:-1] + '-identity"'  # the decompressed bytes differ from the gzip file
+        if request.header(b'if-none-match') == etag.encode():
+            self.not_modified += 1
+            cl.send(f"HTTP/1.0 304 Not Modified\r\nETag: {etag}\r\nCache-Control: {cache}\r\n"
+                    f"Vary: Accept-Encoding\r\n\r\n")
+            return
+        if not gzip and deflate is None:
+            cl.send("HTTP/1.0 406 Not Acceptable\r\nVary: Accept-Encoding\r\n\r\n")
+            return
+        header = (f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\nETag: {etag}\r\nCache-Control: {cache}\r\n"
+                  f"Vary: Accept-Encoding\r\n")
+        if gzip:
+            header += f"Content-Encoding: gzip\r\nContent-Length: {size}\r\n"
+        cl.send(header + "\r\n")
+        with open(path, 'rb') as f:
+            source = f if gzip else deflate.DeflateIO(f, deflate.GZIP)
+            while True:
+                count = source.readinto(self.buffer)
+                if not count:
+                    break
+                cl.write(self.view[:count])
+        self.sent += 1
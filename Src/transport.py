@@ -0,0 +1,252 @@
+""" Transports of the RS485 frames below PylontechRS485.
+
+    Rs485Handler talks to an object with the methods of machine.UART:
+    write, flush, any, read(n) and read() (the bytes up to the character
+    timeout), init and deinit. open_transport() returns one for a device:
+
+        0, 1                       machine.UART of channel 0/1 of the waveshare module (pico)
+        'serial:/dev/ttyUSB0'      USB-RS485 adapter with pyserial (Linux, Windows 'serial:COM3')
+        'tcp:192.168.1.50:4196'    raw TCP of a serial to Ethernet gateway
+        'sim:8'                    simulated_uart.SimulatedUart with 8 modules
+
+    MemoryTransport is an in-memory fake without timing which answers with a
+    function, e.g. SimulatedStack.request, or a list of frames. With a host
+    transport the encoder, the decoder and the menu run unchanged on a PC:
+
+        import host_compat
+        from menu import PylontechMenu
+        menu = PylontechMenu(device='serial:/dev/ttyUSB0')
+"""
+
+import time
+try:
+    from machine import UART, Pin
+except ImportError:
+    UART = Pin = None
+    import host_compat
+
+# tx and rx pins of the two channels of the waveshare 2-Channel RS485 module
+UART_PINS = {0: (0, 1), 1: (4, 5)}
+RX_BUFFER = 512  # holds a whole analog answer while another bus is served
+CHAR_TIMEOUT_MS = 2  # end of a frame: no byte for this time
+TCP_CHAR_TIMEOUT_MS = 20  # the gateway forwards the bytes in packets
+
+
+def open_transport(device=0, baud=115200, bits=8, parity=None, stop=1):
+    """ transport of a device number or a 'kind:address' string """
+    if isinstance(device, int):
+        if UART is None:
+            raise ValueError(f'no machine.UART on this host for device {device}, use serial:, tcp: or sim:')
+        tx, rx = UART_PINS[device]
+        uart = UART(device, baud, tx=Pin(tx), rx=Pin(rx), rxbuf=RX_BUFFER)
+        uart.init(baud, bits, parity, stop)
+        return uart
+    kind, _, address = device.partition(':')
+    if kind == 'serial':
+        return SerialTransport(address, baud, bits, parity, stop)
+    if kind == 'tcp':
+        host, _, port = address.rpartition(':')
+        return TcpTransport(host, int(port))
+    if kind == 'sim':
+        from simulated_uart import SimulatedUart, SimulatedStack
+        return SimulatedUart(SimulatedStack(modules=int(address or 3)), baud)
+    raise ValueError(f'unknown transport {device}')
+
+
+class SerialTransport:
+    """ pyserial port with the read semantics of machine.UART """
+
+    def __init__(self, port, baud=115200, bits=8, parity=None, stop=1, char_timeout_ms=CHAR_TIMEOUT_MS):
+        import serial  # only needed on a host with a USB adapter
+        self.serial = serial
+        self.char_timeout = char_timeout_ms / 1000
+        self.port = serial.Serial(port, timeout=self.char_timeout)
+        self.init(baud, bits, parity, stop)
+
+    def init(self, baud=115200, bits=8, parity=None, stop=1):
+        self.port.baudrate = baud
+        self.port.bytesize = bits
+        self.port.parity = {None: self.serial.PARITY_NONE, 0: self.serial.PARITY_EVEN,
+                            1: self.serial.PARITY_ODD}[parity]
+        self.port.stopbits = stop
+        self.port.reset_input_buffer()
+
+    def write(self, data):
+        return self.port.write(data)
+
+    def flush(self):
+        self.port.flush()
+
+    def any(self):
+        return self.port.in_waiting
+
+    def read(self, n=None):
+        """ n bytes, or without n the bytes until no byte came for the character timeout """
+        if n is not None:
+            return self.port.read(n)
+        data = self.port.read(max(self.port.in_waiting, 1))
+        while data:
+            chunk = self.port.read(max(self.port.in_waiting, 1))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def deinit(self):
+        self.port.close()
+
+
+class TcpTransport:
+    """ raw TCP connection to a serial to Ethernet gateway (transparent mode) """
+
+    def __init__(self, host, port, char_timeout_ms=TCP_CHAR_TIMEOUT_MS, connect_timeout=5.0, end=b'\r'):
+        """ end  last byte of a frame, read() returns without waiting for the character timeout """
+        self.host = host
+        self.port = port
+        self.char_timeout_ms = char_timeout_ms
+        self.connect_timeout = connect_timeout
+        self.end = end[0]
+        self.sock = None
+        self.rx = bytearray()
+        self.reconnects = 0
+        self.connect()
+
+    def connect(self):
+        import socket
+        self.deinit()
+        self.sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        self.sock.setblocking(False)
+        self.rx = bytearray()
+
+    def init(self, *args, **kwargs):
+        """ reinit of the UART: a new connection """
+        self.reconnects += 1
+        self.connect()
+
+    def write(self, data):
+        self.rx = bytearray()  # bytes of an old answer would precede the new one
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.sock.setblocking(False)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def receive(self):
+        """ moves the bytes received by the socket into rx, False if there were none """
+        try:
+            chunk = self.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return False
+        if not chunk:
+            raise OSError(f'{self.host}:{self.port} closed the connection')
+        self.rx += chunk
+        return True
+
+    def any(self):
+        self.receive()
+        return len(self.rx)
+
+    def read(self, n=None):
+        """ n bytes, or without n the bytes until the end of a frame or no byte came for the character timeout """
+        idle = time.ticks_ms()
+        while n is None or len(self.rx) < n:
+            if n is None and self.rx and self.rx[-1] == self.end:
+                break
+            if self.receive():
+                idle = time.ticks_ms()
+            elif time.ticks_diff(time.ticks_ms(), idle) >= self.char_timeout_ms:
+                break
+            else:
+                time.sleep_ms(1)
+        if n is None:
+            n = len(self.rx)
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def deinit(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class MemoryTransport:
+    """ in-memory fake: each written frame is answered at once.
+        answer is a function frame -> answer frame or None, or a list of answer frames in order
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.rx = b''
+        self.requests = 0
+        self.last_request = None
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        data = bytes(data)
+        self.requests += 1
+        self.last_request = data
+        if callable(self.answer):
+            self.rx = self.answer(data) or b''
+        else:
+            self.rx = self.answer.pop(0) if self.answer else b''
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n=None):
+        if n is None:
+            n = len(self.rx)
+        data = self.rx[:n]
+        self.rx = self.rx[n:]
+        return data
+
+    def deinit(self):
+        self.rx = b''
+
+
+if __name__ == '__main__':
+    # the same menu over the in-memory fake and over TCP to a local gateway stand-in
+    import socket
+    import _thread
+    from simulated_uart import SimulatedStack
+    from pylontech_base import PylontechRS485
+    from menu import PylontechMenu
+
+    def gateway(server, stack):
+        """ a serial to Ethernet gateway with the simulated stack on its RS485 side """
+        connection, _ = server.accept()
+        while True:
+            frame = b''
+            while not frame.endswith(b'\r'):
+                chunk = connection.recv(256)
+                if not chunk:
+                    return
+                frame += chunk
+            answer = stack.request(frame)
+            if answer:
+                connection.sendall(answer)
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    _thread.start_new_thread(gateway, (server, SimulatedStack(modules=8)))
+    transports = (('memory', MemoryTransport(SimulatedStack(modules=8).request)),
+                  ('tcp', open_transport(f'tcp:127.0.0.1:{server.getsockname()[1]}')))
+    for name, transport in transports:
+        menu = PylontechMenu(8, pylon=PylontechRS485(uart=transport), energy=False)
+        start = time.ticks_ms()
+        for _ in range(10):
+            result = menu.update()
+        duration = time.ticks_diff(time.ticks_ms(), start)
+        print(f"{name}: 10 polls of 8 modules in {duration} ms, {result['Calculated']['Remaining_%']} %")
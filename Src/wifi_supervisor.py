@@ -0,0 +1,232 @@
+""" Supervision of the Wi-Fi connection without blocking.
+
+    WifiSupervisor.step() is called in the loop of the web server, it never
+    waits: it checks the link status, sends a ping to the router and looks
+    for the answer with select on the next steps, and reconnects with an
+    exponential backoff when the link is lost. With join=True it starts
+    the first association itself, so a failed first attempt is retried with
+    the same backoff. It replaces the heartbeat timer of wlan, which blocked
+    the interpreter during the ping.
+"""
+
+import time
+import struct
+import socket
+import select
+from collections import OrderedDict as Dict
+from checksum import inet_checksum
+from retry_policy import RetryPolicy
+from wlan import LINK_UP, led_off
+import logging
+logger = logging.getLogger('wifi', 'wifi.log')
+logger.setLevel(logging.INFO)
+
+UP = 'up'
+PROBING = 'probing'
+DOWN = 'down'
+JOINING = 'joining'
+
+CHECK_INTERVAL_MS = 60000
+RETRY_INTERVAL_MS = 5000
+PING_TIMEOUT_MS = 1000
+JOIN_TIMEOUT_MS = 10000
+MAX_MISSES = 3  # lost pings in a row until the link counts as lost
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = '!BBHHh'
+IP_HEADER_SIZE = 20
+
+
+class Pinger:
+    """ one ICMP echo request at a time on a non-blocking raw socket """
+
+    def __init__(self, size=32):
+        self.size = size
+        self.id = time.ticks_ms() & 0xffff
+        self.seq = 0
+        self.sock = None
+        self.poller = None
+        self.sent_us = 0
+
+    def send(self, host):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, 1)
+            self.sock.setblocking(False)
+            self.poller = select.poll()
+            self.poller.register(self.sock, select.POLLIN)
+        self.seq = (self.seq + 1) & 0x7fff
+        packet = bytearray(struct.pack(ICMP_HEADER, ICMP_ECHO_REQUEST, 0, 0, self.id, self.seq) + b'Q' * (self.size - 8))
+        struct.pack_into('!H', packet, 2, inet_checksum(packet))
+        address = socket.getaddrinfo(host, 1)[0][-1]
+        self.sent_us = time.ticks_us()
+        self.sock.sendto(packet, address)
+
+    def poll(self):
+        """ round trip time in ms of the answer to the last request or None if it did not arrive yet """
+        while self.poller.poll(0):
+            answer = self.sock.recv(256)
+            if len(answer) < IP_HEADER_SIZE + 8:
+                continue
+            kind, code, chksum, id, seq = struct.unpack_from(ICMP_HEADER, answer, IP_HEADER_SIZE)
+            if kind == ICMP_ECHO_REPLY and id == self.id and seq == self.seq:
+                return time.ticks_diff(time.ticks_us(), self.sent_us) / 1000
+        return None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class WifiSupervisor:
+    """ monitors the link of a wlan.Wifi, one short step per call """
+
+    def __init__(self, wifi, host=None, check_ms=CHECK_INTERVAL_MS, ping_timeout_ms=PING_TIMEOUT_MS, join=False):
+        """ host to ping, None pings the router; join starts the association of a link which is not up """
+        self.wifi = wifi
+        self.host = host
+        self.check_ms = check_ms
+        self.ping_timeout_ms = ping_timeout_ms
+        self.backoff = RetryPolicy(base_delay_ms=2000, max_delay_ms=120000)
+        self.pinger = Pinger()
+        self.state = UP if wifi.get_status() == LINK_UP else DOWN
+        self.since = time.ticks_ms()
+        self.due = self.since
+        self.attempt = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.pings = 0
+        self.lost = 0
+        self.received = 0
+        self.rtt_ms = None
+        self.rtt_total_ms = 0
+        self.rtt_max_ms = 0
+        self.rssi = None
+        self.last_error = None
+        if join and self.state == DOWN:
+            self.wifi.begin_connect()
+            self.state = JOINING
+
+    def connected(self):
+        return self.state in (UP, PROBING)
+
+    def set_state(self, state, due_ms=0):
+        logger.debug(f'{self.state} -> {state}')
+        self.state = state
+        self.since = time.ticks_ms()
+        self.due = time.ticks_add(self.since, due_ms)
+
+    def is_due(self):
+        return time.ticks_diff(time.ticks_ms(), self.due) >= 0
+
+    def elapsed_ms(self):
+        return time.ticks_diff(time.ticks_ms(), self.since)
+
+    def step(self):
+        try:
+            if self.state == UP:
+                self.step_up()
+            elif self.state == PROBING:
+                self.step_probing()
+            elif self.state == DOWN:
+                self.step_down()
+            elif self.state == JOINING:
+                self.step_joining()
+        except OSError as ex:
+            self.last_error = str(ex)
+            logger.warning(f'{self.state}: {ex}')
+            self.pinger.close()
+            if self.state == PROBING:
+                self.ping_lost()
+            elif self.state == JOINING:
+                self.join_failed()
+
+    def step_up(self):
+        if self.wifi.get_status() != LINK_UP:
+            self.link_lost('link ' + str(self.wifi.link_status(self.wifi.get_status())))
+        elif self.is_due():
+            self.rssi = self.wifi.wlan.status('rssi')
+            self.set_state(PROBING)
+            self.pings += 1
+            self.pinger.send(self.host or self.wifi.get_router())
+
+    def step_probing(self):
+        rtt = self.pinger.poll()
+        if rtt is not None:
+            self.misses = 0
+            self.received += 1
+            self.rtt_ms = rtt
+            self.rtt_total_ms += rtt
+            if rtt > self.rtt_max_ms:
+                self.rtt_max_ms = rtt
+            self.set_state(UP, self.check_ms)
+        elif self.elapsed_ms() > self.ping_timeout_ms:
+            self.ping_lost()
+
+    def ping_lost(self):
+        self.lost += 1
+        self.misses += 1
+        if self.misses >= MAX_MISSES:
+            self.link_lost(f'{self.misses} pings lost')
+        else:
+            self.set_state(UP, RETRY_INTERVAL_MS)
+
+    def link_lost(self, reason):
+        logger.warning('connection lost: ' + reason)
+        led_off()
+        self.last_error = reason
+        self.misses = 0
+        self.pinger.close()
+        self.set_state(DOWN)
+
+    def step_down(self):
+        if self.is_due():
+            self.reconnects += 1
+            logger.info(f'reconnect {self.reconnects}')
+            self.wifi.reconnect()
+            self.set_state(JOINING)
+
+    def step_joining(self):
+        status = self.wifi.get_status()
+        if status == LINK_UP:
+            self.wifi.on_connected()
+            self.attempt = 0
+            self.set_state(UP)
+        elif status < 0 or self.elapsed_ms() > JOIN_TIMEOUT_MS:
+            self.last_error = str(self.wifi.link_status(status))
+            self.join_failed()
+
+    def join_failed(self):
+        delay = self.backoff.delay_ms(self.attempt)
+        self.attempt += 1
+        logger.warning(f'reconnect failed: {self.last_error}, next in {delay} ms')
+        self.set_state(DOWN, delay)
+
+    def get_metrics(self):
+        """ link quality for the API """
+        metrics = Dict()
+        metrics['state'] = self.state
+        metrics['state_ms'] = self.elapsed_ms()
+        metrics['rssi'] = self.rssi
+        metrics['reconnects'] = self.reconnects
+        metrics['pings'] = self.pings
+        metrics['lost'] = self.lost
+        metrics['rtt_ms'] = self.rtt_ms
+        metrics['mean_rtt_ms'] = self.rtt_total_ms / self.received if self.received else None
+        metrics['max_rtt_ms'] = self.rtt_max_ms
+        metrics['last_error'] = self.last_error
+        return metrics
+
+
+if __name__ == '__main__':
+    from wlan import Wifi
+    wifi = Wifi()
+    supervisor = WifiSupervisor(wifi, check_ms=10000)
+    last = time.ticks_ms()
+    while True:
+        supervisor.step()
+        if time.ticks_diff(time.ticks_ms(), last) > 10000:
+            last = time.ticks_ms()
+            print(supervisor.get_metrics())
+        time.sleep_ms(10)
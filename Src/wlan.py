@@ -4,7 +4,7 @@ logger = logging.getLogger("wlan","net.log")
 #logger = logging.getLogger("wlan")
 logger.setLevel(logging.INFO)
 
-from machine import UART, Pin, RTC, Timer
+from machine import UART, Pin, RTC
 from machine import reset
 import time
 import network
@@ -12,7 +12,7 @@ import socket
 import rp2
 import sys
 import struct
-import ubinascii
+from checksum import inet_checksum
 
 SSID = "LocalNetwork"
 PASSWORD = "PASSWORD"
@@ -28,14 +28,8 @@ LINK_BADAUTH = -3
 # set the wlan to your country, here Germany
 rp2.country("DE")
 
-HEARTBEAT = False
-
 rtc = RTC()
 
-counter = 0
-period = 60
-router = "192.168.20.1"
-
 # use onboard LED for a active internet connection
 def led_on():
     Pin("LED", Pin.OUT).on()
@@ -48,22 +42,12 @@ def led_off():
 # copyright (c) 2018 Shawwwn <shawwwn1@gmail.com>
 # License: MIT
 
-# Internet Checksum Algorithm
+# Internet Checksum Algorithm, see checksum.inet_checksum
 # Author: Olav Morken
 # https://github.com/olavmrk/python-ping/blob/master/ping.py
 # @data: bytes
 def checksum(data):
-    if len(data) & 0x1: # Odd number of bytes
-        data += b'\0'
-    cs = 0
-    for pos in range(0, len(data), 2):
-        b1 = data[pos]
-        b2 = data[pos + 1]
-        cs += (b1 << 8) + b2
-    while cs >= 0x10000:
-        cs = (cs & 0xffff) + (cs >> 16)
-    cs = ~cs & 0xffff
-    return cs
+    return inet_checksum(data)
 
 def ping(host, count=4, timeout=5000, interval=30, quiet=False, size=64):
     import utime
@@ -152,46 +136,20 @@ def ping(host, count=4, timeout=5000, interval=30, quiet=False, size=64):
     logger.info("%u packets transmitted, %u packets received" % (n_trans, n_recv))
     return (n_trans, n_recv)
 
-def set_router(ip):
-    global router
-    router = ip
-
-""" fuction that test every minute if a connection with the router on the local net exist,
-    if not tries to reconnect. Still buggy, do not use it unless trying to make the program more robust
-    Not usefull during development of the functionality
-"""
-start = time.ticks_ms()
-def alive(t):
-    global start
-    global counter
-    delta = time.ticks_diff(time.ticks_ms(), start)/1000
-    counter += 1
-    logger.debug(counter)
-    if counter % 60 == 0:
-        logger.info(f"alive {delta}")
-        freq = ping(router,quiet=False)
-        if freq[1]>2: # 3 packets received
-            return
-        else: 
-            led_off()
-            status = wlan.get_status()
-            if status < 0:
-                raise OSError("wifi connection lost")
-            elif status < 3:
-                wlan.reconnect()
-            else:
-                raise RuntimeError("Contact with router lost")
-    return
-
 class Wifi:
-    def __init__(self, ssid=SSID, password=PASSWORD):
+    def __init__(self, ssid=SSID, password=PASSWORD, connect=True):
+        """ connect=False only activates the interface, the connection is then
+            started with begin_connect() and checked with connect_state() """
+        self.ssid = ssid
+        self.password = password
         self.wlan = network.WLAN(network.STA_IF)
         self.wlan.active(True)
         self.wlan.config(pm=0xA11140)  # Disable power-save mode
-        self.connect(ssid, password)
+        if connect:
+            self.connect(ssid, password)
 
     def connect(self, ssid, password):
-        self.wlan.connect(ssid, password)
+        self.begin_connect(ssid, password)
         max_wait = 10
         while max_wait > 0:
             if self.wlan.status() < 0 or self.wlan.status() >= 3:
@@ -201,25 +159,43 @@ class Wifi:
             logger.info("waiting for connection...")
             time.sleep(1)
             led_off()
-
-        # Handle connection error
+        self.connect_state(final=True)
+        self.init_rtc()
+
+    def begin_connect(self, ssid=None, password=None):
+        """ starts the association and returns immediately """
+        if ssid is not None:
+            self.ssid = ssid
+            self.password = password
+        self.wlan.connect(self.ssid, self.password)
+
+    def connect_state(self, final=False):
+        """ None while joining, True when connected,
+            raises RuntimeError if the connection failed (or is not up when final)
+        """
         status = self.wlan.status()
-        if status != LINK_UP:
+        if status == LINK_UP:
+            self.on_connected()
+            return True
+        if status < 0 or final:
+            # Handle connection error
             led_off()
             problem = self.link_status(status)
             raise RuntimeError(f"network connection failed {problem}")
-        else:
-            led_on()
-            logger.info("connected")
-            self.status = self.wlan.ifconfig()
-            self.router = self.status[3]
-            for x in range(len(self.status)):
-                logger.info("ip = " + self.status[x])
-            self.init_rtc()
+        return None
+
+    def on_connected(self):
+        led_on()
+        logger.info("connected")
+        self.status = self.wlan.ifconfig()
+        self.router = self.status[3]
+        for x in range(len(self.status)):
+            logger.info("ip = " + self.status[x])
 
     def reconnect(self):
-        self.wlan.close()
-        self.wlan.connect(SSID,PASSWORD)
+        """ drops the association and starts a new one, returns immediately """
+        self.wlan.disconnect()
+        self.begin_connect()
 
     def get_ifconfig(self):
         return self.wlan.ifconfig()
@@ -247,25 +223,11 @@ class Wifi:
         elif status == LINK_BADAUTH:
             return "Authentication failed"
 
-    """ This method creates a timer which fires every second a call to alive
-        alive checks if a connection to the local net exists.
-        Still buggy do not switch it on """
-    """ Trying to use the pico watchdog for this in combination with a 'main.py' led to problems.
-        I had to nuke the pico to make available/usable again """
-    def create_heartbeat(self):
-        #set_router(self.get_router())
-        if HEARTBEAT:
-            self.timer = Timer(period=1000, mode=Timer.PERIODIC, callback=lambda t:alive(t))
-            logger.debug('timer created')
-        
-    def stop_heartbeat(self):
-        if HEARTBEAT:
-           self.timer.deinit()
-    
     def request_time(self, addr="1.de.pool.ntp.org"):
         self.sockaddr = socket.getaddrinfo(addr, 123)[0][-1]
         REF_TIME_1970 = 2208988800  # reference time
         self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)  # the server loop uses clock.NtpClient, which does not block
         self.data = b"\x1b" + 47 * b"\0"
         self.client.sendto(self.data, self.sockaddr)
         self.data, self.address = self.client.recvfrom(1024)
@@ -277,8 +239,10 @@ class Wifi:
         return t
 
     def init_rtc(self):
+        self.set_rtc(self.request_time())
+
+    def set_rtc(self, t):
         global rtc
-        t = self.request_time()
         d = time.localtime(t)
         logger.debug(d)
         tup = (d[0],d[1],d[2],d[6],d[3]+1, d[4], d[5], d[7])
@@ -295,18 +259,15 @@ class Wifi:
 if __name__ == "__main__":
     try:
         logger.setLevel(logging.DEBUG)
-        HEARTBEAT =  True
         wlan = Wifi(SSID, PASSWORD)
         d = time.localtime()
         print(f"{d[3]}:{d[4]}:{d[5]} {d[2]}-{d[1]}-{d[0]} weekday {d[6]} yearday {d[7]}")
-        wlan.create_heartbeat()
         #memory.memory_thread()
         while True:
             logger.info('main alive')
             time.sleep(10)
     except KeyboardInterrupt:
         logger.info('KeyboardInterrupt')
-        wlan.stop_heartbeat()
         wlan.disconnect()
         sys.exit(1)
     except Exception as ex: